@@ -177,8 +177,10 @@
   // Opus / WebCodecs state (output)
   var audioDecoder = null, opusFrameTimestamp = 0, codecOpus = false;
   var serverCodec = null;  // 'opus' | 'pcm' | null (null = waiting for codec_info)
+  // Framing v2: header with sequence number / capture timestamp, N frames per message
+  var serverFraming = 1, frameDurationUs = 20000, lastSeq = null, lostFrames = 0;
   // Opus / WebCodecs state (microphone input)
-  var micEncoder = null, micTimestamp = 0, codecOpusMic = false;
+  var micEncoder = null, micTimestamp = 0, codecOpusMic = false, micSeq = 0;
   // WebSocket connection reference counting (shared by audio output and mic input)
   var wsRefCount = 0;
 
@@ -230,6 +232,8 @@
     setSelected(false);
     codecOpus = false;
     serverCodec = null;
+    serverFraming = 1;
+    lastSeq = null;
     opusFrameTimestamp = 0;
     if (audioDecoder) {
       try { audioDecoder.close(); } catch (e) {}
@@ -277,7 +281,7 @@
         if (active) {
           var preferPcm = !window.AudioDecoder;
           console.log('[audio-bar] prefer_pcm=' + preferPcm + ' (AudioDecoder available: ' + !!window.AudioDecoder + ')');
-          try { ws.send(JSON.stringify({action: 'set_audio', enabled: true, prefer_pcm: preferPcm})); } catch (e) {}
+          try { ws.send(JSON.stringify({action: 'set_audio', enabled: true, prefer_pcm: preferPcm, framing: 2})); } catch (e) {}
         }
         // Query recording status
         try { ws.send(JSON.stringify({action: 'recording_status'})); } catch (e) {}
@@ -302,6 +306,9 @@
           var msg;
           try { msg = JSON.parse(event.data); } catch (e) { return; }
           if (msg.event === 'codec_info') {
+            serverFraming = msg.framing || 1;
+            frameDurationUs = Math.round((msg.frame_ms || 20) * 1000);
+            lastSeq = null;
             if (msg.codec === 'pcm') {
               serverCodec = 'pcm';
               console.log('[audio-bar] Server will send PCM (non-secure context mode)');
@@ -311,59 +318,114 @@
             }
             return;
           }
+          if (msg.event === 'silence') {
+            // Server stops sending during silence; on resume, restart the
+            // schedule with a small lead instead of playing into the past
+            if (!msg.active && audioCtx) nextPlayTime = audioCtx.currentTime + 0.03;
+            return;
+          }
+          if (msg.event === 'discontinuity') {
+            // Server capture restarted: same session, but a gap in the audio
+            console.log('[audio-bar] Stream discontinuity, gap ' + msg.gap_ms + 'ms');
+            if (audioCtx) nextPlayTime = audioCtx.currentTime + 0.03;
+            return;
+          }
+          if (msg.event === 'resync') {
+            // Server skipped this client to live after it fell behind; drop
+            // the schedule's backlog too, or the latency just moves here
+            if (audioCtx) nextPlayTime = audioCtx.currentTime + 0.03;
+            return;
+          }
           handleRecordingMessage(event.data);
           return;
         }
         if (!audioCtx) return;
-        if (serverCodec === 'opus' && codecOpus && audioDecoder && audioDecoder.state === 'configured') {
-          // ── Opus path (WebCodecs AudioDecoder) ──────────────────
-          try {
-            audioDecoder.decode(new EncodedAudioChunk({
-              type: 'key',
-              timestamp: opusFrameTimestamp,
-              data: event.data,
-            }));
-            opusFrameTimestamp += 20000; // 20ms per frame in microseconds
-          } catch (e) {
-            console.error('[audio-bar] AudioDecoder.decode error:', e);
-          }
-        } else if (serverCodec === 'pcm') {
-          // ── PCM path (server sent raw PCM, non-secure context) ──
-          var pcmData = event.data;
-          if (pcmData.byteLength % 2 !== 0) {
-            pcmData = pcmData.slice(0, pcmData.byteLength - 1);  // align to 16-bit boundary
-          }
-          var raw = new Int16Array(pcmData);
-          var numFrames = raw.length / CHANNELS;
-          if (numFrames < 1) return;
-          var buffer = audioCtx.createBuffer(CHANNELS, numFrames, SAMPLE_RATE);
-          for (var ch = 0; ch < CHANNELS; ch++) {
-            var channelData = buffer.getChannelData(ch);
-            for (var i = 0; i < numFrames; i++) {
-              channelData[i] = raw[i * CHANNELS + ch] / 32768.0;
-            }
-          }
-          var source = audioCtx.createBufferSource();
-          source.buffer = buffer;
-          source.connect(audioCtx.destination);
-          var now = audioCtx.currentTime;
-          if (nextPlayTime < now) nextPlayTime = now + 0.01;
-          source.start(nextPlayTime);
-          nextPlayTime += buffer.duration;
+        if (serverFraming === 2) {
+          var frames = parseFramingV2(event.data);
+          for (var f = 0; f < frames.length; f++) playFrame(frames[f].data);
         } else {
-          // serverCodec === null or opus but AudioDecoder not ready → discard
-          return;
+          playFrame(event.data);
         }
       };
     } else {
       // Reusing existing connection, just tell server to start pushing
       console.log('[audio-bar] Reusing existing WebSocket connection');
-      try { ws.send(JSON.stringify({action: 'set_audio', enabled: true})); } catch (e) {}
+      try { ws.send(JSON.stringify({action: 'set_audio', enabled: true, framing: 2})); } catch (e) {}
     }
 
     wsRefCount++;
   }
 
+  // ── Framing v2: 16-byte header + length-prefixed frames ──
+  // header: version, tier, frame count, duration (0.5ms units),
+  //         uint32 seq of first frame, uint64 capture time (us)
+  function parseFramingV2(buf) {
+    var view = new DataView(buf);
+    var count = view.getUint8(2);
+    var seq = view.getUint32(4);
+    var last = (seq + count - 1) >>> 0;
+    if (lastSeq !== null && ((lastSeq - seq) >>> 0) < 0x80000000) {
+      // seq <= lastSeq: a replay or prebuffer burst of frames already
+      // accounted for, not a gap; only the part past lastSeq moves it on
+      if (((last - lastSeq) >>> 0) < 0x80000000) lastSeq = last;
+    } else {
+      if (lastSeq !== null && seq !== ((lastSeq + 1) >>> 0)) {
+        // Gap: frames dropped by the server for a lagging link
+        lostFrames += (seq - lastSeq - 1) >>> 0;
+        console.warn('[audio-bar] sequence gap, ' + lostFrames + ' frames lost so far');
+      }
+      lastSeq = last;
+    }
+    var frames = [];
+    var off = 16;
+    for (var i = 0; i < count && off + 2 <= buf.byteLength; i++) {
+      var len = view.getUint16(off);
+      frames.push({ seq: (seq + i) >>> 0, data: buf.slice(off + 2, off + 2 + len) });
+      off += 2 + len;
+    }
+    return frames;
+  }
+
+  function playFrame(data) {
+    if (serverCodec === 'opus' && codecOpus && audioDecoder && audioDecoder.state === 'configured') {
+      // ── Opus path (WebCodecs AudioDecoder) ──────────────────
+      try {
+        audioDecoder.decode(new EncodedAudioChunk({
+          type: 'key',
+          timestamp: opusFrameTimestamp,
+          data: data,
+        }));
+        opusFrameTimestamp += frameDurationUs;
+      } catch (e) {
+        console.error('[audio-bar] AudioDecoder.decode error:', e);
+      }
+    } else if (serverCodec === 'pcm') {
+      // ── PCM path (server sent raw PCM, non-secure context) ──
+      var pcmData = data;
+      if (pcmData.byteLength % 2 !== 0) {
+        pcmData = pcmData.slice(0, pcmData.byteLength - 1);  // align to 16-bit boundary
+      }
+      var raw = new Int16Array(pcmData);
+      var numFrames = raw.length / CHANNELS;
+      if (numFrames < 1) return;
+      var buffer = audioCtx.createBuffer(CHANNELS, numFrames, SAMPLE_RATE);
+      for (var ch = 0; ch < CHANNELS; ch++) {
+        var channelData = buffer.getChannelData(ch);
+        for (var i = 0; i < numFrames; i++) {
+          channelData[i] = raw[i * CHANNELS + ch] / 32768.0;
+        }
+      }
+      var source = audioCtx.createBufferSource();
+      source.buffer = buffer;
+      source.connect(audioCtx.destination);
+      var now = audioCtx.currentTime;
+      if (nextPlayTime < now) nextPlayTime = now + 0.01;
+      source.start(nextPlayTime);
+      nextPlayTime += buffer.duration;
+    }
+    // serverCodec === null or opus but AudioDecoder not ready → discard
+  }
+
   // ── Opus decoder via WebCodecs AudioDecoder ──────────────
   function initOpusDecoder(codecInfo) {
     if (!window.AudioDecoder) {
@@ -453,15 +515,19 @@
     console.log('[audio-bar] Initialising Opus encoder for mic upload: ' + SAMPLE_RATE + 'Hz ' + CHANNELS + 'ch');
 
     micTimestamp = 0;
+    micSeq = 0;
 
     micEncoder = new AudioEncoder({
       output: function(encodedChunk) {
         if (ws && ws.readyState === WebSocket.OPEN) {
           try {
-            // EncodedAudioChunk: use copyTo() to get ArrayBuffer
+            // 4-byte big-endian sequence number + Opus packet (framing: 'seq'),
+            // lets the server reorder, recover with FEC and conceal losses
             var size = encodedChunk.byteLength;
-            var buffer = new ArrayBuffer(size);
-            encodedChunk.copyTo(buffer);
+            var buffer = new ArrayBuffer(4 + size);
+            new DataView(buffer).setUint32(0, micSeq);
+            micSeq = (micSeq + 1) >>> 0;
+            encodedChunk.copyTo(new Uint8Array(buffer, 4));
             ws.send(buffer);
           } catch (e) {
             console.error('[audio-bar] mic Opus send error:', e);
@@ -478,7 +544,10 @@
       codec: 'opus',
       sampleRate: SAMPLE_RATE,
       numberOfChannels: CHANNELS,
-      bitrate: 64000  // 64 Kbps
+      bitrate: 64000,  // 64 Kbps
+      // 20ms frames to match the server decoder; in-band FEC lets the
+      // server rebuild a lost frame from the next packet
+      opus: { frameDuration: 20000, useinbandfec: true, packetlossperc: 10 }
     });
     codecOpusMic = true;
     console.log('[audio-bar] ✅ Opus encoder ready for mic');
@@ -594,6 +663,7 @@
             ws.send(JSON.stringify({
               action: 'mic_codec',
               codec: 'opus',
+              framing: 'seq',
               sample_rate: SAMPLE_RATE,
               channels: CHANNELS,
               bitrate: 64000
@@ -641,6 +711,7 @@
           ws.send(JSON.stringify({
             action: 'mic_codec',
             codec: 'opus',
+            framing: 'seq',
             sample_rate: SAMPLE_RATE,
             channels: CHANNELS,
             bitrate: 64000
@@ -0,0 +1,593 @@
+#!/usr/bin/env python3
+"""Load test for audio-ws-server.py without audio hardware.
+
+Starts the server with AUDIO_BACKEND=synthetic (or attaches to a running one
+with --url), connects N listeners and M mic clients, and reports throughput,
+capture-to-receive latency percentiles, dropped frames and server CPU.
+
+Listeners use framing v2, so every frame carries its sequence number and
+capture timestamp: latency is measured against the server's capture clock
+(same host) and drops are sequence gaps plus frames the server discarded.
+--bandwidth and --jitter slow down listener reads to emulate poor links;
+socket and library buffers absorb the first few tens of KB, so a throttled
+run needs a --duration long enough for backpressure to reach the server.
+A --bandwidth below the tier's bitrate must get listeners resynced (or, with
+--auto, stepped down a tier); the bench fails if it doesn't. It also fails
+when a tier switch right after a replay leaves a listener without audio.
+
+With --backend pulse / pulse-simple the server captures from a real
+PulseAudio null-sink instead, and a probe plays a click into that sink every
+half second through pacat: the time until the click shows up in a PCM
+listener is the end-to-end latency (including the probe's own ~10ms pacat
+buffer, the same for every backend). The sink should otherwise be quiet.
+Several comma-separated backends are run one after another and compared;
+server CPU includes its child processes (pacat, fan-out workers). --workers
+takes a comma-separated list of AUDIO_WORKERS values to compare the same way.
+
+    scripts/audio-ws-bench.py --listeners 50 --mics 2 --duration 20
+    scripts/audio-ws-bench.py --listeners 20 --bandwidth 48 --jitter 30
+    scripts/audio-ws-bench.py --backend pulse,pulse-simple --listeners 10
+    scripts/audio-ws-bench.py --listeners 300 --workers 0,2,4
+    scripts/audio-ws-bench.py --listeners 20 --relay 8
+
+--relay N starts N synthetic servers as stand-ins for containers plus one in
+relay mode (AUDIO_RELAY_UPSTREAMS), and has every listener play all N: once
+with a connection per container, once through the relay.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import websockets
+
+HEADER = struct.Struct("!BBBBIQ")  # framing v2, see audio-ws-server.py
+RELAY_HEADER = struct.Struct("!H")  # relay mode channel
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio-ws-server.py")
+SAMPLE_RATE = 48000
+MIC_FRAME = 960  # 20ms
+PULSE_SINK = "webcode_null"
+PROBE_INTERVAL = 0.5
+PROBE_PEAK = 10000
+
+
+class ListenerStats:
+    def __init__(self):
+        self.last_seq = None
+        self.tier = None
+        self.reset()
+
+    def reset(self):
+        """Forget warm-up traffic but keep tracking sequence numbers."""
+        self.messages = 0
+        self.frames = 0
+        self.bytes = 0
+        self.lost = 0
+        self.resyncs = 0
+        self.switches = 0
+        self.latencies = []
+
+    def record(self, message, now_us, offset=0):
+        """Account one framing v2 message starting at offset."""
+        _, _, count, _, seq, ts_us = HEADER.unpack_from(message, offset)
+        last = (seq + count - 1) & 0xFFFFFFFF
+        if self.last_seq is not None and (self.last_seq - seq) & 0xFFFFFFFF < 0x80000000:
+            # A replayed or prebuffered frame already seen: not a gap
+            if (last - self.last_seq) & 0xFFFFFFFF < 0x80000000:
+                self.last_seq = last
+        else:
+            if self.last_seq is not None:
+                self.lost += (seq - self.last_seq - 1) & 0xFFFFFFFF
+            self.last_seq = last
+        self.messages += 1
+        self.frames += count
+        self.bytes += len(message)
+        self.latencies.append((now_us - ts_us) / 1000)
+
+
+async def small_socket(url):
+    """Connected socket with a small receive buffer for a listener.
+
+    A throttled reader then pushes back on the server within a few frames
+    instead of hiding in loopback buffers.
+    """
+    host, port = url.split("//", 1)[1].split("/", 1)[0].rsplit(":", 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (host, int(port)))
+    return sock
+
+
+async def throttle(args, size):
+    delay = 0.0
+    if args.bandwidth:
+        delay += size * 8 / (args.bandwidth * 1000)
+    if args.jitter:
+        delay += random.uniform(0, args.jitter / 1000)
+    if delay:
+        await asyncio.sleep(delay)
+
+
+async def listener(url, args, stats, stop):
+    """One playback client; reads are throttled to --bandwidth kbit/s."""
+    async with websockets.connect(url, sock=await small_socket(url), max_queue=4) as ws:
+        await ws.send(json.dumps({
+            "action": "set_audio", "enabled": True, "tier": args.tier,
+            "auto": args.auto, "framing": 2, "frame_ms": args.frame_ms, "batch": args.batch,
+        }))
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            now_us = time.time() * 1_000_000
+            if isinstance(message, str):
+                event = json.loads(message)
+                if event.get("event") == "resync":
+                    stats.resyncs += 1
+                elif event.get("event") == "codec_info" and stats.tier not in (None, event.get("tier")):
+                    stats.switches += 1
+                if event.get("event") == "codec_info":
+                    # A new encoder stream numbers its frames on its own
+                    stats.tier = event.get("tier")
+                    stats.last_seq = None
+                continue
+            stats.record(message, now_us)
+            await throttle(args, len(message))
+
+
+async def relay_listener(url, args, stats, stop):
+    """One relay client subscribed to several containers at once.
+
+    stats maps container ID -> ListenerStats; relayed messages are a 2-byte
+    channel followed by the container's framing v2 message.
+    """
+    channels = {}
+    async with websockets.connect(url, sock=await small_socket(url), max_queue=4) as ws:
+        for container in stats:
+            await ws.send(json.dumps({"action": "subscribe", "container": container, "tier": args.tier}))
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            now_us = time.time() * 1_000_000
+            if isinstance(message, str):
+                event = json.loads(message)
+                if event.get("event") == "subscribed":
+                    channels[event["channel"]] = stats[event["container"]]
+                elif event.get("event") == "resync":
+                    stats[event["container"]].resyncs += 1
+                continue
+            (channel,) = RELAY_HEADER.unpack_from(message)
+            if channel in channels:
+                channels[channel].record(message, now_us, RELAY_HEADER.size)
+            await throttle(args, len(message))
+
+
+async def mic_client(url, args, stop):
+    """One mic uplink sending 20ms PCM frames (tone) with --jitter."""
+    t = [i / SAMPLE_RATE for i in range(MIC_FRAME)]
+    frame = b"".join(struct.pack("<hh", s, s) for s in
+                     (int(3000 * math.sin(2 * math.pi * 330 * x)) for x in t))
+    sent = 0
+    async with websockets.connect(url) as ws:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while not stop.is_set():
+            next_tick += MIC_FRAME / SAMPLE_RATE
+            wait = next_tick - loop.time()
+            if args.jitter:
+                wait += random.uniform(0, args.jitter / 1000)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await ws.send(frame)
+            sent += 1
+    return sent
+
+
+async def server_metrics(url):
+    try:
+        async with websockets.connect(url) as ws:
+            await ws.send(json.dumps({"action": "metrics"}))
+            while True:
+                message = await asyncio.wait_for(ws.recv(), timeout=5)
+                if isinstance(message, str) and json.loads(message).get("event") == "metrics":
+                    return json.loads(message)
+    except Exception as e:
+        print(f"[bench] metrics unavailable: {e}", file=sys.stderr)
+        return None
+
+
+async def replay_switch(url, args):
+    """Replay the ring, then switch tier: frames received in the second after
+    the switch (the switch discards the replay, so live audio resumes)."""
+    tier = "opus-48" if args.tier != "opus-48" else "opus-64"
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"action": "set_audio", "enabled": True, "tier": args.tier,
+                                  "auto": False, "framing": 2}))
+        while not isinstance(await asyncio.wait_for(ws.recv(), timeout=5), bytes):
+            pass
+        await ws.send(json.dumps({"action": "replay"}))
+        await ws.send(json.dumps({"action": "set_tier", "tier": tier, "auto": False}))
+        while True:
+            message = await asyncio.wait_for(ws.recv(), timeout=5)
+            if isinstance(message, str) and json.loads(message).get("tier") == tier:
+                break
+        frames = 0
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            frames += isinstance(message, bytes)
+        return frames
+
+
+class Probe:
+    """Clicks played into the null-sink and detected in a PCM listener."""
+
+    def __init__(self):
+        self.sent = []  # wall-clock time each click was written
+        self.latencies = []
+
+
+async def probe_player(probe, stop):
+    """Feed silence with a 20ms click every PROBE_INTERVAL into the sink."""
+    proc = await asyncio.create_subprocess_exec(
+        "pacat", "--playback", "-d", PULSE_SINK, "--format=s16le",
+        f"--rate={SAMPLE_RATE}", "--channels=2", "--latency-msec=10",
+        stdin=asyncio.subprocess.PIPE)
+    quiet = bytes(MIC_FRAME * 4)
+    click = struct.pack("<hh", 20000, 20000) * MIC_FRAME
+    every = round(PROBE_INTERVAL * SAMPLE_RATE / MIC_FRAME)
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    n = 0
+    try:
+        while not stop.is_set():
+            n += 1
+            if n % every == 0:
+                probe.sent.append(time.time())
+                proc.stdin.write(click)
+            else:
+                proc.stdin.write(quiet)
+            await proc.stdin.drain()
+            next_tick += MIC_FRAME / SAMPLE_RATE
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+    finally:
+        if proc.returncode is None:
+            proc.terminate()
+        await proc.wait()
+
+
+async def probe_listener(url, probe, stop):
+    """PCM listener that timestamps the onset of each click."""
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"action": "set_audio", "enabled": True, "tier": "pcm",
+                                  "auto": False, "framing": 2}))
+        armed = True
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            now = time.time()
+            if isinstance(message, str):
+                continue
+            offset = HEADER.size
+            for _ in range(message[2]):
+                (size,) = struct.unpack_from("!H", message, offset)
+                left = memoryview(message)[offset + 2:offset + 2 + size].cast("h")[::2]
+                offset += 2 + size
+                hits = [i for i, v in enumerate(left) if abs(v) > PROBE_PEAK]
+                if not hits:
+                    armed = True
+                    continue
+                if armed and probe.sent:
+                    # The onset sample was captured this long before the frame ended
+                    onset = now - (len(left) - hits[0]) / SAMPLE_RATE
+                    sent = [t for t in probe.sent if t <= now]
+                    if sent:
+                        probe.latencies.append((onset - sent[-1]) * 1000)
+                armed = False
+
+
+def cpu_seconds(pid):
+    """CPU seconds of pid and its live descendants (pacat children)."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            parents[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+    tree = {pid}
+    changed = True
+    while changed:
+        changed = False
+        for child, (ppid, _) in parents.items():
+            if ppid in tree and child not in tree:
+                tree.add(child)
+                changed = True
+    ticks = sum(parents[p][1] for p in tree if p in parents)
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def start_server(args, backend, workers=0, port=None, relay=""):
+    port = port or args.port
+    env = {
+        **os.environ,
+        "AUDIO_WORKERS": str(workers),
+        "AUDIO_BACKEND": backend,
+        "AUDIO_SYNTH_SOURCE": args.source,
+        "AUDIO_PORT": str(port),
+        "AUDIO_METRICS_PORT": "0",
+        "AUDIO_IDLE_GRACE": "0",
+        "AUDIO_RELAY_UPSTREAMS": relay,
+    }
+    proc = subprocess.Popen([sys.executable, SERVER], env=env,
+                            stdout=None if args.verbose else subprocess.DEVNULL,
+                            stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"[bench] server exited with {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                if workers:
+                    time.sleep(1)  # let every worker bind before clients spread out
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    sys.exit("[bench] server did not start listening")
+
+
+async def run(args, url, pid, backend, label=None, containers=None):
+    """Measure one configuration. With containers ({ID: URL}) every listener
+    plays all of them: through the relay at url, or with one connection per
+    container when url is None; mic clients connect to the containers
+    directly, round-robin."""
+    stop = asyncio.Event()
+    pids = pid if isinstance(pid, list) else [pid] if pid else []
+    if containers is None:
+        stats = [ListenerStats() for _ in range(args.listeners)]
+        tasks = [asyncio.create_task(listener(url, args, s, stop)) for s in stats]
+    else:
+        groups = [{c: ListenerStats() for c in containers} for _ in range(args.listeners)]
+        stats = [s for group in groups for s in group.values()]
+        if url:
+            tasks = [asyncio.create_task(relay_listener(url, args, group, stop)) for group in groups]
+        else:
+            tasks = [asyncio.create_task(listener(containers[c], args, s, stop))
+                     for group in groups for c, s in group.items()]
+    # The relay doesn't carry the mic uplink: mics talk to the containers
+    mic_urls = [url] if containers is None else list(containers.values())
+    # The containers outlive one run: count their mic frames from here
+    mic_before = [await server_metrics(u) for u in mic_urls] if args.mics and containers else []
+    mics = [asyncio.create_task(mic_client(mic_urls[i % len(mic_urls)], args, stop)) for i in range(args.mics)]
+    probe = Probe() if backend != "synthetic" and not args.no_probe else None
+    probes = []
+    if probe:
+        probes = [asyncio.create_task(probe_player(probe, stop)),
+                  asyncio.create_task(probe_listener(url, probe, stop))]
+
+    await asyncio.sleep(args.warmup)
+    for s in stats:  # measure steady state only
+        s.reset()
+    if probe:
+        probe.latencies.clear()
+    cpu_start = sum(cpu_seconds(p) for p in pids)
+    started = time.monotonic()
+    await asyncio.sleep(args.duration)
+    elapsed = time.monotonic() - started
+    cpu = sum(cpu_seconds(p) for p in pids) - cpu_start if pids else None
+    metrics = await server_metrics(url) if url else None
+    mic_metrics = [await server_metrics(u) for u in mic_urls] if args.mics and containers else []
+    switch_frames = await replay_switch(url, args) if containers is None else None
+    stop.set()
+    results = await asyncio.gather(*tasks, *mics, *probes, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    mic_frames = sum(r for r in results[len(tasks):len(tasks) + len(mics)] if isinstance(r, int))
+
+    latencies = [x for s in stats for x in s.latencies]
+    frames = sum(s.frames for s in stats)
+    report = {
+        "backend": label or backend,
+        "listeners": args.listeners,
+        "mics": args.mics,
+        "tier": args.tier,
+        "frame_ms": args.frame_ms,
+        "batch": args.batch,
+        "duration_s": round(elapsed, 2),
+        "frames_per_s": round(frames / elapsed, 1),
+        "kbit_per_s": round(sum(s.bytes for s in stats) * 8 / elapsed / 1000, 1),
+        "latency_ms": {p: round(percentile(latencies, int(p[1:])) or 0, 2)
+                       for p in ("p50", "p90", "p99")},
+        "latency_max_ms": round(max(latencies, default=0), 2),
+        "lost_frames": sum(s.lost for s in stats),
+        "resyncs": sum(s.resyncs for s in stats),
+        "tier_switches": sum(s.switches for s in stats),
+        "mic_frames_sent": mic_frames,
+        "client_errors": len(errors),
+        "connections": len(tasks),
+    }
+    if switch_frames is not None:
+        report["replay_switch_frames"] = switch_frames
+    if probe:
+        report["e2e_probes"] = len(probe.latencies)
+        if probe.latencies:
+            report["e2e_ms"] = {p: round(percentile(probe.latencies, int(p[1:])), 2)
+                                for p in ("p50", "p90", "p99")}
+    if cpu is not None:
+        report["server_cpu_pct"] = round(100 * cpu / elapsed, 1)
+        report["cpu_pct_per_listener"] = round(100 * cpu / elapsed / max(1, args.listeners), 3)
+    if metrics:
+        counters = metrics["counters"]
+        report["server_frames_dropped"] = counters["frames_dropped"]
+        report["server_mic_frames_in"] = counters["mic_frames_in"]
+        report["server_tiers"] = sorted({c["tier"] for c in metrics["clients"]})
+    if mic_metrics and all(mic_metrics) and all(mic_before):
+        report["server_mic_frames_in"] = sum(m["counters"]["mic_frames_in"] for m in mic_metrics) - \
+            sum(m["counters"]["mic_frames_in"] for m in mic_before)
+    for e in errors[:3]:
+        print(f"[bench] client error: {e!r}", file=sys.stderr)
+    return report
+
+
+def tier_kbps(tier):
+    """Nominal bitrate of a tier name (opus-64 -> 64, pcm -> 1536)."""
+    if tier == "pcm":
+        return SAMPLE_RATE * 2 * 16 / 1000
+    return float(tier.split("-")[1].rstrip("m"))
+
+
+def check_backpressure(args, report):
+    """Listeners on a link slower than their stream have to be resynced or
+    stepped down; otherwise their latency grows without bound."""
+    if not args.bandwidth or args.bandwidth >= tier_kbps(args.tier):
+        return
+    if not report["resyncs"] and not report["tier_switches"]:
+        sys.exit(f"[bench] FAIL: listeners at {args.bandwidth:g} kbit/s fell behind {args.tier} "
+                 f"without a resync or tier switch")
+
+
+def check_replay_switch(report):
+    """A tier switch right after a replay must not leave the listener
+    waiting for the discarded replay to finish."""
+    if report.get("replay_switch_frames") == 0:
+        sys.exit("[bench] FAIL: no audio within 1s of a tier switch after a replay")
+
+
+def print_report(r):
+    lat = r["latency_ms"]
+    print(f"backend={r['backend']} listeners={r['listeners']} mics={r['mics']} tier={r['tier']} "
+          f"frame={r['frame_ms']:g}ms x{r['batch']} over {r['duration_s']}s")
+    print(f"  throughput  {r['frames_per_s']} frames/s, {r['kbit_per_s']} kbit/s total")
+    print(f"  latency     p50 {lat['p50']}ms  p90 {lat['p90']}ms  p99 {lat['p99']}ms  max {r['latency_max_ms']}ms")
+    print(f"  drops       {r['lost_frames']} lost (seq gaps), {r['resyncs']} resyncs, "
+          f"{r.get('server_frames_dropped', '?')} dropped by server, {r['tier_switches']} tier switches")
+    print(f"  sockets     {r['connections']} listener connections")
+    if "e2e_ms" in r:
+        e2e = r["e2e_ms"]
+        print(f"  end-to-end  p50 {e2e['p50']}ms  p90 {e2e['p90']}ms  p99 {e2e['p99']}ms "
+              f"({r['e2e_probes']} clicks)")
+    elif "e2e_probes" in r:
+        print("  end-to-end  no clicks detected (is the probe reaching the sink?)")
+    if "server_cpu_pct" in r:
+        print(f"  server cpu  {r['server_cpu_pct']}% ({r['cpu_pct_per_listener']}% per listener)")
+    if r["mics"]:
+        print(f"  mic         {r['mic_frames_sent']} frames sent, {r.get('server_mic_frames_in', '?')} received")
+
+
+def print_comparison(reports):
+    print(f"{'backend':<14}{'e2e p50':>10}{'e2e p99':>10}{'send p50':>10}{'cpu %':>8}{'lost':>7}")
+    for r in reports:
+        e2e = r.get("e2e_ms", {})
+        print(f"{r['backend']:<14}{e2e.get('p50', '-'):>10}{e2e.get('p99', '-'):>10}"
+              f"{r['latency_ms']['p50']:>10}{r.get('server_cpu_pct', '-'):>8}{r['lost_frames']:>7}")
+
+
+def relay_bench(args):
+    """--relay N: every listener plays N containers (synthetic servers on
+    --port+1..N), first over one connection per container, then over a
+    single connection to a relay on --port. CPU covers all servers."""
+    containers = {f"c{i}": f"ws://127.0.0.1:{args.port + i}" for i in range(1, args.relay + 1)}
+    procs = [start_server(args, "synthetic", port=args.port + i) for i in range(1, args.relay + 1)]
+    upstreams = ",".join(f"{c}={url}" for c, url in containers.items())
+    procs.append(start_server(args, "synthetic", relay=upstreams))
+    reports = []
+    try:
+        for label, url, pids in (("direct", None, [p.pid for p in procs[:-1]]),
+                                 ("relay", f"ws://127.0.0.1:{args.port}", [p.pid for p in procs])):
+            reports.append(asyncio.run(run(args, url, pids, "synthetic", label, containers)))
+            if args.json:
+                print(json.dumps(reports[-1]))
+            else:
+                print_report(reports[-1])
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+    if not args.json:
+        print_comparison(reports)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--listeners", type=int, default=10)
+    parser.add_argument("--mics", type=int, default=0)
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds ignored at start")
+    parser.add_argument("--tier", default="opus-64")
+    parser.add_argument("--auto", action="store_true", help="allow auto-tiering")
+    parser.add_argument("--frame-ms", type=float, default=20)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--bandwidth", type=float, default=0, help="per-listener kbit/s (0 = unlimited)")
+    parser.add_argument("--jitter", type=float, default=0, help="max random read/send delay in ms")
+    parser.add_argument("--backend", default="synthetic",
+                        help="synthetic, pulse or pulse-simple; comma-separated to compare")
+    parser.add_argument("--workers", default="0",
+                        help="fan-out worker processes (AUDIO_WORKERS); comma-separated to compare")
+    parser.add_argument("--no-probe", action="store_true", help="skip the end-to-end click probe")
+    parser.add_argument("--source", default="sine", help="synthetic backend: sine, noise or a raw s16le pipe/file")
+    parser.add_argument("--port", type=int, default=10906, help="port for the spawned server")
+    parser.add_argument("--url", help="attach to a running server instead of spawning one")
+    parser.add_argument("--pid", type=int, help="server pid for CPU accounting with --url")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--relay", type=int, default=0,
+                        help="N synthetic container servers: compare direct connections with relay mode")
+    parser.add_argument("--verbose", action="store_true", help="show server output")
+    args = parser.parse_args()
+
+    if args.relay:
+        relay_bench(args)
+        return
+    reports = []
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    for backend, workers in [(b, w) for b in args.backend.split(",") for w in worker_counts]:
+        label = f"{backend}/w{workers}" if len(worker_counts) > 1 else backend
+        proc = None
+        if args.url:
+            url, pid = args.url, args.pid
+        else:
+            proc = start_server(args, backend, workers)
+            url, pid = f"ws://127.0.0.1:{args.port}", proc.pid
+        try:
+            report = asyncio.run(run(args, url, pid, backend, label))
+        finally:
+            if proc:
+                proc.terminate()
+                proc.wait()
+        reports.append(report)
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print_report(report)
+        check_backpressure(args, report)
+        check_replay_switch(report)
+    if len(reports) > 1 and not args.json:
+        print_comparison(reports)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,37 @@
 #!/usr/bin/env python3
-"""PulseAudio null-sink -> WebSocket audio stream (Opus 64kbps, 48000Hz, stereo)
-Full-duplex: also accepts inbound binary messages from browser mic and writes
-them into a webcode_input null-sink via pacat --playback.
-Text frames: JSON control messages for server-side ffmpeg recording.
+"""PulseAudio null-sink -> WebSocket audio stream (Opus tiers, 48000Hz)
+Full-duplex: also accepts inbound binary messages from browser mics, mixes
+them and writes them into a webcode_input null-sink.
+Text frames: JSON control messages for output tier, framing and stream,
+replay, metrics and server-side recording.
 
 Compression: Opus @ 64 Kbps, 20ms frames (960 samples/ch @ 48000Hz).
 Bandwidth: 1.37 Mbps (raw PCM) -> 64 Kbps (Opus) = ~95% reduction.
 Latency:   ~186ms (raw chunk) -> ~20ms (Opus frame) = ~89% reduction.
+
+Settings are AUDIO_* environment variables, described where they are read.
 """
 import asyncio
+import bisect
+import collections
+import ctypes
+import ctypes.util
+import fcntl
 import os
 import subprocess
 import sys
 import websockets
 import json
 import signal
+import socket
 import datetime
+import http
+import math
+import struct
+import termios
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import opuslib
 
 HOST = "127.0.0.1"
@@ -24,13 +40,114 @@ SAMPLE_RATE = 48000       # Opus native rate (upsample from 44100)
 CHANNELS = 2
 FRAME_SIZE = 960          # 20ms per frame at 48000Hz
 CHUNK_BYTES = FRAME_SIZE * CHANNELS * 2  # raw PCM bytes per Opus frame
-ENCODER_BITRATE = 64000   # 64 Kbps target
+FRAME_SECONDS = FRAME_SIZE / SAMPLE_RATE  # 20ms: default output and mic frame
+# Frame durations Opus can encode; listeners may pick any of them (framing v2)
+FRAME_DURATIONS_MS = (2.5, 5, 10, 20, 40, 60)
+# pacat is read in chunks of this many ms. Output frames shorter than this
+# arrive in bursts, so low-latency setups lower it (2.5/5/10/20).
+CAPTURE_MS = float(os.environ.get("AUDIO_CAPTURE_MS", "20"))
+if CAPTURE_MS not in FRAME_DURATIONS_MS[:4]:
+    CAPTURE_MS = 20.0
+CAPTURE_FRAME_SIZE = int(SAMPLE_RATE * CAPTURE_MS / 1000)
+CAPTURE_BYTES = CAPTURE_FRAME_SIZE * CHANNELS * 2
+CAPTURE_SECONDS = CAPTURE_FRAME_SIZE / SAMPLE_RATE  # real-time budget per chunk
+# Framing v2 message: version, tier index, frame count, frame duration (0.5ms
+# units), sequence number of the first frame, capture time of the first frame
+# (us since the epoch); then per frame a 2-byte length and the payload.
+FRAMING_V2_HEADER = struct.Struct("!BBBBIQ")
+MAX_BATCH = 12
+# Seconds between encode-time summaries in the log
+CODEC_STATS_INTERVAL = float(os.environ.get("AUDIO_CODEC_STATS_INTERVAL", "60"))
+# Mic uplink playout delay: initial/minimum target and hard maximum (ms).
+# The Opus jitter buffer adapts its target between the two from measured jitter.
+MIC_TARGET_FRAMES = max(1, round(int(os.environ.get("AUDIO_MIC_TARGET_MS", "40")) / 1000 / FRAME_SECONDS))
+MIC_MAX_FRAMES = max(MIC_TARGET_FRAMES, round(int(os.environ.get("AUDIO_MIC_MAX_MS", "200")) / 1000 / FRAME_SECONDS))
+# Consecutive concealed frames after which a silent mic is treated as stopped
+MIC_MAX_CONCEAL_FRAMES = 5
+# Seconds without listeners before pacat and the encoder are stopped
+CAPTURE_IDLE_GRACE = float(os.environ.get("AUDIO_IDLE_GRACE", "10"))
+# Encoder tiers: name -> (codec, channels, bitrate). Each tier is encoded at
+# most once per frame, and only while a listener is subscribed to it.
+TIERS = {
+    "opus-24m": ("opus", 1, 24000),
+    "opus-48": ("opus", 2, 48000),
+    "opus-64": ("opus", 2, 64000),
+    "opus-96": ("opus", 2, 96000),
+    "pcm": ("pcm", CHANNELS, None),
+}
+DEFAULT_TIER = os.environ.get("AUDIO_DEFAULT_TIER", "opus-64")
+# Opus tiers in quality order; auto-tiering moves listeners along this ladder
+TIER_LADDER = ["opus-24m", "opus-48", "opus-64", "opus-96"]
+# Auto-tiering: frames per evaluation window, send lag (in 20ms frames beyond
+# one message) that steps a client down, and consecutive calm windows before
+# it steps back up
+AUTO_TIER_WINDOW = 50
+AUTO_TIER_DOWN_FRAMES = int(os.environ.get("AUDIO_AUTO_TIER_DOWN_FRAMES", "5"))
+AUTO_TIER_UP_WINDOWS = int(os.environ.get("AUDIO_AUTO_TIER_UP_WINDOWS", "10"))
+# Silence gate: frames whose peak |sample| stays at or below SILENCE_PEAK for
+# longer than the hangover are neither encoded nor sent (0 disables the gate)
+SILENCE_PEAK = int(os.environ.get("AUDIO_SILENCE_PEAK", "16"))
+SILENCE_HANGOVER_CHUNKS = round(int(os.environ.get("AUDIO_SILENCE_HANGOVER_MS", "200")) / 1000 / CAPTURE_SECONDS)
 PULSE_SINK = "webcode_null"
 PULSE_INPUT_SINK = "webcode_input"
+# Named streams besides "main" (PULSE_SINK), comma-separated:
+#   name              a null sink webcode_<name> of its own
+#   name=sink:<sink>  an existing (or created) sink's monitor
+#   name=app:<a>|<b>  a null sink webcode_<name> that applications whose
+#                     process binary contains a or b are moved into while the
+#                     stream is captured
+STREAMS_SPEC = os.environ.get("AUDIO_STREAMS", "")
+DEFAULT_STREAM = "main"
+# How often app streams look for new matching sink-inputs
+APP_ROUTE_SECONDS = float(os.environ.get("AUDIO_APP_ROUTE_SECONDS", "2"))
+# Per-client send queue: frames beyond this are dropped oldest-first
+SEND_QUEUE_FRAMES = int(os.environ.get("AUDIO_SEND_QUEUE_FRAMES", "50"))
+# A client whose audio waits this many 20ms frames (beyond one message) to be
+# sent is skipped to live and told to resync
+RESYNC_FRAMES = int(os.environ.get("AUDIO_RESYNC_FRAMES", "15"))
+# Bytes buffered per connection below the send queue (websockets' write
+# buffer, and the kernel socket buffer of client connections): kept small
+# so a slow link holds up sends, where its lag is measured, instead of
+# piling up seconds of audio out of sight
+SEND_BUFFER_BYTES = int(os.environ.get("AUDIO_SEND_BUFFER_BYTES", "8192"))
+# Seconds of encoded frames kept per stream for prebuffering and "replay"
+# (0 disables both)
+RING_SECONDS = float(os.environ.get("AUDIO_RING_SECONDS", "5"))
+# Recent audio sent to a listener on set_audio so playback starts with a lead
+PREBUFFER_MS = int(os.environ.get("AUDIO_PREBUFFER_MS", "80"))
+# Fan-out workers: with N > 0 this process captures and encodes into shared
+# memory rings and N worker processes serve AUDIO_PORT (SO_REUSEPORT)
+WORKERS = int(os.environ.get("AUDIO_WORKERS", "0"))
+WORKER_INDEX = os.environ.get("AUDIO_WORKER_INDEX")  # set in worker processes
+WORKER_SOCKET = os.environ.get("AUDIO_WORKER_SOCKET", f"/tmp/audio-ws-{PORT}.sock")
+# How often workers look for new frames in the rings
+WORKER_POLL_SECONDS = float(os.environ.get("AUDIO_WORKER_POLL_MS", "5")) / 1000
+WORKER_METRICS = {}  # worker index -> last metrics report
+# Relay mode: "id=ws://host:port,..." (a bare port is a server on this host).
+# The process then captures nothing and serves the listed container audio
+# servers to its clients, multiplexed over one WebSocket each.
+RELAY_UPSTREAMS = os.environ.get("AUDIO_RELAY_UPSTREAMS", "")
 CLIENTS = set()
 # Track which clients want audio output (to avoid pushing when only mic is active)
-AUDIO_PLAYING_CLIENTS = set()
-PCM_CLIENTS = set()  # clients that requested PCM instead of Opus
+AUDIO_PLAYING_CLIENTS = {}  # ws -> AudioSender
+
+# Capture backend: "pulse" (pacat from the null-sink monitor), "pulse-simple"
+# (libpulse-simple in-process, falls back to pacat if the library is missing)
+# or "synthetic" (AUDIO_SYNTH_SOURCE: "sine", "noise" or the path of a raw
+# s16le pipe/file; no PulseAudio needed, mic audio is mixed and discarded)
+CAPTURE_BACKEND = os.environ.get("AUDIO_BACKEND", "pulse")
+SYNTH_SOURCE = os.environ.get("AUDIO_SYNTH_SOURCE", "sine")
+# pulse-simple buffer sizes: record fragment (delivery granularity) and
+# playback target length, in ms
+PULSE_FRAGMENT_MS = float(os.environ.get("AUDIO_PULSE_FRAGMENT_MS", str(CAPTURE_MS)))
+PULSE_PLAYBACK_MS = float(os.environ.get("AUDIO_PULSE_PLAYBACK_MS", "20"))
+
+# Local Prometheus endpoint (http://127.0.0.1:<port>/metrics); 0 disables it
+METRICS_PORT = int(os.environ.get("AUDIO_METRICS_PORT", "10016"))
+
+STARTED_AT = time.monotonic()
+# Set once sinks and the mic playback stream exist; capture waits for it
+AUDIO_READY = asyncio.Event()
 
 # PulseAudio socket path
 PULSE_SOCKET = "/run/user/1000/pulse/native"
@@ -42,11 +159,46 @@ pacat_in_proc = None
 # ffmpeg recording state
 ffmpeg_proc = None
 recording_filename = None
+recording_started_at = None
 RECORDINGS_DIR = "/home/ubuntu/recordings"
+# Audio-only recordings (start_recording mode "audio") copy this tier's packets
+RECORD_TIER = os.environ.get("AUDIO_RECORD_TIER", "opus-96")
+audio_recorder = None  # OggOpusWriter while an audio-only recording runs
+# start_recording without a mode: "video" (single MP4), "segments" or "audio"
+RECORD_MODE = os.environ.get("AUDIO_RECORD_MODE", "video")
+# Segmented recordings: chunk length and retention (0 disables a limit);
+# the oldest segments are deleted first
+SEGMENT_SECONDS = int(os.environ.get("AUDIO_RECORD_SEGMENT_SECONDS", "60"))
+KEEP_SEGMENTS = int(os.environ.get("AUDIO_RECORD_KEEP_SEGMENTS", "0"))
+KEEP_HOURS = float(os.environ.get("AUDIO_RECORD_KEEP_HOURS", "0"))
+KEEP_MB = float(os.environ.get("AUDIO_RECORD_KEEP_MB", "10240"))
+segmented_recording = None  # SegmentedRecording while mode "segments" runs
+# Screen recording profiles: capture rate, duplicate-frame dropping (VFR),
+# max output width, x264 settings, encoder thread cap and audio bitrate
+RECORD_PROFILES = {
+    "docs": {"fps": 10, "decimate": True, "max_width": 1280, "preset": "veryfast",
+             "crf": 28, "tune": "stillimage", "threads": 1, "audio": "96k"},
+    "demo": {"fps": 30, "decimate": True, "max_width": 1920, "preset": "veryfast",
+             "crf": 25, "tune": None, "threads": 2, "audio": "128k"},
+    "full": {"fps": 30, "decimate": False, "max_width": None, "preset": "fast",
+             "crf": 23, "tune": None, "threads": 0, "audio": "192k"},
+}
+RECORD_PROFILE = os.environ.get("AUDIO_RECORD_PROFILE", "full")
+recording_profile = None
+_display_resolution = {}  # display -> "WxH", resolved once per process
 
 
 def _get_display_resolution(display):
-    """Query actual X11 display size via xdpyinfo (avoids VNC_RESOLUTION mismatch)."""
+    """Query actual X11 display size via xdpyinfo (avoids VNC_RESOLUTION mismatch).
+
+    The result is cached, so only the first recording pays for xdpyinfo.
+    """
+    if display not in _display_resolution:
+        _display_resolution[display] = _query_display_resolution(display)
+    return _display_resolution[display]
+
+
+def _query_display_resolution(display):
     import re
     try:
         result = subprocess.run(
@@ -66,31 +218,325 @@ def _get_display_resolution(display):
     return vnc_res
 
 
-def _build_ffmpeg_cmd(filename):
+def _build_ffmpeg_cmd(filename, segmented=False, profile="full"):
+    """ffmpeg command for a single MP4, or for a directory of segments."""
+    opts = RECORD_PROFILES[profile]
     display = os.environ.get("DISPLAY", ":1")
     res = _get_display_resolution(display)
-    print(f"[audio-ws] Recording resolution: {res}", flush=True)
-    return [
+    print(f"[audio-ws] Recording resolution: {res}, profile {profile}", flush=True)
+    filters = []
+    if opts["decimate"]:
+        # A static desktop produces near-identical frames: drop them and
+        # keep the original timestamps (variable frame rate)
+        filters.append("mpdecimate")
+    if opts["max_width"]:
+        filters.append(f"scale='min(iw,{opts['max_width']})':-2")
+    cmd = [
         "ffmpeg", "-y",
-        "-f", "x11grab", "-framerate", "30",
+        "-f", "x11grab", "-framerate", str(opts["fps"]),
         "-video_size", res,
         "-i", f"{display}.0+0,0",
         "-f", "pulse", "-i", f"{PULSE_SINK}.monitor",
-        "-c:v", "libx264", "-preset", "fast", "-crf", "23",
-        "-c:a", "aac", "-b:a", "192k",
-        "-movflags", "+faststart",
-        filename,
     ]
+    if filters:
+        cmd += ["-vf", ",".join(filters), "-fps_mode", "vfr"]
+    cmd += ["-c:v", "libx264", "-preset", opts["preset"], "-crf", str(opts["crf"])]
+    if opts["tune"]:
+        cmd += ["-tune", opts["tune"]]
+    if opts["threads"]:
+        cmd += ["-threads", str(opts["threads"])]
+    cmd += ["-c:a", "aac", "-b:a", opts["audio"]]
+    if not segmented:
+        return cmd + ["-movflags", "+faststart", filename]
+    # Fragmented MP4 per segment: each is playable on its own as soon as it
+    # is closed, and a crash loses at most the last fragment
+    return cmd + [
+        "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_SECONDS})",
+        "-f", "segment", "-segment_time", str(SEGMENT_SECONDS), "-reset_timestamps", "1",
+        "-segment_format", "mp4",
+        "-segment_format_options", "movflags=+frag_keyframe+empty_moov+default_base_moof",
+        "-segment_list", os.path.join(filename, "segments.csv"), "-segment_list_type", "csv",
+        os.path.join(filename, "seg_%05d.mp4"),
+    ]
+
+
+class SegmentedRecording:
+    """Bookkeeping for a segmented screen recording (mode "segments").
+
+    ffmpeg's segment muxer appends every finished segment to segments.csv;
+    watch() turns that into manifest.json (start offset, duration and size
+    per segment) and applies the retention limits, so a week-long session
+    keeps bounded disk and every closed segment can be played or
+    downloaded while recording continues.
+    """
+
+    POLL_SECONDS = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.started = time.time()
+        self.segments = []  # {"file", "start", "duration", "size", "created"}
+        self.deleted = 0
+        self.complete = False
+        self._csv_pos = 0
+
+    @property
+    def bytes(self):
+        return sum(seg["size"] for seg in self.segments)
+
+    def disk_bytes(self):
+        """Kept segments plus the one being written."""
+        try:
+            return sum(e.stat().st_size for e in os.scandir(self.path) if e.name.startswith("seg_"))
+        except OSError:
+            return self.bytes
+
+    def manifest(self):
+        return {
+            "session": self.name,
+            "recording": not self.complete,
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "segment_seconds": SEGMENT_SECONDS,
+            "segments": self.segments,
+            "deleted": self.deleted,
+            "bytes": self.bytes,
+        }
+
+    async def watch(self):
+        while not self.complete:
+            await asyncio.sleep(self.POLL_SECONDS)
+            self.update()
+            if ffmpeg_proc is None or ffmpeg_proc.returncode is not None:
+                self.finish()
+
+    def update(self):
+        """Pick up newly finished segments and apply retention."""
+        changed = self._scan()
+        changed = self._apply_retention() or changed
+        if changed:
+            self._write_manifest()
+
+    def finish(self):
+        global segmented_recording
+        self.update()
+        self.complete = True
+        self._write_manifest()
+        if segmented_recording is self:
+            segmented_recording = None
+
+    def _scan(self):
+        try:
+            with open(os.path.join(self.path, "segments.csv")) as f:
+                f.seek(self._csv_pos)
+                text = f.read()
+        except OSError:
+            return False
+        done = text[:text.rfind("\n") + 1]  # ignore a half-written line
+        self._csv_pos += len(done)
+        for line in done.splitlines():
+            name, start, end = line.rsplit(",", 2)
+            self.segments.append({
+                "file": name,
+                "start": round(float(start), 3),
+                "duration": round(float(end) - float(start), 3),
+                "size": _file_size(os.path.join(self.path, name)),
+                "created": int(time.time()),
+            })
+        return bool(done)
+
+    def _apply_retention(self):
+        now = time.time()
+        removed = False
+        while len(self.segments) > 1 and (
+            (KEEP_SEGMENTS and len(self.segments) > KEEP_SEGMENTS)
+            or (KEEP_HOURS and now - self.segments[0]["created"] > KEEP_HOURS * 3600)
+            or (KEEP_MB and self.bytes > KEEP_MB * 1024 * 1024)
+        ):
+            seg = self.segments.pop(0)
+            try:
+                os.remove(os.path.join(self.path, seg["file"]))
+            except OSError:
+                pass
+            self.deleted += 1
+            removed = True
+        return removed
+
+    def _write_manifest(self):
+        tmp = os.path.join(self.path, "manifest.json.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.manifest(), f)
+            os.replace(tmp, os.path.join(self.path, "manifest.json"))
+        except OSError as e:
+            print(f"[audio-ws] manifest write failed: {e}", flush=True)
+
+
+def recording_manifest(session=None):
+    """Manifest of the running segmented recording, or of a finished session."""
+    if segmented_recording is not None and session in (None, segmented_recording.name):
+        segmented_recording.update()
+        return segmented_recording.manifest()
+    if not session or "/" in session or session.startswith("."):
+        return None
+    try:
+        with open(os.path.join(RECORDINGS_DIR, session, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _ogg_crc_table():
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04C11DB7) if r & 0x80000000 else (r << 1)
+        table.append(r & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC = _ogg_crc_table()
+
+
+class OggOpusWriter:
+    """Writes already-encoded 20ms Opus packets into an Ogg Opus file (RFC 7845).
+
+    Fed from the live tier stream by the capture loop, so an audio-only
+    recording costs no extra capture and no re-encode. Pages are flushed
+    about once a second, keeping the file playable if the server dies.
+    Time the silence gate skips is filled with TOC-only packets, which
+    decoders play as silence, so the recording keeps wall-clock length.
+    """
+
+    PRE_SKIP = 120  # encoder lookahead of RESTRICTED_LOWDELAY (2.5ms)
+    PAGE_PACKETS = 50
+
+    def __init__(self, path, tier, stream=DEFAULT_STREAM):
+        self.path = path
+        self.tier = tier
+        self.stream_key = (stream, tier.name, FRAME_SECONDS * 1000)
+        self.file = open(path, "wb")
+        self.serial = int.from_bytes(os.urandom(4), "little")
+        self.page_seq = 0
+        self.granule = 0  # 48kHz samples written so far
+        self.packets = []
+        self.silent_samples = 0
+        self.size = 0
+        # CELT-only fullband 20ms, one frame of zero length
+        self.empty_packet = bytes([(31 << 3) | (4 if tier.channels == 2 else 0)])
+        head = b"OpusHead" + struct.pack("<BBHIhB", 1, tier.channels, self.PRE_SKIP, SAMPLE_RATE, 0, 0)
+        vendor = b"audio-ws"
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        self._page([head], 0, 0x02)
+        self._page([tags], 0, 0x00)
+
+    @property
+    def duration(self):
+        return (self.granule + len(self.packets) * FRAME_SIZE) / SAMPLE_RATE
+
+    def write(self, packet):
+        self.packets.append(packet)
+        if len(self.packets) >= self.PAGE_PACKETS:
+            self._flush()
+
+    def skip(self, seconds):
+        """Account for gated silence; emits one empty packet per 20ms."""
+        self.silent_samples += round(seconds * SAMPLE_RATE)
+        while self.silent_samples >= FRAME_SIZE:
+            self.silent_samples -= FRAME_SIZE
+            self.write(self.empty_packet)
+
+    def close(self):
+        self._flush(eos=True)
+        self.file.close()
+
+    def _flush(self, eos=False):
+        if not self.packets and not eos:
+            return
+        packets, self.packets = self.packets, []
+        self.granule += len(packets) * FRAME_SIZE
+        self._page(packets, self.granule, 0x04 if eos else 0x00)
+        self.file.flush()
 
+    def _page(self, packets, granule, flags):
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = struct.pack("<4sBBqIIIB", b"OggS", 0, flags, granule, self.serial,
+                             self.page_seq, 0, len(lacing))
+        page = bytearray(header + lacing + b"".join(packets))
+        crc = 0
+        for byte in page:
+            crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC[(crc >> 24) ^ byte]
+        page[22:26] = struct.pack("<I", crc)
+        self.file.write(page)
+        self.size += len(page)
+        self.page_seq += 1
 
-async def start_recording():
-    global ffmpeg_proc, recording_filename
+
+def recording_info():
+    """Filename, mode, size and duration of the current recording (or None)."""
+    if audio_recorder is not None:
+        duration = audio_recorder.duration
+        return {"filename": os.path.basename(audio_recorder.path), "mode": "audio",
+                "tier": audio_recorder.tier.name, "stream": audio_recorder.stream_key[0],
+                "size": audio_recorder.size,
+                "duration": round(duration, 2),
+                "bytes_per_min": round(audio_recorder.size * 60 / max(duration, 0.001))}
     if ffmpeg_proc is not None and ffmpeg_proc.returncode is None:
+        info = {"filename": os.path.basename(recording_filename), "mode": "video",
+                "profile": recording_profile, "size": _file_size(recording_filename),
+                "duration": round(time.monotonic() - recording_started_at, 2)}
+        if segmented_recording is not None:
+            info.update(mode="segments", size=segmented_recording.disk_bytes(),
+                        segments=len(segmented_recording.segments))
+        cpu = _proc_cpu_seconds(ffmpeg_proc.pid)
+        info["cpu_pct"] = round(100 * cpu / max(info["duration"], 0.001), 1)
+        info["bytes_per_min"] = round(info["size"] * 60 / max(info["duration"], 0.001))
+        return info
+    return None
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+async def start_recording(mode="video", tier=None, profile=None, stream=None):
+    global ffmpeg_proc, recording_filename, recording_started_at, audio_recorder, segmented_recording
+    global recording_profile
+    if recording_info() is not None:
         return None, "already_recording"
     os.makedirs(RECORDINGS_DIR, exist_ok=True)
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    recording_filename = os.path.join(RECORDINGS_DIR, f"recording_{ts}.mp4")
-    cmd = _build_ffmpeg_cmd(recording_filename)
+    if mode == "audio":
+        tier = ENCODER_TIERS.get(tier or RECORD_TIER)
+        if tier is None or tier.codec != "opus":
+            return None, "unknown_tier"
+        named = NAMED_STREAMS.get(stream or DEFAULT_STREAM)
+        if named is None:
+            return None, "unknown_stream"
+        filename = os.path.join(RECORDINGS_DIR, f"recording_{ts}.opus")
+        try:
+            audio_recorder = OggOpusWriter(filename, tier, named.name)
+        except OSError as e:
+            return None, str(e)
+        print(f"[audio-ws] Starting audio-only recording ({tier.name}, stream '{named.name}'): {filename}", flush=True)
+        named.capture.acquire()
+        return filename, None
+    profile = profile or RECORD_PROFILE
+    if profile not in RECORD_PROFILES:
+        return None, "unknown_profile"
+    segmented = mode == "segments"
+    if segmented:
+        recording_filename = os.path.join(RECORDINGS_DIR, f"session_{ts}")
+        os.makedirs(recording_filename, exist_ok=True)
+    else:
+        recording_filename = os.path.join(RECORDINGS_DIR, f"recording_{ts}.mp4")
+    cmd = _build_ffmpeg_cmd(recording_filename, segmented, profile)
     print(f"[audio-ws] Starting recording: {recording_filename}", flush=True)
     try:
         ffmpeg_proc = await asyncio.create_subprocess_exec(
@@ -99,7 +545,12 @@ async def start_recording():
             stderr=asyncio.subprocess.PIPE,
             env={**PULSE_ENV, "DISPLAY": os.environ.get("DISPLAY", ":1")},
         )
+        recording_started_at = time.monotonic()
+        recording_profile = profile
         asyncio.ensure_future(_drain_ffmpeg_stderr())
+        if segmented:
+            segmented_recording = SegmentedRecording(recording_filename)
+            asyncio.ensure_future(segmented_recording.watch())
         return recording_filename, None
     except Exception as e:
         ffmpeg_proc = None
@@ -123,10 +574,25 @@ async def _drain_ffmpeg_stderr():
 
 
 async def stop_recording():
-    global ffmpeg_proc, recording_filename
-    if ffmpeg_proc is None or ffmpeg_proc.returncode is not None:
+    """Stop the current recording; returns (info, error)."""
+    global ffmpeg_proc, recording_filename, audio_recorder
+    info = recording_info()
+    if info is None:
         return None, "not_recording"
+    if audio_recorder is not None:
+        recorder, audio_recorder = audio_recorder, None
+        try:
+            recorder.close()
+        except OSError as e:
+            return None, str(e)
+        finally:
+            NAMED_STREAMS[recorder.stream_key[0]].capture.release()
+        info.update(size=recorder.size, duration=round(recorder.duration, 2))
+        print(f"[audio-ws] Recording saved: {recorder.path} ({info['size']} bytes, {info['duration']:.1f}s)", flush=True)
+        return info, None
     fname = recording_filename
+    print(f"[audio-ws] Recording profile {info['profile']}: ffmpeg {info['cpu_pct']}% CPU, "
+          f"{info['bytes_per_min'] / 1e6:.1f} MB/min so far", flush=True)
     try:
         ffmpeg_proc.send_signal(signal.SIGINT)
         try:
@@ -140,368 +606,2961 @@ async def stop_recording():
     finally:
         ffmpeg_proc = None
         recording_filename = None
-    return fname, None
+    if segmented_recording is not None:
+        session = segmented_recording
+        session.finish()
+        info.update(size=session.bytes, segments=len(session.segments), deleted=session.deleted)
+    else:
+        info["size"] = _file_size(fname)
+        info["bytes_per_min"] = round(info["size"] * 60 / max(info["duration"], 0.001))
+    return info, None
 
 
-async def broadcast_audio():
-    """Read audio from pacat, encode with Opus, broadcast to all WebSocket clients.
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
 
-    Codec: Opus, 48000Hz stereo, 64 Kbps, 20ms frames (APPLICATION_RESTRICTED_LOWDELAY).
-    Each WebSocket message is one raw Opus packet (~160 bytes vs 3840 bytes raw PCM).
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def state(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    def merge(self, state):
+        """Add another histogram's state() (same buckets), e.g. a worker's."""
+        self.counts = [a + b for a, b in zip(self.counts, state["counts"])]
+        self.sum += state["sum"]
+        self.count += state["count"]
+
+    def render(self, name, out):
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            out.append(f'{name}_bucket{{le="{bound:g}"}} {total}')
+        out.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        out.append(f"{name}_sum {self.sum:.6f}")
+        out.append(f"{name}_count {self.count}")
+
+
+class Metrics:
+    """Hot-path counters and histograms; gauges are sampled at scrape time.
+
+    Served as Prometheus text on AUDIO_METRICS_PORT and as JSON through the
+    "metrics" control action. In fan-out worker mode the workers' latest
+    reports (WORKER_METRICS) are added to the counters, the latency histogram
+    and the per-client list.
     """
-    encoder = opuslib.Encoder(SAMPLE_RATE, CHANNELS, 'restricted_lowdelay')
-    encoder.bitrate = ENCODER_BITRATE
-    encoder.complexity = 5  # balance quality vs CPU for real-time use
 
-    cmd = [
-        "pacat", "--record",
-        "-d", f"{PULSE_SINK}.monitor",
-        "--format=s16le",
-        f"--rate={SAMPLE_RATE}",
-        f"--channels={CHANNELS}",
-        "--latency-msec=5",
-    ]
-    proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        env=PULSE_ENV,
-    )
-    print(
-        f"[audio-ws] pacat started (pid={proc.pid}), "
-        f"Opus {ENCODER_BITRATE // 1000}kbps @ {SAMPLE_RATE}Hz "
-        f"20ms frames → ws://{HOST}:{PORT}",
-        flush=True,
-    )
+    COUNTERS = {
+        "frames_captured": "PCM chunks read from the capture source",
+        "frames_encoded": "Opus frames encoded (all streams)",
+        "frames_sent": "Frames written to listener WebSockets",
+        "frames_dropped": "Frames dropped from listener send queues",
+        "bytes_out": "Audio bytes written to listener WebSockets",
+        "resyncs": "Listeners skipped to live after falling behind",
+        "mic_frames_in": "Mic frames/packets received from clients",
+        "mic_decode_errors": "Mic packets that failed to decode",
+        "capture_starts": "Capture pipeline starts (demand-driven)",
+        "pacat_restarts": "Capture (pacat) restarts after it exited",
+        "mic_playback_restarts": "Mic playback (pacat --playback) restarts",
+    }
 
-    try:
-        while True:
-            try:
-                frame_pcm = await proc.stdout.readexactly(CHUNK_BYTES)
-            except asyncio.IncompleteReadError:
-                print(f"[audio-ws] pacat EOF, exit code={await proc.wait()}", flush=True)
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.encode_seconds = Histogram((0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05))
+        self.latency_seconds = Histogram((0.005, 0.01, 0.02, 0.04, 0.08, 0.16, 0.32, 0.64, 1.28))
+        self.recovery_seconds = Histogram((0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+        self.last_recovery_seconds = 0.0
+
+    def inc(self, name, value=1):
+        self.counters[name] += value
+
+    def snapshot(self):
+        """JSON-friendly view of everything the text endpoint exposes."""
+        latency = self._latency()
+        return {
+            "counters": self._counters(),
+            "encode_seconds": {"count": self.encode_seconds.count, "sum": self.encode_seconds.sum},
+            "latency_seconds": {"count": latency.count, "sum": latency.sum},
+            "recovery_seconds": {"count": self.recovery_seconds.count, "sum": self.recovery_seconds.sum},
+            "gauges": self._gauges(),
+            "clients": self._clients(),
+            "silence": MAIN_STREAM.silence.stats(),
+            "streams": {name: {**named.info(), "silence": named.silence.stats()}
+                        for name, named in NAMED_STREAMS.items()},
+            "relay": [link.info() for link in list(RELAY_LINKS.values())],
+        }
+
+    def _counters(self):
+        totals = dict(self.counters)
+        for report in list(WORKER_METRICS.values()):
+            for name, value in report["counters"].items():
+                if name in totals:
+                    totals[name] += value
+        return totals
+
+    def _latency(self):
+        if not WORKER_METRICS:
+            return self.latency_seconds
+        total = Histogram(self.latency_seconds.buckets)
+        total.merge(self.latency_seconds.state())
+        for report in list(WORKER_METRICS.values()):
+            total.merge(report["latency_seconds"])
+        return total
+
+    def _clients(self):
+        clients = [
+            {"client": _client_label(sender.ws), "stream": sender.stream_name, "tier": sender.tier,
+             "queue_depth": len(sender.queue), "bytes_out": sender.bytes_out,
+             "dropped": sender.dropped, "resyncs": sender.resyncs}
+            for sender in list(AUDIO_PLAYING_CLIENTS.values()) + _relay_senders() if not sender.remote
+        ]
+        for report in list(WORKER_METRICS.values()):
+            clients.extend(report["clients"])
+        return clients
+
+    def report(self):
+        """What a fan-out worker sends to the capture process."""
+        return {"counters": self.counters, "latency_seconds": self.latency_seconds.state(),
+                "clients": self._clients()}
+
+    def _gauges(self):
+        recording = ffmpeg_proc is not None and ffmpeg_proc.returncode is None
+        info = recording_info()
+        return {
+            "clients": len(CLIENTS),
+            "listeners": len(AUDIO_PLAYING_CLIENTS),
+            "mic_clients": len(MIXER.inputs),
+            "capture_running": int(MAIN_STREAM.capture is not None and MAIN_STREAM.capture.running),
+            "capture_last_recovery_seconds": round(self.last_recovery_seconds, 3),
+            "mic_playback_running": int(pacat_in_proc is not None and pacat_in_proc.returncode is None),
+            "silence_active": int(MAIN_STREAM.silence.active),
+            "recording": int(info is not None),
+            "recording_bytes": info["size"] if info else 0,
+            "ffmpeg_cpu_seconds": _proc_cpu_seconds(ffmpeg_proc.pid) if recording else 0.0,
+            "fanout_workers": len(WORKER_METRICS),
+        }
+
+    def render(self):
+        out = []
+        counters = self._counters()
+        for name, help_text in self.COUNTERS.items():
+            out.append(f"# HELP audio_{name}_total {help_text}")
+            out.append(f"# TYPE audio_{name}_total counter")
+            out.append(f"audio_{name}_total {counters[name]}")
+        for name, hist, help_text in (
+            ("audio_encode_seconds", self.encode_seconds, "Encode time per captured chunk"),
+            ("audio_capture_to_send_seconds", self._latency(), "Capture to WebSocket write latency"),
+            ("audio_capture_recovery_seconds", self.recovery_seconds, "Capture loss to first frame after restart"),
+        ):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} histogram")
+            hist.render(name, out)
+        for name, value in self._gauges().items():
+            out.append(f"# TYPE audio_{name} gauge")
+            out.append(f"audio_{name} {value}")
+        out.append("# TYPE audio_stream_listeners gauge")
+        out.append("# TYPE audio_stream_capture_running gauge")
+        for name, named in NAMED_STREAMS.items():
+            info = named.info()
+            out.append(f'audio_stream_listeners{{stream="{name}"}} {info["listeners"]}')
+            out.append(f'audio_stream_capture_running{{stream="{name}"}} {int(info["capture_running"])}')
+        links = [link.info() for link in list(RELAY_LINKS.values())]
+        for name, kind, field in (
+            ("relay_upstream_connected", "gauge", "connected"),
+            ("relay_subscribers", "gauge", "subscribers"),
+            ("relay_upstream_connects", "counter", "connects"),
+            ("relay_frames_in", "counter", "frames_in"),
+            ("relay_bytes_in", "counter", "bytes_in"),
+            ("relay_frames_dropped", "counter", "dropped"),
+        ):
+            if not links:
                 break
+            out.append(f"# TYPE audio_{name} {kind}")
+            for link in links:
+                labels = f'container="{link["container"]}",stream="{link["stream"]}",tier="{link["tier"]}"'
+                out.append(f"audio_{name}{{{labels}}} {int(link[field])}")
+        out.append("# TYPE audio_client_queue_depth gauge")
+        out.append("# TYPE audio_client_bytes_out counter")
+        for client in self._clients():
+            labels = f'client="{client["client"]}",tier="{client["tier"]}"'
+            out.append(f"audio_client_queue_depth{{{labels}}} {client['queue_depth']}")
+            out.append(f"audio_client_bytes_out{{{labels}}} {client['bytes_out']}")
+        return "\n".join(out) + "\n"
 
-            try:
-                encoded = encoder.encode(frame_pcm, FRAME_SIZE)
-            except Exception as e:
-                print(f"[audio-ws] Opus encode error: {e}", flush=True)
-                continue
 
-            if AUDIO_PLAYING_CLIENTS:
-                dead = set()
-                for client in list(AUDIO_PLAYING_CLIENTS):
-                    try:
-                        data = frame_pcm if client in PCM_CLIENTS else encoded
-                        await client.send(data)
-                    except Exception:
-                        dead.add(client)
-                AUDIO_PLAYING_CLIENTS.difference_update(dead)
-                PCM_CLIENTS.difference_update(dead)
-    except Exception as e:
-        print(f"[audio-ws] broadcast_audio error: {e}", flush=True)
-    finally:
+METRICS = Metrics()
+
+
+def _client_label(ws):
+    addr = getattr(ws, "remote_address", None)
+    if not addr:
+        return "unknown"
+    return f"{addr[0]}:{addr[1]}"
+
+
+def _limit_send_buffer(ws):
+    """Shrink a client connection's kernel send buffer to SEND_BUFFER_BYTES,
+    so a slow link backs up into its sender's queue."""
+    sock = ws.transport.get_extra_info("socket") if ws.transport else None
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
         try:
-            proc.terminate()
-            await proc.wait()
-        except Exception:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+        except OSError:
             pass
 
 
-async def handler(ws):
-    """Handle WebSocket client connection (full-duplex)."""
-    CLIENTS.add(ws)
-    print(f"[audio-ws] client connected ({len(CLIENTS)} total) from {ws.remote_address}", flush=True)
-
-    # Send codec negotiation so the client knows to use Opus decoder
+def _proc_cpu_seconds(pid):
+    """user+system CPU seconds of a process, from /proc/<pid>/stat."""
     try:
-        await ws.send(json.dumps({
-            "event": "codec_info",
-            "codec": "opus",
-            "sample_rate": SAMPLE_RATE,
-            "channels": CHANNELS,
-            "frame_size": FRAME_SIZE,
-            "bitrate": ENCODER_BITRATE,
-        }))
-    except Exception as e:
-        print(f"[audio-ws] codec_info send failed: {e}", flush=True)
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return 0.0
 
-    # Mic decoder state for this client
-    mic_decoder = None
-    mic_codec_opus = False
 
-    try:
-        async for message in ws:
-            if isinstance(message, bytes):
-                if pacat_in_proc and pacat_in_proc.stdin:
-                    try:
-                        if mic_codec_opus and mic_decoder:
-                            # Decode Opus packet to PCM
-                            try:
-                                pcm = mic_decoder.decode(bytes(message), FRAME_SIZE)
-                                pacat_in_proc.stdin.write(pcm)
-                                await pacat_in_proc.stdin.drain()
-                            except Exception as e:
-                                print(f"[audio-ws] mic Opus decode error: {e}", flush=True)
-                        else:
-                            # Raw PCM (fallback)
-                            pacat_in_proc.stdin.write(message)
-                            await pacat_in_proc.stdin.drain()
-                    except Exception as e:
-                        print(f"[audio-ws] mic input write error: {e}", flush=True)
-            elif isinstance(message, str):
-                try:
-                    cmd = json.loads(message)
-                except json.JSONDecodeError:
-                    continue
-                action = cmd.get("action")
+# Largest piece of a segment returned for one Range request on the audio port
+RECORDING_RANGE_BYTES = 4 * 1024 * 1024
 
-                if action == "set_audio":
-                    # Client tells us whether they're playing audio
-                    should_send = cmd.get("enabled", False)
-                    if should_send:
-                        AUDIO_PLAYING_CLIENTS.add(ws)
-                        if cmd.get("prefer_pcm", False):
-                            PCM_CLIENTS.add(ws)
-                            print(f"[audio-ws] client enabled audio output in PCM mode ({len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
-                            # Re-announce PCM codec so client's onmessage knows the mode
-                            try:
-                                await ws.send(json.dumps({
-                                    "event": "codec_info",
-                                    "codec": "pcm",
-                                    "sample_rate": SAMPLE_RATE,
-                                    "channels": CHANNELS,
-                                    "frame_size": FRAME_SIZE,
-                                }))
-                            except Exception as e:
-                                print(f"[audio-ws] pcm codec_info send failed: {e}", flush=True)
-                        else:
-                            print(f"[audio-ws] client enabled audio output ({len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
-                    else:
-                        AUDIO_PLAYING_CLIENTS.discard(ws)
-                        PCM_CLIENTS.discard(ws)
-                        print(f"[audio-ws] client disabled audio output ({len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
 
-                elif action == "mic_codec":
-                    # Client announces mic codec support
-                    if cmd.get("codec") == "opus":
-                        try:
-                            mic_decoder = opuslib.Decoder(SAMPLE_RATE, CHANNELS)
-                            mic_codec_opus = True
-                            print(f"[audio-ws] client mic Opus decoder ready", flush=True)
-                        except Exception as e:
-                            print(f"[audio-ws] failed to create mic Opus decoder: {e}", flush=True)
+def _recording_file(path):
+    """Map /recordings/<session>/<file> to a manifest or segment on disk."""
+    parts = path.split("/")
+    if len(parts) != 4 or parts[1] != "recordings" or not parts[2].startswith("session_"):
+        return None, None
+    name = parts[3]
+    if name == "manifest.json":
+        kind = "application/json"
+    elif name.startswith("seg_") and name.endswith(".mp4") and "/" not in name:
+        kind = "video/mp4"
+    else:
+        return None, None
+    full = os.path.join(RECORDINGS_DIR, parts[2], name)
+    return (full, kind) if os.path.isfile(full) else (None, None)
 
-                elif action == "start_recording":
-                    fname, err = await start_recording()
-                    resp = {"event": "recording_error", "error": err} if err else \
-                           {"event": "recording_started", "filename": os.path.basename(fname)}
-                elif action == "stop_recording":
-                    fname, err = await stop_recording()
-                    resp = {"event": "recording_error", "error": err} if err else \
-                           {"event": "recording_stopped", "filename": os.path.basename(fname)}
-                elif action == "recording_status":
-                    is_rec = ffmpeg_proc is not None and ffmpeg_proc.returncode is None
-                    resp = {"event": "recording_status", "recording": is_rec,
-                            "filename": os.path.basename(recording_filename) if recording_filename else None}
-                else:
-                    continue
-                try:
-                    await ws.send(json.dumps(resp))
-                except Exception:
-                    pass
+
+async def _serve_metrics(reader, writer):
+    """Minimal HTTP/1.0 handler.
+
+    GET /metrics, plus /recordings/<session>/manifest.json and segment files
+    of segmented recordings (streamed, so memory stays bounded); anything
+    else is 404.
+    """
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else ""
+        if path == "/metrics":
+            body = METRICS.render().encode()
+            head = "HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+        elif path.startswith("/recordings/"):
+            full, kind = _recording_file(path)
+            if full is not None:
+                with open(full, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    writer.write(f"HTTP/1.0 200 OK\r\nContent-Type: {kind}\r\n"
+                                 f"Content-Length: {size}\r\n\r\n".encode())
+                    while size > 0:
+                        chunk = f.read(min(size, 65536))
+                        if not chunk:
+                            break
+                        size -= len(chunk)
+                        writer.write(chunk)
+                        await writer.drain()
+                return
+            body = b"not found\n"
+            head = "HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\n"
+        else:
+            body = b"not found\n"
+            head = "HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\n"
+        writer.write(f"{head}Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
     except Exception:
         pass
     finally:
-        CLIENTS.discard(ws)
-        AUDIO_PLAYING_CLIENTS.discard(ws)
-        PCM_CLIENTS.discard(ws)
-        print(f"[audio-ws] client disconnected ({len(CLIENTS)} remaining, {len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
+        writer.close()
 
 
-async def wait_for_pulseaudio(retries=30):
-    """Wait for PulseAudio to be ready."""
-    for i in range(retries):
-        try:
-            result = subprocess.run(
-                ["pactl", "info"],
-                capture_output=True,
-                env=PULSE_ENV,
-                timeout=2,
-            )
-            if result.returncode == 0:
-                print("[audio-ws] PulseAudio is ready", flush=True)
-                return True
-        except Exception:
-            pass
-        print(f"[audio-ws] waiting for PulseAudio ({i+1}/{retries})...", flush=True)
-        await asyncio.sleep(1)
-    print("[audio-ws] ERROR: PulseAudio did not start in time", flush=True)
-    return False
+async def _start_metrics():
+    """Serve METRICS_PORT if set; audio keeps running without it if the
+    port can't be bound (e.g. taken by another instance)."""
+    if not METRICS_PORT:
+        return
+    try:
+        await asyncio.start_server(_serve_metrics, HOST, METRICS_PORT)
+    except OSError as e:
+        print(f"[audio-ws] warning: metrics disabled, port {METRICS_PORT} unavailable: {e}", flush=True)
+        return
+    print(f"[audio-ws] metrics on http://{HOST}:{METRICS_PORT}/metrics", flush=True)
 
 
-async def wait_for_null_sink(retries=10):
-    """Wait for webcode_null sink to be available."""
-    for i in range(retries):
-        try:
-            result = subprocess.run(
-                ["pactl", "list", "sinks", "short"],
-                capture_output=True,
-                text=True,
-                env=PULSE_ENV,
-                timeout=2,
-            )
-            if PULSE_SINK in result.stdout:
-                print(f"[audio-ws] null-sink '{PULSE_SINK}' is available", flush=True)
-                return True
-        except Exception:
-            pass
-        print(f"[audio-ws] waiting for null-sink '{PULSE_SINK}' ({i+1}/{retries})...", flush=True)
-        await asyncio.sleep(1)
-    print(f"[audio-ws] WARNING: null-sink '{PULSE_SINK}' not found, pacat may fail", flush=True)
-    return False
+def _read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
 
 
-async def setup_null_sink():
-    """Create null-sink if it doesn't exist."""
-    try:
-        result = subprocess.run(
-            ["pactl", "list", "sinks", "short"],
-            capture_output=True,
-            text=True,
-            env=PULSE_ENV,
-        )
-        if PULSE_SINK in result.stdout:
-            print(f"[audio-ws] null-sink '{PULSE_SINK}' already exists", flush=True)
+async def _recordings_request(*args):
+    """process_request hook of the audio port: answers GET
+    /audio/recordings/<session>/<file> with the manifest or segment, so the
+    browser reaches recordings through the same proxy route as the
+    WebSocket. Other paths go on to the handshake.
+
+    Called as (path, headers) by the legacy websockets API and as
+    (connection, request) by websockets >= 13; the response is built for
+    whichever called.
+    """
+    legacy = isinstance(args[0], str)
+    path, headers = (args[0], args[1]) if legacy else (args[1].path, args[1].headers)
+    path = path.split("?", 1)[0]
+    marker = path.find("/audio/recordings/")
+    if marker < 0:
+        return None
+    full, kind = _recording_file(path[marker + len("/audio"):])
+    if full is None:
+        return _http_response(legacy, 404, [("Content-Type", "text/plain")], b"not found\n")
+    size = os.path.getsize(full)
+    start, end, status = 0, size - 1, 200
+    spec = headers.get("Range", "")
+    if spec.startswith("bytes=") and "," not in spec:
+        first, _, last = spec[6:].partition("-")
+        try:
+            if first:
+                start, end = int(first), int(last) if last else size - 1
+            else:
+                start, end = max(0, size - int(last)), size - 1
+        except ValueError:
+            start, end = 0, size - 1
         else:
-            subprocess.run(
-                [
-                    "pactl", "load-module", "module-null-sink",
-                    f"sink_name={PULSE_SINK}",
-                    "sink_properties=device.description=WebcodeAudio",
-                ],
-                env=PULSE_ENV,
-                check=True,
-            )
-            print(f"[audio-ws] null-sink '{PULSE_SINK}' created", flush=True)
+            if start >= size or start > end:
+                return _http_response(legacy, 416, [("Content-Range", f"bytes */{size}")], b"")
+            status = 206
+            end = min(end, size - 1, start + RECORDING_RANGE_BYTES - 1)
+    body = await asyncio.get_running_loop().run_in_executor(None, _read_range, full, start, end - start + 1)
+    response_headers = [("Content-Type", kind), ("Accept-Ranges", "bytes"), ("Cache-Control", "no-cache")]
+    if status == 206:
+        response_headers.append(("Content-Range", f"bytes {start}-{start + len(body) - 1}/{size}"))
+    return _http_response(legacy, status, response_headers, body)
 
-        subprocess.run(
-            ["pactl", "set-default-sink", PULSE_SINK],
-            env=PULSE_ENV,
-            check=True,
-        )
-        print(f"[audio-ws] default sink set to '{PULSE_SINK}'", flush=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[audio-ws] ERROR setting up null-sink: {e}", flush=True)
 
+def _http_response(legacy, status, headers, body):
+    headers = headers + [("Content-Length", str(len(body)))]
+    if legacy:
+        return http.HTTPStatus(status), headers, body
+    from websockets.datastructures import Headers
+    from websockets.http11 import Response
+    return Response(status, http.HTTPStatus(status).phrase, Headers(headers), body)
 
-async def setup_input_sink():
-    """Create webcode_input null-sink and wrap its monitor as a normal source.
 
-    Chrome filters out PA_SOURCE_MONITOR sources during getUserMedia enumeration.
-    module-remap-source wraps webcode_input.monitor into a plain source 'webcode_mic'
-    without the MONITOR flag, so Chrome can enumerate and select it.
+class CodecWorker:
+    """Runs opuslib encode/decode on dedicated threads, off the event loop.
+
+    libopus is called through ctypes, which releases the GIL for the duration
+    of the call, so a busy encoder no longer adds jitter to WebSocket I/O.
+    Encoder and decoder each get a single-thread executor, which keeps calls
+    on the same codec state strictly ordered. PCM frames and packets are
+    immutable bytes, so the handoff is by reference with no extra copy.
     """
-    try:
-        # 1. Create webcode_input null-sink if missing
-        result = subprocess.run(
-            ["pactl", "list", "sinks", "short"],
-            capture_output=True,
-            text=True,
-            env=PULSE_ENV,
-        )
-        if PULSE_INPUT_SINK in result.stdout:
-            print(f"[audio-ws] null-sink '{PULSE_INPUT_SINK}' already exists", flush=True)
-        else:
-            subprocess.run(
-                [
-                    "pactl", "load-module", "module-null-sink",
-                    f"sink_name={PULSE_INPUT_SINK}",
-                    "sink_properties=device.description=WebcodeMic",
-                ],
-                env=PULSE_ENV,
-                check=True,
-            )
-            print(f"[audio-ws] null-sink '{PULSE_INPUT_SINK}' created", flush=True)
 
-        # 2. Wrap webcode_input.monitor as plain source 'webcode_mic' (no MONITOR flag)
-        src_result = subprocess.run(
-            ["pactl", "list", "sources", "short"],
-            capture_output=True,
-            text=True,
-            env=PULSE_ENV,
-        )
-        if "webcode_mic" in src_result.stdout:
-            print("[audio-ws] remap-source 'webcode_mic' already exists", flush=True)
-        else:
-            subprocess.run(
-                [
-                    "pactl", "load-module", "module-remap-source",
-                    "source_name=webcode_mic",
-                    f"master={PULSE_INPUT_SINK}.monitor",
-                    "source_properties=device.description=WebcodeMicrophone",
-                ],
-                env=PULSE_ENV,
-                check=True,
-            )
-            print("[audio-ws] remap-source 'webcode_mic' created", flush=True)
+    def __init__(self):
+        self._enc_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opus-enc")
+        self._dec_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opus-dec")
+        self.encode_frames = 0
+        self.encode_late = 0      # chunks that took longer than CAPTURE_SECONDS
+        self.last_encode_time = 0.0
+        self._window_total = 0.0
+        self._window_max = 0.0
+        self._window_frames = 0
+        self._window_start = time.monotonic()
 
-        # 3. Set webcode_mic as default source
-        subprocess.run(
-            ["pactl", "set-default-source", "webcode_mic"],
-            env=PULSE_ENV,
-            check=True,
-        )
-        print("[audio-ws] default source set to 'webcode_mic'", flush=True)
+    @staticmethod
+    def _timed(fn, *args):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - t0
 
-    except subprocess.CalledProcessError as e:
-        print(f"[audio-ws] ERROR setting up input sink: {e}", flush=True)
+    async def encode_batch(self, jobs):
+        """Encode everything due for one captured chunk in one hop to the encode thread.
 
+        jobs is a list of (encoder, pcm, channels, frame_size); stereo PCM is
+        downmixed on the worker thread for mono tiers. The recorded encode
+        time covers the whole batch, i.e. the real cost of one chunk. Returns
+        one packet per job, or None where encoding failed.
+        """
+        loop = asyncio.get_running_loop()
+        packets, elapsed = await loop.run_in_executor(
+            self._enc_pool, self._timed, self._encode_jobs, jobs)
+        self._record_encode(elapsed)
+        return packets
 
-async def start_input_playback():
-    """Start pacat --playback to feed browser mic audio into webcode_input."""
-    global pacat_in_proc
-    cmd = [
-        "pacat", "--playback",
-        "-d", PULSE_INPUT_SINK,
-        "--format=s16le",
-        f"--rate={SAMPLE_RATE}",
-        f"--channels={CHANNELS}",
-        "--latency-msec=20",
-    ]
-    pacat_in_proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdin=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        env=PULSE_ENV,
-    )
-    print(f"[audio-ws] pacat --playback started (pid={pacat_in_proc.pid}) for mic input", flush=True)
+    @staticmethod
+    def _encode_jobs(jobs):
+        out = []
+        for encoder, pcm, channels, frame_size in jobs:
+            try:
+                if channels == 1 and CHANNELS == 2:
+                    stereo = np.frombuffer(pcm, dtype=np.int16).reshape(-1, 2).astype(np.int32)
+                    pcm = ((stereo[:, 0] + stereo[:, 1]) >> 1).astype(np.int16).tobytes()
+                out.append(encoder.encode(pcm, frame_size))
+            except Exception as e:
+                print(f"[audio-ws] Opus encode error: {e}", flush=True)
+                out.append(None)
+        return out
 
+    async def decode_batch(self, jobs):
+        """Decode a list of (decoder, packet, fec) in one hop to the decode thread.
 
-async def main():
-    import atexit
+        packet=None asks libopus for packet-loss concealment; fec=True recovers
+        the previous frame from the in-band FEC data of the given packet.
+        Returns PCM bytes per job, or None where decoding failed.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._dec_pool, self._decode_jobs, jobs)
 
-    def _cleanup():
-        if ffmpeg_proc and ffmpeg_proc.returncode is None:
+    @staticmethod
+    def _decode_jobs(jobs):
+        out = []
+        for decoder, packet, fec in jobs:
             try:
-                ffmpeg_proc.send_signal(signal.SIGINT)
+                if packet is None:
+                    pcm = opuslib.api.decoder.decode(
+                        decoder.decoder_state, None, 0, FRAME_SIZE, False, channels=CHANNELS)
+                else:
+                    pcm = decoder.decode(packet, FRAME_SIZE, fec)
             except Exception:
-                pass
+                pcm = None
+            out.append(pcm)
+        return out
 
-    atexit.register(_cleanup)
+    def _record_encode(self, elapsed):
+        METRICS.encode_seconds.observe(elapsed)
+        self.encode_frames += 1
+        self.last_encode_time = elapsed
+        if elapsed > CAPTURE_SECONDS:
+            self.encode_late += 1
+        self._window_total += elapsed
+        self._window_frames += 1
+        if elapsed > self._window_max:
+            self._window_max = elapsed
+        now = time.monotonic()
+        if now - self._window_start >= CODEC_STATS_INTERVAL:
+            avg = self._window_total / self._window_frames
+            print(
+                f"[audio-ws] encode time: avg={avg * 1000:.2f}ms "
+                f"max={self._window_max * 1000:.2f}ms "
+                f"load={avg / CAPTURE_SECONDS:.1%} of real time "
+                f"({self.encode_late} late of {self.encode_frames} frames)",
+                flush=True,
+            )
+            self._window_total = 0.0
+            self._window_max = 0.0
+            self._window_frames = 0
+            self._window_start = now
 
-    if not await wait_for_pulseaudio():
-        sys.exit(1)
 
-    await setup_null_sink()
-    await wait_for_null_sink()
-    await setup_input_sink()
-    await start_input_playback()
+CODEC = CodecWorker()
+
+
+class EncoderTier:
+    """One output quality level (codec, channels, bitrate)."""
+
+    def __init__(self, name, codec, channels, bitrate):
+        self.name = name
+        self.index = list(TIERS).index(name)  # tier byte in framing v2
+        self.codec = codec
+        self.channels = channels
+        self.bitrate = bitrate
+
+    def make_encoder(self):
+        if self.codec != "opus":
+            return None
+        encoder = opuslib.Encoder(SAMPLE_RATE, self.channels, 'restricted_lowdelay')
+        encoder.bitrate = self.bitrate
+        encoder.complexity = 5  # balance quality vs CPU for real-time use
+        # DTX: near-silent frames that slip past the gate (hangover, very
+        # quiet noise) shrink to tiny packets. opuslib's dtx setter is broken.
+        opuslib.api.encoder.encoder_ctl(encoder.encoder_state, opuslib.api.ctl.set_dtx, 1)
+        return encoder
+
+    def codec_info(self, frame_ms=FRAME_SECONDS * 1000):
+        info = {
+            "event": "codec_info",
+            "codec": self.codec,
+            "sample_rate": SAMPLE_RATE,
+            "channels": self.channels,
+            "frame_size": int(SAMPLE_RATE * frame_ms / 1000),
+            "frame_ms": frame_ms,
+            "tier": self.name,
+            "tiers": list(TIERS),
+            "streams": list(NAMED_STREAMS),
+            "framing": 1,
+            "framings": [1, 2],
+            "frame_durations": list(FRAME_DURATIONS_MS),
+            "max_batch": MAX_BATCH,
+            "capture_ms": CAPTURE_MS,
+        }
+        if self.bitrate:
+            info["bitrate"] = self.bitrate
+        return info
+
+
+ENCODER_TIERS = {name: EncoderTier(name, *spec) for name, spec in TIERS.items()}
+if DEFAULT_TIER not in ENCODER_TIERS:
+    DEFAULT_TIER = "opus-64"
+
+
+class FrameRing:
+    """The most recent frames of one stream in preallocated storage.
+
+    Payloads are packed back to back into an arena that wraps around;
+    sequence numbers, capture timestamps, offsets and lengths live in parallel
+    typed arrays, all carved out of one buffer. Appending copies the payload
+    once and allocates nothing. The oldest frames are evicted when their slot
+    or their bytes are needed, so capacity bounds both the frame count and the
+    memory.
+
+    With a name the buffer is a shared memory segment, which fan-out workers
+    attach to read-only: the header carries the layout, and readers re-check
+    the oldest index after copying so frames overwritten meanwhile are
+    dropped rather than returned torn.
+    """
+
+    HEADER = 6  # int64: count, first, head, slots, capacity, reserved
+
+    def __init__(self, frames, capacity, name=None, attach=False):
+        self.shm = None
+        if name is None:
+            buf = memoryview(bytearray(self._size(frames, capacity)))
+        else:
+            from multiprocessing import shared_memory
+            if attach:
+                self.shm = shared_memory.SharedMemory(name=name)
+                # The creating (capture) process owns the segment: keep this
+                # process's resource tracker from unlinking it on exit
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            else:
+                try:
+                    shared_memory.SharedMemory(name=name).unlink()  # left by a crashed run
+                except FileNotFoundError:
+                    pass
+                self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                      size=self._size(frames, capacity))
+            buf = self.shm.buf
+        self.buf = buf
+        self.header = buf[:self.HEADER * 8].cast("q")
+        if attach:
+            frames, capacity = self.header[3], self.header[4]
+        else:
+            self.header[4] = capacity
+            self.header[3] = frames  # non-zero slots: layout is ready
+        self.slots = frames
+        pos = self.HEADER * 8
+        self.stamps = buf[pos:pos + 8 * frames].cast("q")
+        pos += 8 * frames
+        self.offsets = buf[pos:pos + 4 * frames].cast("I")
+        pos += 4 * frames
+        self.lengths = buf[pos:pos + 4 * frames].cast("I")
+        pos += 4 * frames
+        self.seqs = buf[pos:pos + 4 * frames].cast("I")
+        pos += 4 * frames
+        self.arena = buf[pos:pos + capacity]
+
+    @classmethod
+    def _size(cls, frames, capacity):
+        return cls.HEADER * 8 + 20 * frames + capacity
 
-    async with websockets.serve(handler, HOST, PORT):
-        print(f"[audio-ws] WebSocket server listening on ws://{HOST}:{PORT}", flush=True)
-        await broadcast_audio()
+    @classmethod
+    def attach(cls, name):
+        """Open a ring created by another process, or None if it isn't ready (yet)."""
+        try:
+            ring = cls(0, 0, name, attach=True)
+        except FileNotFoundError:
+            return None
+        if not ring.slots:
+            ring.close()
+            return None
+        return ring
+
+    @property
+    def count(self):
+        """Frames appended so far."""
+        return self.header[0]
+
+    @property
+    def first(self):
+        """Index (in append order) of the oldest frame held."""
+        return self.header[1]
+
+    def close(self, unlink=False):
+        """Release a shared ring; unlink it too in the process that created it."""
+        if self.shm is None:
+            return
+        for view in (self.header, self.stamps, self.offsets, self.lengths, self.seqs, self.arena, self.buf):
+            view.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        self.shm = None
+
+    def append(self, seq, ts_us, payload):
+        size = len(payload)
+        capacity = len(self.arena)
+        if size > capacity:
+            return
+        header = self.header
+        count, first, start = header[0], header[1], header[2]
+        if count - first == self.slots:
+            first += 1
+        if start + size > capacity:
+            # Wrap: frames left in the tail are older than anything in front
+            while first < count and self.offsets[first % self.slots] >= start:
+                first += 1
+            start = 0
+        end = start + size
+        # Older frames sit ahead of the write position in arena order
+        while first < count and start <= self.offsets[first % self.slots] < end:
+            first += 1
+        header[1] = first  # evict before overwriting, for concurrent readers
+        self.arena[start:end] = payload
+        i = count % self.slots
+        self.offsets[i] = start
+        self.lengths[i] = size
+        self.seqs[i] = seq
+        self.stamps[i] = ts_us
+        header[2] = end
+        header[0] = count + 1  # publish last
+
+    def read(self, index, end=None):
+        """([(seq, ts_us, payload), ...] from append index on, next index).
+
+        Frames already evicted are skipped, so a reader that fell behind
+        resumes at the oldest frame still held.
+        """
+        count = self.header[0] if end is None else min(end, self.header[0])
+        index = max(index, self.header[1])
+        frames = []
+        for n in range(index, count):
+            i = n % self.slots
+            offset = self.offsets[i]
+            frames.append((self.seqs[i], self.stamps[i], bytes(self.arena[offset:offset + self.lengths[i]])))
+        first = self.header[1]
+        if first > index:
+            del frames[:first - index]
+        return frames, count
+
+    def since(self, ts_us, end=None):
+        """[(seq, ts_us, payload), ...] captured at or after ts_us (and
+        appended before index end), oldest first."""
+        index = self.header[0] if end is None else min(end, self.header[0])
+        first = self.header[1]
+        while index > first and self.stamps[(index - 1) % self.slots] >= ts_us:
+            index -= 1
+        return self.read(index, end)[0]
+
+
+class EncoderStream:
+    """A tier at one frame duration: its own encoder, PCM backlog and sequence.
+
+    Captured chunks are appended to the backlog and cut into frames of
+    frame_ms, so streams with frames longer than CAPTURE_MS collect several
+    chunks and shorter ones split a chunk. Sequence numbers and capture
+    timestamps are per stream and carried by framing v2. Every frame sent is
+    also kept in the stream's FrameRing.
+    """
+
+    def __init__(self, tier, frame_ms, ring_name=None):
+        self.tier = tier
+        self.frame_ms = frame_ms
+        self.frame_size = int(SAMPLE_RATE * frame_ms / 1000)
+        self.frame_bytes = self.frame_size * CHANNELS * 2
+        self.frame_us = int(frame_ms * 1000)
+        self.encoder = tier.make_encoder()
+        self.pending = bytearray()
+        self.pending_ts = 0
+        self.seq = 0
+        self.last_packet_size = 0  # for estimating bytes saved during silence
+        self.ring = None
+        # Fan-out workers read every frame from the ring, so it always
+        # exists in that mode
+        seconds = RING_SECONDS if RING_SECONDS > 0 or not WORKERS else 1.0
+        if seconds > 0:
+            frames = math.ceil(seconds * 1000 / frame_ms)
+            if self.encoder is None:
+                capacity = frames * self.frame_bytes
+            else:
+                # Twice the nominal bitrate leaves room for VBR peaks
+                capacity = int(seconds * tier.bitrate / 4) + frames * 8
+            self.ring = FrameRing(frames, capacity, ring_name)
+
+    def feed(self, pcm, ts_us):
+        """Append a captured chunk; return the complete (seq, ts_us, pcm) frames."""
+        if not self.pending:
+            self.pending_ts = ts_us
+        self.pending += pcm
+        frames = []
+        while len(self.pending) >= self.frame_bytes:
+            frames.append((self.seq, self.pending_ts, bytes(self.pending[:self.frame_bytes])))
+            del self.pending[:self.frame_bytes]
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            self.pending_ts += self.frame_us
+        return frames
+
+    def reset(self):
+        self.pending.clear()
+
+
+def _ring_name(key):
+    """Shared memory name of a stream's ring in fan-out worker mode."""
+    return f"audio-ws-{PORT}-{key[0]}-{key[1]}-{round(key[2] * 10)}"
+
+
+def pack_v2(tier, frame_ms, frames):
+    """Build one framing v2 message from [(seq, ts_us, payload), ...]."""
+    seq, ts_us, _ = frames[0]
+    parts = [FRAMING_V2_HEADER.pack(2, ENCODER_TIERS[tier].index, len(frames),
+                                    int(frame_ms * 2), seq, ts_us)]
+    for _, _, payload in frames:
+        parts.append(struct.pack("!H", len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def _framing_options(cmd, framing=1, frame_ms=20.0, batch=1):
+    """Validated (framing, frame_ms, batch) from a control message."""
+    framing = 2 if cmd.get("framing", framing) == 2 else 1
+    try:
+        frame_ms = float(cmd.get("frame_ms", frame_ms))
+    except (TypeError, ValueError):
+        frame_ms = 20.0
+    if frame_ms not in FRAME_DURATIONS_MS:
+        frame_ms = 20.0
+    try:
+        batch = min(max(int(cmd.get("batch", batch)), 1), MAX_BATCH)
+    except (TypeError, ValueError):
+        batch = 1
+    if framing == 1:
+        # v1 clients assume one bare 20ms packet per message
+        frame_ms, batch = 20.0, 1
+    return framing, frame_ms, batch
+
+
+class SilenceGate:
+    """Decides per captured frame whether it is worth encoding and sending.
+
+    A chunk is silent when its peak absolute sample is <= SILENCE_PEAK
+    (vectorised over the int16 buffer). After SILENCE_HANGOVER_CHUNKS silent
+    chunks in a row the gate closes: listeners get {"event": "silence",
+    "active": true} and nothing else until sound returns, when they get
+    "active": false right before the first audible frame.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.silent_run = 0
+        self.frames = 0          # captured chunks gated
+        self.packets_saved = 0   # frames not sent, summed over listeners
+        self.bytes_saved = 0
+
+    def reset(self):
+        self.active = False
+        self.silent_run = 0
+
+    def update(self, pcm):
+        """Return (gated, changed) for this frame."""
+        if SILENCE_PEAK <= 0:
+            return False, False
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        peak = max(int(samples.max()), -int(samples.min()))
+        if peak > SILENCE_PEAK:
+            self.silent_run = 0
+            if self.active:
+                self.active = False
+                return False, True
+            return False, False
+        self.silent_run += 1
+        if self.active:
+            return True, False
+        if self.silent_run > SILENCE_HANGOVER_CHUNKS:
+            self.active = True
+            return True, True
+        return False, False
+
+    def event(self):
+        return json.dumps({"event": "silence", "active": self.active})
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "chunks_gated": self.frames,
+            "packets_saved": round(self.packets_saved),
+            "bytes_saved": round(self.bytes_saved),
+        }
+
+
+class NamedStream:
+    """A PulseAudio sink whose monitor is captured on demand, by name.
+
+    Each has its own encoder streams (keyed (name, tier, frame_ms), like the
+    senders subscribed to them), silence gate and CaptureController, so a
+    stream nobody listens to costs nothing. App streams pull the matching
+    applications' sink-inputs into their sink while captured and hand them
+    back when capture stops.
+    """
+
+    def __init__(self, name, sink, apps=()):
+        self.name = name
+        self.sink = sink
+        self.apps = apps
+        self.streams = {}  # (name, tier name, frame_ms) -> EncoderStream
+        self.silence = SilenceGate()
+        self.capture = None  # CaptureController, created in main()
+        self.routed = {}  # sink-input index -> sink it was moved from
+
+    def stream(self, key):
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = EncoderStream(
+                ENCODER_TIERS[key[1]], key[2], _ring_name(key) if WORKERS else None)
+        return stream
+
+    def senders(self):
+        return [sender for sender in AUDIO_PLAYING_CLIENTS.values() if sender.stream_name == self.name]
+
+    def info(self):
+        return {"sink": self.sink, "apps": list(self.apps), "listeners": len(self.senders()),
+                "capture_running": bool(self.capture and self.capture.running)}
+
+    async def setup_sink(self):
+        """Create the stream's sink (the main one also becomes the default)."""
+        if self.name == DEFAULT_STREAM:
+            return await setup_null_sink()
+        try:
+            await _ensure_sink(self.sink, f"Webcode-{self.name}")
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            print(f"[audio-ws] ERROR setting up sink for stream '{self.name}': {e}", flush=True)
+            return False
+
+    async def _app_inputs(self):
+        """[(sink-input index, sink name)] of applications matching self.apps."""
+        _, sinks = await _pactl("list", "short", "sinks", check=True)
+        _, clients = await _pactl("list", "short", "clients", check=True)
+        _, inputs = await _pactl("list", "short", "sink-inputs", check=True)
+        sink_names = dict(line.split("\t")[:2] for line in sinks.splitlines() if "\t" in line)
+        binaries = {}
+        for line in clients.splitlines():
+            fields = line.split("\t")
+            if len(fields) >= 3:
+                binaries[fields[0]] = fields[-1].strip().lower()
+        matches = []
+        for line in inputs.splitlines():
+            fields = line.split("\t")
+            if len(fields) < 3:
+                continue
+            binary = binaries.get(fields[2], "")
+            if binary and any(app in binary for app in self.apps):
+                matches.append((fields[0], sink_names.get(fields[1], fields[1])))
+        return matches
+
+    async def route_apps(self):
+        """While captured, keep moving matching applications into the sink."""
+        while True:
+            try:
+                for index, sink in await self._app_inputs():
+                    if sink != self.sink:
+                        await _pactl("move-sink-input", index, self.sink, check=True)
+                        self.routed.setdefault(index, sink)
+                        print(f"[audio-ws] stream '{self.name}': sink-input {index} moved from {sink}", flush=True)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+                print(f"[audio-ws] stream '{self.name}': app routing failed: {e}", flush=True)
+            await asyncio.sleep(APP_ROUTE_SECONDS)
+
+    async def unroute_apps(self):
+        """Give routed applications back to the sinks they came from."""
+        routed, self.routed = self.routed, {}
+        for index, sink in routed.items():
+            try:
+                await _pactl("move-sink-input", index, sink)
+            except (subprocess.TimeoutExpired, OSError):
+                pass
+
+
+def _parse_streams(spec):
+    """{name: NamedStream} for "main" plus the AUDIO_STREAMS entries."""
+    channels = {DEFAULT_STREAM: NamedStream(DEFAULT_STREAM, PULSE_SINK)}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, source = entry.partition("=")
+        name = name.strip()
+        if not name.replace("-", "").replace("_", "").isalnum() or name in channels:
+            print(f"[audio-ws] ignoring stream '{entry}': bad or duplicate name", flush=True)
+            continue
+        kind, _, arg = source.partition(":")
+        if kind == "sink" and arg:
+            channels[name] = NamedStream(name, arg)
+        elif kind == "app" and arg:
+            apps = tuple(app.strip().lower() for app in arg.split("|") if app.strip())
+            channels[name] = NamedStream(name, f"webcode_{name}", apps)
+        elif not source:
+            channels[name] = NamedStream(name, f"webcode_{name}")
+        else:
+            print(f"[audio-ws] ignoring stream '{entry}': expected sink:<name> or app:<binary>", flush=True)
+    return channels
+
+
+NAMED_STREAMS = _parse_streams(STREAMS_SPEC)
+MAIN_STREAM = NAMED_STREAMS[DEFAULT_STREAM]
+
+
+class AudioSender:
+    """Bounded per-client send queue drained by its own task.
+
+    The capture loop only calls push()/push_frame(), which never await, so a
+    slow listener can fall behind (and get resynced) without delaying pacat
+    reads, the encoder, or any other listener.
+
+    Each sender is subscribed to one encoder stream: a tier at a frame
+    duration of one named stream. Framing v1 sends one bare 20ms packet per
+    message; framing v2 adds a header and packs `batch` frames per message.
+    With auto-tiering on, the peak lag (see below) over each AUTO_TIER_WINDOW
+    frames' worth of audio moves the client down the TIER_LADDER when it lags
+    and back up (never above the tier it asked for) once its link has been
+    calm for AUTO_TIER_UP_WINDOWS windows. Queue limits are scaled from 20ms
+    frames to the client's message duration. Frames from the stream's ring
+    (prebuffer, replay) go out as one queue entry so a burst doesn't count as
+    backlog.
+
+    Falling behind is measured in time: how long a message waited in the
+    queue plus the audio still buffered below it (websockets' write buffer
+    and the kernel's send queue, both kept small with SEND_BUFFER_BYTES).
+    Audio that would play more than RESYNC_FRAMES late is discarded with the
+    rest of the backlog, until the buffers have drained, and the client is
+    told to resync.
+    """
+
+    remote = False
+
+    def __init__(self, ws, tier=DEFAULT_TIER, auto=True):
+        self.ws = ws
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        self.resyncs = 0
+        self._skipping = False
+        self._byte_rate = 0.0  # bytes per second of audio last sent
+        self.bytes_out = 0
+        self.stream_name = DEFAULT_STREAM
+        self.tier = tier
+        self.max_tier = tier
+        self.auto = auto
+        self.framing = 1
+        self.frame_ms = 20.0
+        self.batch = 1
+        self._batch = []
+        self.hold_until_us = 0  # live frames are skipped until a replay has played
+        self._scale_limits()
+        self._window_frames = 0
+        self._window_lag = 0.0
+        self._window_resyncs = 0
+        self._calm_windows = 0
+        self.task = asyncio.ensure_future(self._run())
+
+    @property
+    def stream_key(self):
+        return (self.stream_name, self.tier, self.frame_ms)
+
+    def _scale_limits(self):
+        per_message = FRAME_SECONDS / (self.frame_ms * self.batch / 1000)
+        self.queue = collections.deque(maxlen=max(4, round(SEND_QUEUE_FRAMES * per_message)))
+        self.resync_seconds = self.frame_ms * self.batch / 1000 + RESYNC_FRAMES * FRAME_SECONDS
+        self.window_limit = max(1, round(AUTO_TIER_WINDOW * per_message))
+        self.down_seconds = self.frame_ms * self.batch / 1000 + AUTO_TIER_DOWN_FRAMES * FRAME_SECONDS
+
+    def push(self, data, ts_us=None, frames=0):
+        """Queue a message; ts_us (capture time) and frames feed the metrics."""
+        if self.closed:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self._drop(1, self.queue[0][2])
+        self.queue.append((data, ts_us, frames, time.monotonic()))
+        self.ready.set()
+        self._track_backlog()
+
+    def _drop(self, messages, frames):
+        self.dropped += messages
+        METRICS.inc("frames_dropped", frames)
+
+    def _drop_backlog(self):
+        """Discard queued audio; control messages stay queued."""
+        controls = [m for m in self.queue if isinstance(m[0], str)]
+        if len(controls) < len(self.queue):
+            self._drop(len(self.queue) - len(controls), sum(m[2] for m in self.queue))
+        self.queue.clear()
+        self.queue.extend(controls)
+        # A replay that was discarded doesn't hold live audio back any more
+        self.hold_until_us = 0
+
+    def push_frame(self, seq, ts_us, payload):
+        if self.framing == 1:
+            self.push(payload, ts_us, 1)
+            return
+        self._batch.append((seq, ts_us, payload))
+        if len(self._batch) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Send a partially filled v2 batch (e.g. before a silence gap)."""
+        if self._batch:
+            frames, self._batch = self._batch, []
+            self.push(pack_v2(self.tier, self.frame_ms, frames), frames[0][1], len(frames))
+
+    def push_burst(self, frames):
+        """Queue ring frames [(seq, ts_us, payload), ...] ahead of live audio."""
+        if not frames:
+            return
+        if self.framing == 1:
+            messages = [payload for _, _, payload in frames]
+        else:
+            messages = [pack_v2(self.tier, self.frame_ms, frames[i:i + MAX_BATCH])
+                        for i in range(0, len(frames), MAX_BATCH)]
+        self.push(messages, None, len(frames))
+
+    def replay(self, frames):
+        """Send ring frames now and hold live audio until they have played."""
+        self._batch = []
+        self.push_burst(frames)
+        self.hold_until_us = int(time.time() * 1_000_000) + int(len(frames) * self.frame_ms * 1000)
+
+    def codec_info(self):
+        info = ENCODER_TIERS[self.tier].codec_info(self.frame_ms)
+        info["stream"] = self.stream_name
+        info["framing"] = self.framing
+        info["batch"] = self.batch
+        return info
+
+    def configure(self, tier=None, auto=None, framing=None, frame_ms=None, batch=None, stream=None):
+        """Switch stream or framing; the client gets codec_info before the first new frame."""
+        if stream is not None:
+            self.stream_name = stream
+        if auto is not None:
+            self.auto = auto
+        if tier is not None:
+            self.tier = tier
+        if framing is not None:
+            self.framing, self.frame_ms, self.batch = framing, frame_ms, batch
+        # Old frames must not reach a decoder configured for the new stream;
+        # queued control messages (proxied responses in a worker) still go out
+        self._drop_backlog()
+        if self._batch:
+            self._drop(0, len(self._batch))
+            self._batch = []
+        controls = list(self.queue)
+        self._scale_limits()
+        self.queue.extend(controls)
+        self.queue.append((json.dumps(self.codec_info()), None, 0, time.monotonic()))
+        self.ready.set()
+
+    def set_tier(self, tier, auto=None):
+        self.configure(tier=tier, auto=auto)
+
+    def _track_backlog(self):
+        self._window_frames += 1
+        if self._window_frames < self.window_limit:
+            return
+        # Audio stuck behind a send that hasn't returned is lag already
+        lag = self._window_lag
+        if self.queue:
+            lag = max(lag, time.monotonic() - self.queue[0][3])
+        lagging = lag >= self.down_seconds or self.resyncs > self._window_resyncs
+        calm = lag <= FRAME_SECONDS
+        self._window_frames = 0
+        self._window_lag = 0.0
+        self._window_resyncs = self.resyncs
+        if not self.auto or self.tier not in TIER_LADDER:
+            return
+        rung = TIER_LADDER.index(self.tier)
+        if lagging:
+            self._calm_windows = 0
+            if rung > 0:
+                self._auto_switch(TIER_LADDER[rung - 1])
+        elif calm:
+            self._calm_windows += 1
+            ceiling = TIER_LADDER.index(self.max_tier) if self.max_tier in TIER_LADDER else rung
+            if self._calm_windows >= AUTO_TIER_UP_WINDOWS and rung < ceiling:
+                self._calm_windows = 0
+                self._auto_switch(TIER_LADDER[rung + 1])
+        else:
+            self._calm_windows = 0
+
+    def _auto_switch(self, tier):
+        print(f"[audio-ws] auto-tier: {self.tier} -> {tier} ({self.ws.remote_address})", flush=True)
+        self.set_tier(tier)
+
+    async def _run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue:
+                    data, ts_us, frames, queued = self.queue.popleft()
+                    lag = self._lag(queued) if frames else 0.0
+                    if lag > self.resync_seconds:
+                        # Skip to live: discard the backlog, keep control
+                        # messages, and keep dropping audio until what is
+                        # already buffered has drained
+                        self._drop(1, frames)
+                        self._drop_backlog()
+                        if not self._skipping:
+                            self._skipping = True
+                            self.resyncs += 1
+                            METRICS.inc("resyncs")
+                            await self.ws.send(self._resync_event())
+                        continue
+                    if isinstance(data, list):
+                        # A ring burst: several messages, no latency sample
+                        size = 0
+                        for message in data:
+                            await self.ws.send(message)
+                            size += len(message)
+                    else:
+                        await self.ws.send(data)
+                        size = len(data)
+                    if frames:
+                        self._skipping = False
+                        self._window_lag = max(self._window_lag, lag)
+                        self._byte_rate = size / (frames * self.frame_ms / 1000)
+                        self.bytes_out += size
+                        METRICS.inc("frames_sent", frames)
+                        METRICS.inc("bytes_out", size)
+                        if ts_us is not None:
+                            METRICS.latency_seconds.observe(time.time() - ts_us / 1_000_000)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass
+        finally:
+            self.closed = True
+            self.queue.clear()
+
+    def _lag(self, queued):
+        """Seconds of audio ahead of a message queued at queued: its wait in
+        the queue plus what websockets and the kernel still buffer."""
+        lag = time.monotonic() - queued
+        transport = self.ws.transport
+        if self._byte_rate and transport is not None:
+            buffered = transport.get_write_buffer_size()
+            sock = transport.get_extra_info("socket")
+            if sock is not None:
+                try:
+                    buffered += struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0" * 4))[0]
+                except OSError:
+                    pass
+            lag += buffered / self._byte_rate
+        return lag
+
+    def _resync_event(self):
+        return json.dumps({
+            "event": "resync",
+            "dropped": self.dropped,
+        })
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()
+        if self.resyncs:
+            print(f"[audio-ws] sender closed: {self.resyncs} resyncs, {self.dropped} frames dropped", flush=True)
+
+
+class RemoteSender(AudioSender):
+    """A listener served by a fan-out worker, as seen by the capture process.
+
+    It subscribes the worker's client to a stream (so the stream gets
+    encoded) and forwards control messages over the worker's proxy
+    connection. Audio never goes through it: the worker reads frames from
+    the shared ring. Stream changes, flushes, prebuffer bursts and replays
+    become {"worker": ...} commands that the worker applies to its own
+    sender in order with everything else.
+    """
+
+    remote = True
+
+    def push(self, data, ts_us=None, frames=0):
+        if not frames:
+            super().push(data)
+
+    def push_frame(self, seq, ts_us, payload):
+        pass
+
+    def flush(self):
+        super().push(json.dumps({"worker": "flush"}))
+
+    def push_burst(self, frames):
+        if frames:
+            super().push(json.dumps({"worker": "burst", "since_us": frames[0][1], "frames": len(frames)}))
+
+    def replay(self, frames):
+        super().push(json.dumps({"worker": "replay", "since_us": frames[0][1] if frames else 0,
+                                 "frames": len(frames)}))
+
+    def codec_info(self):
+        return {"worker": "configure", "stream": self.stream_name, "tier": self.tier, "auto": self.auto,
+                "max_tier": self.max_tier, "framing": self.framing, "frame_ms": self.frame_ms,
+                "batch": self.batch}
+
+    def _track_backlog(self):
+        pass  # auto-tiering happens in the worker, which reports switches
+
+
+class WorkerSender(AudioSender):
+    """A fan-out worker's sender; tells the capture process about tier switches."""
+
+    def __init__(self, ws, upstream, tier=DEFAULT_TIER, auto=True):
+        super().__init__(ws, tier, auto)
+        self.upstream = upstream
+
+    def configure(self, *args, **kwargs):
+        super().configure(*args, **kwargs)
+        ring = _shared_ring(self.stream_key)
+        if ring is not None:
+            # Ring frames before the fan-out position go out as a burst
+            # (prebuffer, replay), everything after it live
+            SHARED_CURSORS.setdefault(self.stream_key, ring.count)
+
+    def _auto_switch(self, tier):
+        super()._auto_switch(tier)
+        asyncio.ensure_future(self.upstream.send(json.dumps({"action": "worker_tier", "tier": tier})))
+
+
+def _disable_audio(ws):
+    sender = AUDIO_PLAYING_CLIENTS.pop(ws, None)
+    if sender:
+        sender.close()
+        NAMED_STREAMS[sender.stream_name].capture.release()
+
+
+def _ring_frames(sender, ms):
+    """The sender's stream frames from the last ms milliseconds of its ring."""
+    ms = min(ms, RING_SECONDS * 1000)
+    stream = NAMED_STREAMS[sender.stream_name].streams.get(sender.stream_key)
+    if stream is None or stream.ring is None or not ms > 0:
+        return []
+    return stream.ring.since(int(time.time() * 1_000_000) - int((ms + stream.frame_ms) * 1000))
+
+
+class SyntheticCapture:
+    """Stand-in for the pacat recorder when AUDIO_BACKEND=synthetic.
+
+    Generated sources (sine, noise) are paced to real time; a pipe or file
+    path is read as fast as its writer delivers. Mimics the parts of an
+    asyncio subprocess that broadcast_audio() uses.
+    """
+
+    pid = None
+    returncode = None
+
+    def __init__(self, source):
+        self.label = f"synthetic {source}"
+        self.source = source
+        self.stdout = self
+        self._file = None
+        self._next = None
+        self._pos = 0
+        self._rng = np.random.default_rng(0)
+
+    async def readexactly(self, n):
+        loop = asyncio.get_running_loop()
+        if self.source not in ("sine", "noise"):
+            data = await loop.run_in_executor(None, self._read, n)
+            if len(data) < n:
+                raise asyncio.IncompleteReadError(data, n)
+            return data
+        frames = n // (CHANNELS * 2)
+        now = loop.time()
+        self._next = (self._next or now) + frames / SAMPLE_RATE
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+        if self.source == "sine":
+            t = np.arange(self._pos, self._pos + frames) / SAMPLE_RATE
+            mono = 10000 * np.sin(2 * np.pi * 440 * t)
+        else:
+            mono = self._rng.normal(0, 3000, frames)
+        self._pos += frames
+        samples = np.repeat(np.clip(mono, -32768, 32767).astype(np.int16), CHANNELS)
+        return samples.tobytes()
+
+    def _read(self, n):
+        if self._file is None:
+            self._file = open(self.source, "rb")  # blocks until a fifo has a writer
+        return self._file.read(n)
+
+    def terminate(self):
+        self.returncode = 0
+        if self._file is not None:
+            self._file.close()
+
+    async def wait(self):
+        return 0
+
+
+class _PaSampleSpec(ctypes.Structure):
+    _fields_ = [("format", ctypes.c_int), ("rate", ctypes.c_uint32), ("channels", ctypes.c_uint8)]
+
+
+class _PaBufferAttr(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint32) for name in ("maxlength", "tlength", "prebuf", "minreq", "fragsize")]
+
+
+_PA_SAMPLE_S16LE = 3
+_PA_STREAM_PLAYBACK = 1
+_PA_STREAM_RECORD = 2
+_PA_DEFAULT = 0xFFFFFFFF  # (uint32_t) -1: let the server choose
+_pulse_simple = None
+
+
+def _load_pulse_simple():
+    """libpulse-simple via ctypes, or None when it is not installed."""
+    global _pulse_simple
+    if _pulse_simple is None:
+        try:
+            lib = ctypes.CDLL(ctypes.util.find_library("pulse-simple") or "libpulse-simple.so.0")
+            pulse = ctypes.CDLL(ctypes.util.find_library("pulse") or "libpulse.so.0")
+        except OSError as e:
+            print(f"[audio-ws] libpulse-simple unavailable ({e}), using pacat", flush=True)
+            _pulse_simple = False
+            return None
+        lib.pa_simple_new.restype = ctypes.c_void_p
+        lib.pa_simple_new.argtypes = [
+            ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p,
+            ctypes.POINTER(_PaSampleSpec), ctypes.c_void_p, ctypes.POINTER(_PaBufferAttr),
+            ctypes.POINTER(ctypes.c_int),
+        ]
+        for name in ("pa_simple_read", "pa_simple_write"):
+            getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+                                           ctypes.POINTER(ctypes.c_int)]
+        lib.pa_simple_free.argtypes = [ctypes.c_void_p]
+        lib.pa_simple_free.restype = None
+        pulse.pa_strerror.restype = ctypes.c_char_p
+        lib.pa_strerror = pulse.pa_strerror
+        _pulse_simple = lib
+    return _pulse_simple or None
+
+
+class PulseSimpleStream:
+    """In-process PulseAudio record or playback stream (AUDIO_BACKEND=pulse-simple).
+
+    Replaces a pacat subprocess and its pipe: the blocking pa_simple_new
+    connect and pa_simple_read/write calls run on a dedicated thread (ctypes
+    releases the GIL), records land in a small ring of preallocated buffers,
+    and fragsize/tlength are set explicitly. Create streams with open().
+    Exposes the subset of the asyncio subprocess API
+    (stdout.readexactly, stdin.write/drain, terminate, wait, returncode)
+    that the capture loop and the mic mixer use.
+    """
+
+    pid = None
+    RING = 4  # capture buffers in rotation; a chunk is consumed long before reuse
+
+    def __init__(self, lib, direction, device, latency_ms):
+        self.lib = lib
+        self.label = f"libpulse-simple ({device})"
+        self.stdout = self.stdin = self
+        self.returncode = None
+        self._closed = asyncio.get_running_loop().create_future()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pulse")
+        self._pending = None  # last submitted write
+        self._ring = []
+        self._slot = 0
+        self._direction = direction
+        self._device = device
+        self._latency_ms = latency_ms
+        self._handle = None
+
+    @classmethod
+    async def open(cls, lib, direction, device, latency_ms):
+        """Connect a stream off the event loop: pa_simple_new blocks, for
+        long while PulseAudio is (re)starting."""
+        stream = cls(lib, direction, device, latency_ms)
+        try:
+            await asyncio.get_running_loop().run_in_executor(stream._pool, stream._connect)
+        except OSError:
+            stream._pool.shutdown(wait=False)
+            raise
+        return stream
+
+    def _connect(self):
+        spec = _PaSampleSpec(_PA_SAMPLE_S16LE, SAMPLE_RATE, CHANNELS)
+        nbytes = int(SAMPLE_RATE * self._latency_ms / 1000) * CHANNELS * 2
+        attr = _PaBufferAttr(_PA_DEFAULT, _PA_DEFAULT, _PA_DEFAULT, _PA_DEFAULT, _PA_DEFAULT)
+        if self._direction == _PA_STREAM_RECORD:
+            attr.fragsize = nbytes
+        else:
+            attr.tlength = nbytes
+        error = ctypes.c_int(0)
+        server = os.environ.get("PULSE_SERVER", f"unix:{PULSE_SOCKET}").encode()
+        self._handle = self.lib.pa_simple_new(
+            server, b"audio-ws", self._direction, self._device.encode(), b"webcode",
+            ctypes.byref(spec), None, ctypes.byref(attr), ctypes.byref(error))
+        if not self._handle:
+            raise OSError(f"pa_simple_new({self._device}): {self.lib.pa_strerror(error.value).decode()}")
+
+    def _call(self, fn, buf, n):
+        error = ctypes.c_int(0)
+        if fn(self._handle, buf, n, ctypes.byref(error)) < 0:
+            raise OSError(self.lib.pa_strerror(error.value).decode())
+
+    async def readexactly(self, n):
+        if len(self._ring) != self.RING or len(self._ring[0]) != n:
+            self._ring = [bytearray(n) for _ in range(self.RING)]
+        buf = self._ring[self._slot]
+        self._slot = (self._slot + 1) % self.RING
+        try:
+            if self.returncode is not None:
+                raise OSError("stream closed")
+            c_buf = (ctypes.c_char * n).from_buffer(buf)
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool, self._call, self.lib.pa_simple_read, c_buf, n)
+        except OSError as e:
+            print(f"[audio-ws] pa_simple_read: {e}", flush=True)
+            self._close(1)
+            raise asyncio.IncompleteReadError(b"", n)
+        return memoryview(buf)
+
+    def write(self, data):
+        if self.returncode is None:
+            self._pending = asyncio.get_running_loop().run_in_executor(
+                self._pool, self._call, self.lib.pa_simple_write, bytes(data), len(data))
+
+    async def drain(self):
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        try:
+            await pending
+        except OSError as e:
+            self._close(1)
+            raise ConnectionResetError(f"pa_simple_write: {e}") from None
+
+    def _close(self, code):
+        if self.returncode is None:
+            self.returncode = code
+        if not self._closed.done():
+            self._closed.set_result(self.returncode)
+
+    def terminate(self):
+        self._close(0)
+
+    async def wait(self):
+        code = await self._closed
+        if self._handle:
+            # The worker thread finishes its current call before the free
+            handle, self._handle = self._handle, None
+            await asyncio.get_running_loop().run_in_executor(self._pool, self.lib.pa_simple_free, handle)
+            self._pool.shutdown(wait=False)
+        return code
+
+
+def _use_pulse_simple():
+    return CAPTURE_BACKEND == "pulse-simple" and _load_pulse_simple() is not None
+
+
+async def _open_capture(named):
+    """Start the capture source of a named stream for the configured backend."""
+    if CAPTURE_BACKEND == "synthetic":
+        return SyntheticCapture(SYNTH_SOURCE)
+    if _use_pulse_simple():
+        return await PulseSimpleStream.open(_load_pulse_simple(), _PA_STREAM_RECORD,
+                                            f"{named.sink}.monitor", PULSE_FRAGMENT_MS)
+    cmd = [
+        "pacat", "--record",
+        "-d", f"{named.sink}.monitor",
+        "--format=s16le",
+        f"--rate={SAMPLE_RATE}",
+        f"--channels={CHANNELS}",
+        "--latency-msec=5",
+    ]
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=PULSE_ENV,
+    )
+
+
+class RestartBackoff:
+    """Exponential restart delay that resets once a run has been stable."""
+
+    def __init__(self, initial=0.1, maximum=5.0, stable=10.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.stable = stable
+        self.delay = initial
+
+    def next(self, ran_for):
+        if ran_for >= self.stable:
+            self.delay = self.initial
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        return delay
+
+
+async def broadcast_audio(named, requested_at):
+    """Read a named stream from pacat, encode with Opus, broadcast to its listeners.
+
+    Codec: Opus, 48000Hz (APPLICATION_RESTRICTED_LOWDELAY), one EncoderStream
+    per (tier, frame duration) that currently has listeners. Each frame is
+    encoded once per stream and every listener of the stream is handed the
+    same packet object (or the same framing v2 message when it is not
+    batching). A v1 WebSocket message is one raw 20ms Opus packet (~160 bytes
+    vs 3840 bytes raw PCM), or the raw frame for the "pcm" tier.
+    Frames are handed to each client's AudioSender; this loop never awaits a send.
+
+    pacat exiting is not fatal: it is restarted with backoff while sessions
+    and encoders stay up, and listeners get {"event": "discontinuity"} with
+    the gap once audio flows again. Cancelled by CaptureController when
+    nobody listens.
+    """
+    named.silence.reset()
+    backoff = RestartBackoff()
+    lost_at = None  # monotonic time capture was lost, until it recovers
+
+    def on_first_frame():
+        nonlocal lost_at
+        now = time.monotonic()
+        if lost_at is None:
+            print(
+                f"[audio-ws] capture of '{named.name}' started, first frame after {(now - requested_at) * 1000:.0f}ms"
+                f" ({(now - STARTED_AT) * 1000:.0f}ms since server start)",
+                flush=True,
+            )
+            return
+        gap = now - lost_at
+        lost_at = None
+        METRICS.recovery_seconds.observe(gap)
+        METRICS.last_recovery_seconds = gap
+        print(f"[audio-ws] capture of '{named.name}' recovered after {gap * 1000:.0f}ms", flush=True)
+        event = json.dumps({"event": "discontinuity", "gap_ms": round(gap * 1000)})
+        for sender in named.senders():
+            sender.push(event)
+
+    while True:
+        await AUDIO_READY.wait()
+        started = time.monotonic()
+        chunks = 0
+        try:
+            proc = await _open_capture(named)
+        except OSError as e:
+            print(f"[audio-ws] capture start failed: {e}", flush=True)
+        else:
+            source = getattr(proc, "label", None) or f"pacat (pid={proc.pid})"
+            print(
+                f"[audio-ws] {source} started for stream '{named.name}' ({named.sink}), "
+                f"Opus tiers {', '.join(TIER_LADDER)} @ {SAMPLE_RATE}Hz "
+                f"{CAPTURE_MS:g}ms chunks → ws://{HOST}:{PORT}",
+                flush=True,
+            )
+            try:
+                chunks = await _capture_loop(named, proc, on_first_frame)
+                print(f"[audio-ws] {source} EOF, exit code={await proc.wait()}", flush=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[audio-ws] broadcast_audio error: {e}", flush=True)
+            finally:
+                try:
+                    proc.terminate()
+                    await proc.wait()
+                except Exception:
+                    pass
+
+        # Keep sessions: deliver what was already encoded, drop half-built
+        # frames, and try again
+        if lost_at is None:
+            lost_at = time.monotonic()
+        for sender in named.senders():
+            sender.flush()
+        for stream in named.streams.values():
+            stream.reset()
+        METRICS.inc("pacat_restarts")
+        delay = backoff.next(time.monotonic() - started)
+        print(f"[audio-ws] restarting capture in {delay:.1f}s", flush=True)
+        await asyncio.sleep(delay)
+        if not chunks and CAPTURE_BACKEND != "synthetic":
+            # Never got audio: PulseAudio may have restarted without our sink
+            await named.setup_sink()
+
+
+async def _capture_loop(named, proc, on_first_frame):
+    """Encode and fan out chunks from one capture process until EOF.
+
+    Returns the number of chunks read.
+    """
+    chunks = 0
+    chunk_us = int(CAPTURE_SECONDS * 1_000_000)
+    while True:
+        try:
+            frame_pcm = await proc.stdout.readexactly(CAPTURE_BYTES)
+        except asyncio.IncompleteReadError:
+            return chunks
+        # Capture time of the chunk's first sample
+        ts_us = int(time.time() * 1_000_000) - chunk_us
+        METRICS.inc("frames_captured")
+
+        chunks += 1
+        if chunks == 1:
+            on_first_frame()
+
+        by_stream = {}
+        for sender in named.senders():
+            by_stream.setdefault(sender.stream_key, []).append(sender)
+        recorder = audio_recorder
+        if recorder is not None and recorder.stream_key[0] == named.name:
+            by_stream.setdefault(recorder.stream_key, [])
+        else:
+            recorder = None
+        gate = named.silence
+
+        gated, changed = gate.update(frame_pcm)
+        if changed:
+            event = gate.event()
+            for senders in by_stream.values():
+                for sender in senders:
+                    if gated:
+                        sender.flush()
+                    sender.push(event)
+            if gated:
+                for stream in named.streams.values():
+                    stream.reset()
+        if gated:
+            gate.frames += 1
+            if recorder is not None:
+                recorder.skip(CAPTURE_SECONDS)
+            for key, senders in by_stream.items():
+                stream = named.stream(key)
+                share = len(senders) * CAPTURE_MS / stream.frame_ms
+                gate.packets_saved += share
+                size = stream.frame_bytes if stream.encoder is None else stream.last_packet_size
+                gate.bytes_saved += size * share
+            continue
+
+        # Cut the chunk into frames for every subscribed stream, then
+        # encode all Opus frames in one batch
+        outputs = []  # [stream, seq, ts_us, payload]
+        jobs = []
+        for key in by_stream:
+            stream = named.stream(key)
+            for seq, frame_ts, pcm in stream.feed(frame_pcm, ts_us):
+                if stream.encoder is None:
+                    outputs.append([stream, seq, frame_ts, pcm])
+                else:
+                    outputs.append([stream, seq, frame_ts, None])
+                    jobs.append((stream.encoder, pcm, stream.tier.channels, stream.frame_size))
+        for key, stream in named.streams.items():
+            if key not in by_stream and stream.pending:
+                stream.reset()  # don't glue stale audio onto a later subscriber
+        if jobs:
+            packets = iter(await CODEC.encode_batch(jobs))
+            for out in outputs:
+                if out[3] is None:
+                    out[3] = next(packets)
+                    if out[3] is not None:
+                        out[0].last_packet_size = len(out[3])
+                        METRICS.inc("frames_encoded")
+
+        for stream, seq, frame_ts, payload in outputs:
+            key = (named.name, stream.tier.name, stream.frame_ms)
+            if recorder is not None and key == recorder.stream_key:
+                recorder.write(payload if payload is not None else recorder.empty_packet)
+            if payload is None:
+                continue
+            if stream.ring is not None:
+                stream.ring.append(seq, frame_ts, payload)
+            _fan_out(key, by_stream[key], seq, frame_ts, payload)
+
+
+def _fan_out(key, senders, seq, frame_ts, payload):
+    """Hand one frame of stream key to each of its senders."""
+    shared_v2 = None
+    for sender in senders:
+        if frame_ts < sender.hold_until_us:
+            continue
+        if sender.framing == 2 and sender.batch == 1:
+            if shared_v2 is None:
+                shared_v2 = pack_v2(key[1], key[2], [(seq, frame_ts, payload)])
+            sender.push(shared_v2, frame_ts, 1)
+        else:
+            sender.push_frame(seq, frame_ts, payload)
+
+
+class CaptureController:
+    """Runs broadcast_audio() for a named stream only while someone listens.
+
+    Capture starts on the first set_audio enabled=true for the stream and is
+    torn down once it has had no listeners for CAPTURE_IDLE_GRACE seconds.
+    Tier encoders outlive individual pacat runs so restarts stay cheap. App
+    routing runs alongside capture.
+    """
+
+    def __init__(self, named):
+        self.named = named
+        self.task = None
+        self.router = None
+        self._idle_timer = None
+        # Resolved if broadcast_audio() crashes (pacat exits are handled
+        # inside it); main() then exits and supervisor restarts us
+        self.failed = asyncio.get_running_loop().create_future()
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def acquire(self):
+        """A client started listening: cancel any pending stop, start if idle."""
+        if self._idle_timer:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self.running:
+            return
+        METRICS.inc("capture_starts")
+        self.task = asyncio.ensure_future(broadcast_audio(self.named, time.monotonic()))
+        self.task.add_done_callback(self._on_done)
+        if self.named.apps and CAPTURE_BACKEND != "synthetic":
+            self.router = asyncio.ensure_future(self.named.route_apps())
+
+    def _wanted(self):
+        recorder = audio_recorder
+        return bool(self.named.senders()) or (recorder is not None and recorder.stream_key[0] == self.named.name)
+
+    def release(self):
+        """A client stopped listening: schedule a stop if nobody is left."""
+        if self._wanted() or not self.running or self._idle_timer:
+            return
+        self._idle_timer = asyncio.get_running_loop().call_later(
+            CAPTURE_IDLE_GRACE, lambda: asyncio.ensure_future(self._stop_if_idle()))
+
+    async def _stop_if_idle(self):
+        self._idle_timer = None
+        if self._wanted() or not self.running:
+            return
+        t0 = time.monotonic()
+        self.task.cancel()
+        if self.router is not None:
+            self.router.cancel()
+            self.router = None
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        await self.named.unroute_apps()
+        print(f"[audio-ws] capture of '{self.named.name}' stopped (idle), teardown took {(time.monotonic() - t0) * 1000:.0f}ms", flush=True)
+
+    def _on_done(self, task):
+        if task.cancelled() or self.failed.done():
+            return
+        print(f"[audio-ws] capture task failed: {task.exception()!r}", flush=True)
+        self.failed.set_result(None)
+
+
+class MicInput:
+    """Per-client raw PCM uplink buffer: whole frames in arrival order."""
+
+    def __init__(self):
+        self.pending = bytearray()  # partial frame (raw PCM arrives in odd sizes)
+        self.frames = collections.deque()
+        self.gain = 1.0
+        self.muted = False
+        self.playing = False        # True once MIC_TARGET_FRAMES have arrived
+        self.received = 0
+        self.underruns = 0
+        self.dropped = 0
+
+    def feed(self, pcm):
+        self.pending += pcm
+        while len(self.pending) >= CHUNK_BYTES:
+            self.frames.append(bytes(self.pending[:CHUNK_BYTES]))
+            del self.pending[:CHUNK_BYTES]
+            self.received += 1
+            METRICS.inc("mic_frames_in")
+            if len(self.frames) > MIC_MAX_FRAMES:
+                self.frames.popleft()
+                self.dropped += 1
+
+    def take(self):
+        """Next frame for this tick: PCM bytes, or None to skip this client."""
+        if not self.playing:
+            if len(self.frames) < MIC_TARGET_FRAMES:
+                return None
+            self.playing = True
+        if not self.frames:
+            # Ran dry: rebuild the prebuffer before mixing this client again
+            self.playing = False
+            self.underruns += 1
+            return None
+        return self.frames.popleft()
+
+    def stats(self):
+        return {
+            "codec": "pcm",
+            "received": self.received,
+            "buffered": len(self.frames),
+            "underruns": self.underruns,
+            "dropped": self.dropped,
+        }
+
+
+class OpusMicInput(MicInput):
+    """Adaptive Opus playout buffer with in-band FEC and loss concealment.
+
+    Packets are keyed by sequence number: taken from a 4-byte big-endian
+    header when the client announced framing "seq", otherwise assigned in
+    arrival order. Decoding happens on the mixer tick, which lets a missing
+    frame be rebuilt from the next packet's FEC data, or concealed (PLC)
+    when nothing usable has arrived. The target delay follows an RFC 3550
+    style interarrival jitter estimate, bounded by AUDIO_MIC_TARGET_MS and
+    AUDIO_MIC_MAX_MS.
+    """
+
+    def __init__(self, decoder, seq_framing=False):
+        super().__init__()
+        self.decoder = decoder
+        self.seq_framing = seq_framing
+        self.packets = {}           # seq -> Opus packet
+        self.next_seq = None        # seq due on the next tick while playing
+        self.max_seq = -1
+        self.arrivals = 0
+        self.target = MIC_TARGET_FRAMES
+        self.jitter = 0.0           # seconds
+        self._base = None           # monotonic time of seq 0
+        self._last_transit = None
+        self._concealed = 0         # consecutive PLC frames
+        self.late = 0
+        self.fec = 0
+        self.plc = 0
+        self.decode_errors = 0
+
+    def feed(self, message):
+        if self.seq_framing:
+            if len(message) < 5:
+                return
+            seq = struct.unpack_from("!I", message)[0]
+            packet = bytes(message[4:])
+        else:
+            seq = self.arrivals
+            packet = bytes(message)
+        self.arrivals += 1
+        self.received += 1
+        METRICS.inc("mic_frames_in")
+        self._update_jitter(seq)
+        if self.next_seq is not None and seq < self.next_seq:
+            self.late += 1  # its slot was already concealed
+            return
+        if seq in self.packets:
+            return
+        self.packets[seq] = packet
+        if seq > self.max_seq:
+            self.max_seq = seq
+
+    def _update_jitter(self, seq):
+        now = time.monotonic()
+        if self._base is None:
+            self._base = now - seq * FRAME_SECONDS
+        transit = now - self._base - seq * FRAME_SECONDS
+        if self._last_transit is not None:
+            self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+        self._last_transit = transit
+        wanted = math.ceil(3 * self.jitter / FRAME_SECONDS) + 1
+        self.target = min(max(wanted, MIC_TARGET_FRAMES), MIC_MAX_FRAMES)
+
+    def take(self):
+        """Decode job (decoder, packet, fec) for this tick, or None to skip."""
+        if self.next_seq is None:
+            if len(self.packets) < self.target:
+                return None
+            self.next_seq = min(self.packets)
+        buffered = self.max_seq - self.next_seq + 1
+        if buffered > MIC_MAX_FRAMES:
+            # Too far behind: jump forward to the target delay
+            skip_to = self.max_seq - self.target + 1
+            for seq in range(self.next_seq, skip_to):
+                if self.packets.pop(seq, None) is not None:
+                    self.dropped += 1
+            self.next_seq = skip_to
+        elif buffered > 2 * self.target + 1 and self.next_seq in self.packets:
+            # Drift above target: drop one frame per tick to shrink the delay
+            del self.packets[self.next_seq]
+            self.dropped += 1
+            self.next_seq += 1
+
+        seq = self.next_seq
+        self.next_seq += 1
+        packet = self.packets.pop(seq, None)
+        if packet is not None:
+            self._concealed = 0
+            return (self.decoder, packet, False)
+        if not self.packets:
+            self.underruns += 1
+            if self._concealed >= MIC_MAX_CONCEAL_FRAMES:
+                # Talk spurt over (or client stalled): rebuffer from scratch
+                self.next_seq = None
+                self._concealed = 0
+                return None
+        self._concealed += 1
+        following = self.packets.get(seq + 1)
+        if following is not None:
+            self.fec += 1
+            return (self.decoder, following, True)
+        self.plc += 1
+        return (self.decoder, None, False)
+
+    def stats(self):
+        buffered = 0 if self.next_seq is None else max(0, self.max_seq - self.next_seq + 1)
+        return {
+            "codec": "opus",
+            "received": self.received,
+            "buffered": buffered,
+            "target_ms": round(self.target * FRAME_SECONDS * 1000),
+            "jitter_ms": round(self.jitter * 1000, 1),
+            "late": self.late,
+            "fec": self.fec,
+            "plc": self.plc,
+            "underruns": self.underruns,
+            "dropped": self.dropped,
+            "decode_errors": self.decode_errors,
+        }
+
+
+class MicMixer:
+    """Mixes every client's mic into webcode_input on a fixed 20ms tick.
+
+    Each tick takes at most one frame from each client's MicInput, sums them
+    with per-client gain in float32, clips to int16 and writes exactly one
+    frame to pacat --playback. The tick task only runs while at least one
+    client is sending mic audio.
+    """
+
+    def __init__(self):
+        self.inputs = {}  # ws -> MicInput
+        self.task = None
+
+    def add(self, ws, inp=None):
+        """Return the client's input, creating a PCM one (or installing inp)."""
+        current = self.inputs.get(ws)
+        if inp is None:
+            if current is not None:
+                return current
+            inp = MicInput()
+        elif current is not None:
+            inp.gain, inp.muted = current.gain, current.muted
+        self.inputs[ws] = inp
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return inp
+
+    def remove(self, ws):
+        self.inputs.pop(ws, None)
+
+    async def _mix(self):
+        voices = []  # (pcm, gain)
+        jobs, owners = [], []
+        for inp in list(self.inputs.values()):
+            item = inp.take()
+            if item is None or inp.muted:
+                continue
+            if isinstance(item, bytes):
+                voices.append((item, inp.gain))
+            else:
+                jobs.append(item)
+                owners.append(inp)
+        if jobs:
+            for inp, pcm in zip(owners, await CODEC.decode_batch(jobs)):
+                if pcm is None or len(pcm) != CHUNK_BYTES:
+                    inp.decode_errors += 1
+                    METRICS.inc("mic_decode_errors")
+                    continue
+                voices.append((pcm, inp.gain))
+        if not voices:
+            return None
+        mix = None
+        for pcm, gain in voices:
+            samples = np.frombuffer(pcm, dtype=np.int16)
+            if mix is None:
+                mix = samples * np.float32(gain)
+            else:
+                mix += samples * np.float32(gain)
+        np.clip(mix, -32768, 32767, out=mix)
+        return mix.astype(np.int16).tobytes()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while self.inputs:
+            next_tick += FRAME_SECONDS
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > 5 * FRAME_SECONDS:
+                next_tick = loop.time()  # fell far behind: resume on the clock, don't burst
+            frame = await self._mix()
+            if frame is None or pacat_in_proc is None or pacat_in_proc.returncode is not None:
+                continue
+            try:
+                pacat_in_proc.stdin.write(frame)
+                await pacat_in_proc.stdin.drain()
+            except Exception as e:
+                print(f"[audio-ws] mic input write error: {e}", flush=True)
+
+
+MIXER = MicMixer()
+
+
+def _request_path(ws):
+    """The HTTP path the client connected with (any websockets version)."""
+    request = getattr(ws, "request", None)
+    if request is not None:
+        return request.path
+    return getattr(ws, "path", "") or ""
+
+
+def _path_stream(path):
+    """Stream name from a .../audio/<stream> path, or None."""
+    parts = path.split("?", 1)[0].rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2] == "audio":
+        return parts[-1]
+    return None
+
+
+def _subscribe(sender, old, prebuffer_ms=PREBUFFER_MS):
+    """Start feeding a (re)configured sender its stream; old is the stream
+    it listened to before, whose capture may now go idle."""
+    named = NAMED_STREAMS[sender.stream_name]
+    if named.silence.active or NAMED_STREAMS[old].silence.active:
+        sender.push(named.silence.event())
+    if not named.silence.active:
+        # Recent frames first, so the client starts with a lead
+        sender.push_burst(_ring_frames(sender, prebuffer_ms))
+    named.capture.acquire()
+    if old != named.name:
+        NAMED_STREAMS[old].capture.release()
+
+
+async def handler(ws, peer=None, path=None):
+    """Handle WebSocket client connection (full-duplex).
+
+    peer is set for clients proxied by a fan-out worker: their audio is sent
+    by the worker, everything else is handled here. A path ending in
+    /audio/<stream> picks the named stream set_audio subscribes to.
+    """
+    CLIENTS.add(ws)
+    if peer is None:
+        _limit_send_buffer(ws)
+    print(f"[audio-ws] client connected ({len(CLIENTS)} total) from {peer or ws.remote_address}", flush=True)
+
+    # Send codec negotiation so the client knows to use Opus decoder
+    try:
+        await ws.send(json.dumps(ENCODER_TIERS[DEFAULT_TIER].codec_info()))
+    except Exception as e:
+        print(f"[audio-ws] codec_info send failed: {e}", flush=True)
+
+    # Output tier, framing and stream preference; applied on set_audio,
+    # set_tier, set_framing and set_stream
+    preferred_tier = DEFAULT_TIER
+    auto_tier = True
+    framing = _framing_options({})
+    preferred_stream = _path_stream(_request_path(ws) if path is None else path) or DEFAULT_STREAM
+    if preferred_stream not in NAMED_STREAMS:
+        try:
+            await ws.send(json.dumps({"event": "stream_error", "error": "unknown_stream",
+                                      "stream": preferred_stream, "streams": list(NAMED_STREAMS)}))
+        except Exception:
+            pass
+        preferred_stream = DEFAULT_STREAM
+
+    try:
+        async for message in ws:
+            if isinstance(message, bytes):
+                # Opus packets (after mic_codec) or raw PCM (fallback);
+                # decoding happens on the mixer tick
+                MIXER.add(ws).feed(message)
+            elif isinstance(message, str):
+                try:
+                    cmd = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(cmd, dict):
+                    continue  # valid JSON but not a command object
+                action = cmd.get("action")
+
+                if action == "set_audio":
+                    # Client tells us whether they're playing audio
+                    should_send = cmd.get("enabled", False)
+                    if should_send and cmd.get("stream", preferred_stream) not in NAMED_STREAMS:
+                        resp = {"event": "stream_error", "error": "unknown_stream",
+                                "stream": cmd.get("stream"), "streams": list(NAMED_STREAMS)}
+                    elif should_send:
+                        preferred_stream = cmd.get("stream", preferred_stream)
+                        if cmd.get("prefer_pcm", False):
+                            preferred_tier, auto_tier = "pcm", False
+                        elif cmd.get("tier") in ENCODER_TIERS:
+                            preferred_tier = cmd["tier"]
+                            auto_tier = bool(cmd.get("auto", auto_tier))
+                        framing = _framing_options(cmd, *framing)
+                        sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                        if sender is None:
+                            cls = AudioSender if peer is None else RemoteSender
+                            sender = AUDIO_PLAYING_CLIENTS[ws] = cls(ws, preferred_tier, auto_tier)
+                            sender.stream_name = preferred_stream
+                        old_stream = sender.stream_name
+                        sender.max_tier = preferred_tier
+                        # (Re-)announce the stream's codec so client's onmessage knows the mode
+                        sender.configure(preferred_tier, auto_tier, *framing, stream=preferred_stream)
+                        try:
+                            prebuffer_ms = float(cmd.get("prebuffer_ms", PREBUFFER_MS))
+                        except (TypeError, ValueError):
+                            prebuffer_ms = PREBUFFER_MS
+                        _subscribe(sender, old_stream, prebuffer_ms)
+                        print(f"[audio-ws] client enabled audio output, stream '{preferred_stream}' tier {preferred_tier} "
+                              f"framing v{framing[0]} {framing[1]:g}ms x{framing[2]} ({len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
+                        continue
+                    else:
+                        _disable_audio(ws)
+                        print(f"[audio-ws] client disabled audio output ({len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
+
+                elif action == "set_stream":
+                    # Subscribe to another named stream (takes effect now if playing)
+                    if cmd.get("stream") not in NAMED_STREAMS:
+                        resp = {"event": "stream_error", "error": "unknown_stream",
+                                "stream": cmd.get("stream"), "streams": list(NAMED_STREAMS)}
+                    else:
+                        preferred_stream = cmd["stream"]
+                        sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                        if sender is not None and sender.stream_name != preferred_stream:
+                            old_stream = sender.stream_name
+                            sender.configure(stream=preferred_stream)
+                            _subscribe(sender, old_stream)
+                        resp = {"event": "stream", "stream": preferred_stream}
+
+                elif action == "replay":
+                    # Re-send the last N seconds of the ring; live audio
+                    # resumes once they have played
+                    sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                    if sender is None:
+                        resp = {"event": "replay_error", "error": "audio_disabled"}
+                    else:
+                        try:
+                            ms = float(cmd.get("seconds", RING_SECONDS)) * 1000
+                        except (TypeError, ValueError):
+                            ms = RING_SECONDS * 1000
+                        frames = _ring_frames(sender, ms)
+                        sender.push(json.dumps({"event": "replay", "frames": len(frames),
+                                                "seconds": round(len(frames) * sender.frame_ms / 1000, 3)}))
+                        sender.replay(frames)
+                        continue
+
+                elif action == "worker_tier":
+                    # A worker's sender auto-switched; encode the new tier
+                    sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                    if sender is not None and sender.remote and cmd.get("tier") in ENCODER_TIERS:
+                        sender.tier = cmd["tier"]
+                    continue
+
+                elif action == "set_tier":
+                    # Pick an output tier; "auto" lets the server step down on a lagging link
+                    if cmd.get("tier") not in ENCODER_TIERS:
+                        resp = {"event": "tier_error", "error": "unknown_tier", "tiers": list(TIERS)}
+                    else:
+                        preferred_tier = cmd["tier"]
+                        auto_tier = bool(cmd.get("auto", auto_tier)) and preferred_tier != "pcm"
+                        sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                        if sender:
+                            sender.max_tier = preferred_tier
+                            sender.set_tier(preferred_tier, auto_tier)
+                        resp = {"event": "tier", "tier": preferred_tier, "auto": auto_tier}
+
+                elif action == "set_framing":
+                    # Framing v2 (header with seq/timestamp/tier), frame duration, frames per message
+                    framing = _framing_options(cmd, *framing)
+                    sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                    if sender:
+                        sender.configure(framing=framing[0], frame_ms=framing[1], batch=framing[2])
+                    resp = {"event": "framing", "framing": framing[0],
+                            "frame_ms": framing[1], "batch": framing[2]}
+
+                elif action == "mic_codec":
+                    # Client announces mic codec support
+                    if cmd.get("codec") == "opus":
+                        try:
+                            seq_framing = cmd.get("framing") == "seq"
+                            MIXER.add(ws, OpusMicInput(opuslib.Decoder(SAMPLE_RATE, CHANNELS), seq_framing))
+                            print(f"[audio-ws] client mic Opus decoder ready (framing={'seq' if seq_framing else 'arrival'})", flush=True)
+                        except Exception as e:
+                            print(f"[audio-ws] failed to create mic Opus decoder: {e}", flush=True)
+
+                elif action == "mic_gain":
+                    # Per-client uplink gain (linear, 0..4) and mute
+                    mic_input = MIXER.add(ws)
+                    try:
+                        mic_input.gain = min(max(float(cmd.get("gain", mic_input.gain)), 0.0), 4.0)
+                    except (TypeError, ValueError):
+                        pass
+                    mic_input.muted = bool(cmd.get("muted", mic_input.muted))
+                    resp = {"event": "mic_gain", "gain": mic_input.gain, "muted": mic_input.muted}
+
+                elif action == "mic_stats":
+                    mic_input = MIXER.inputs.get(ws)
+                    resp = {"event": "mic_stats", "stats": mic_input.stats() if mic_input else None}
+
+                elif action == "metrics":
+                    resp = {"event": "metrics", **METRICS.snapshot()}
+
+                elif action == "stream_stats":
+                    sender = AUDIO_PLAYING_CLIENTS.get(ws)
+                    name = sender.stream_name if sender is not None else preferred_stream
+                    resp = {"event": "stream_stats", "stream": name,
+                            "silence": NAMED_STREAMS[name].silence.stats(),
+                            "streams": {n: named.info() for n, named in NAMED_STREAMS.items()}}
+
+                elif action == "start_recording":
+                    # mode "audio": Ogg Opus from the live stream, no ffmpeg;
+                    # mode "segments": rotating fMP4 chunks plus a manifest
+                    mode = cmd.get("mode", RECORD_MODE)
+                    if mode not in ("video", "segments", "audio"):
+                        mode = "video"
+                    fname, err = await start_recording(mode, cmd.get("tier"), cmd.get("profile"), cmd.get("stream"))
+                    resp = {"event": "recording_error", "error": err} if err else \
+                           {"event": "recording_started", "filename": os.path.basename(fname), "mode": mode,
+                            "profile": None if mode == "audio" else recording_profile,
+                            "profiles": sorted(RECORD_PROFILES)}
+                elif action == "stop_recording":
+                    info, err = await stop_recording()
+                    resp = {"event": "recording_error", "error": err} if err else \
+                           {"event": "recording_stopped", **info}
+                elif action == "recording_manifest":
+                    manifest = recording_manifest(cmd.get("session"))
+                    resp = {"event": "recording_manifest", "manifest": manifest,
+                            "url": f"/audio/recordings/{manifest['session']}/"} if manifest else \
+                           {"event": "recording_error", "error": "no_manifest"}
+                elif action == "recording_status":
+                    info = recording_info()
+                    resp = {"event": "recording_status", "recording": info is not None,
+                            "filename": None, **(info or {})}
+                else:
+                    continue
+                try:
+                    await ws.send(json.dumps(resp))
+                except Exception:
+                    pass
+    except Exception:
+        pass
+    finally:
+        CLIENTS.discard(ws)
+        MIXER.remove(ws)
+        _disable_audio(ws)
+        print(f"[audio-ws] client disconnected ({len(CLIENTS)} remaining, {len(AUDIO_PLAYING_CLIENTS)} playing)", flush=True)
+
+
+async def _pactl(*args, check=False, timeout=5):
+    """Run pactl without blocking the event loop; returns (returncode, stdout)."""
+    proc = await asyncio.create_subprocess_exec(
+        "pactl", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        env=PULSE_ENV,
+    )
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(["pactl", *args], timeout)
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, ["pactl", *args])
+    return proc.returncode, out.decode(errors="replace")
+
+
+async def wait_for_pulseaudio(timeout=30):
+    """Wait for PulseAudio to be ready.
+
+    Polls with exponential backoff (50ms doubling to 1s), so a daemon that is
+    already up is detected on the first try instead of after a fixed sleep.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if (await _pactl("info", timeout=2))[0] == 0:
+                print(f"[audio-ws] PulseAudio is ready (attempt {attempt})", flush=True)
+                return True
+        except Exception:
+            pass
+        if time.monotonic() + delay > deadline:
+            break
+        if attempt == 1 or delay >= 1:
+            print(f"[audio-ws] waiting for PulseAudio (attempt {attempt})...", flush=True)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+    print("[audio-ws] ERROR: PulseAudio did not start in time", flush=True)
+    return False
+
+
+async def _ensure_sink(name, description):
+    """Load a module-null-sink called name unless it already exists."""
+    _, sinks = await _pactl("list", "sinks", "short", check=True)
+    if name in sinks:
+        print(f"[audio-ws] null-sink '{name}' already exists", flush=True)
+        return
+    # load-module returns once the sink exists, so no polling is needed
+    await _pactl(
+        "load-module", "module-null-sink",
+        f"sink_name={name}",
+        f"sink_properties=device.description={description}",
+        check=True,
+    )
+    print(f"[audio-ws] null-sink '{name}' created", flush=True)
+
+
+async def setup_null_sink():
+    """Create null-sink if it doesn't exist."""
+    try:
+        await _ensure_sink(PULSE_SINK, "WebcodeAudio")
+        await _pactl("set-default-sink", PULSE_SINK, check=True)
+        print(f"[audio-ws] default sink set to '{PULSE_SINK}'", flush=True)
+        return True
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        print(f"[audio-ws] ERROR setting up null-sink: {e}", flush=True)
+        return False
+
+
+async def setup_input_sink():
+    """Create webcode_input null-sink and wrap its monitor as a normal source.
+
+    Chrome filters out PA_SOURCE_MONITOR sources during getUserMedia enumeration.
+    module-remap-source wraps webcode_input.monitor into a plain source 'webcode_mic'
+    without the MONITOR flag, so Chrome can enumerate and select it.
+    """
+    try:
+        # 1. Create webcode_input null-sink if missing
+        await _ensure_sink(PULSE_INPUT_SINK, "WebcodeMic")
+
+        # 2. Wrap webcode_input.monitor as plain source 'webcode_mic' (no MONITOR flag)
+        _, sources = await _pactl("list", "sources", "short", check=True)
+        if "webcode_mic" in sources:
+            print("[audio-ws] remap-source 'webcode_mic' already exists", flush=True)
+        else:
+            await _pactl(
+                "load-module", "module-remap-source",
+                "source_name=webcode_mic",
+                f"master={PULSE_INPUT_SINK}.monitor",
+                "source_properties=device.description=WebcodeMicrophone",
+                check=True,
+            )
+            print("[audio-ws] remap-source 'webcode_mic' created", flush=True)
+
+        # 3. Set webcode_mic as default source
+        await _pactl("set-default-source", "webcode_mic", check=True)
+        print("[audio-ws] default source set to 'webcode_mic'", flush=True)
+
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        print(f"[audio-ws] ERROR setting up input sink: {e}", flush=True)
+
+
+async def start_input_playback():
+    """Start pacat --playback to feed browser mic audio into webcode_input."""
+    global pacat_in_proc
+    if _use_pulse_simple():
+        pacat_in_proc = await PulseSimpleStream.open(_load_pulse_simple(), _PA_STREAM_PLAYBACK,
+                                                     PULSE_INPUT_SINK, PULSE_PLAYBACK_MS)
+        print(f"[audio-ws] {pacat_in_proc.label} playback started for mic input", flush=True)
+        return
+    cmd = [
+        "pacat", "--playback",
+        "-d", PULSE_INPUT_SINK,
+        "--format=s16le",
+        f"--rate={SAMPLE_RATE}",
+        f"--channels={CHANNELS}",
+        "--latency-msec=20",
+    ]
+    pacat_in_proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=PULSE_ENV,
+    )
+    print(f"[audio-ws] pacat --playback started (pid={pacat_in_proc.pid}) for mic input", flush=True)
+
+
+async def supervise_input_playback():
+    """Restart pacat --playback with backoff whenever it exits."""
+    global pacat_in_proc
+    backoff = RestartBackoff()
+    while True:
+        started = time.monotonic()
+        if pacat_in_proc is not None:
+            code = await pacat_in_proc.wait()
+            print(f"[audio-ws] pacat --playback exited (code={code})", flush=True)
+        pacat_in_proc = None  # the mixer skips writes meanwhile
+        METRICS.inc("mic_playback_restarts")
+        delay = backoff.next(time.monotonic() - started)
+        await asyncio.sleep(delay)
+        await setup_input_sink()
+        try:
+            await start_input_playback()
+        except OSError as e:
+            print(f"[audio-ws] pacat --playback start failed: {e}", flush=True)
+
+
+async def setup_audio():
+    """Bring up PulseAudio sinks and the mic playback stream, then set AUDIO_READY.
+
+    The output and input sink chains (and the sinks of extra named streams)
+    are independent, so they are created concurrently.
+    """
+    if CAPTURE_BACKEND == "synthetic":
+        print(f"[audio-ws] synthetic backend ({SYNTH_SOURCE}), skipping PulseAudio setup", flush=True)
+        AUDIO_READY.set()
+        return True
+    if not await wait_for_pulseaudio():
+        return False
+    sink_ok, _, *_ = await asyncio.gather(
+        setup_null_sink(), setup_input_sink(),
+        *(named.setup_sink() for named in NAMED_STREAMS.values() if named is not MAIN_STREAM))
+    if not sink_ok:
+        print(f"[audio-ws] WARNING: null-sink '{PULSE_SINK}' not set up, pacat may fail", flush=True)
+    try:
+        await start_input_playback()
+    except OSError as e:
+        print(f"[audio-ws] mic playback start failed: {e}", flush=True)
+    asyncio.ensure_future(supervise_input_playback())
+    AUDIO_READY.set()
+    print(f"[audio-ws] audio ready after {(time.monotonic() - STARTED_AT) * 1000:.0f}ms", flush=True)
+    return True
+
+
+# --- Fan-out workers (AUDIO_WORKERS > 0) ---
+#
+# The capture process serves only WORKER_SOCKET. Each worker listens on
+# AUDIO_PORT with SO_REUSEPORT, so the kernel spreads clients across them,
+# and proxies every client over its own connection to the capture process,
+# which handles control actions and the mic uplink as usual. Audio frames
+# skip that hop: workers read them from the shared rings.
+
+WORKER_PROCS = {}     # worker index -> process (capture process)
+SHARED_RINGS = {}     # stream key -> attached FrameRing (worker)
+SHARED_CURSORS = {}   # stream key -> next ring index to fan out (worker)
+
+
+async def _worker_entry(ws):
+    """Capture process side of the worker socket; the first message says
+    whether the connection is a proxied client or a worker's own channel."""
+    try:
+        hello = json.loads(await ws.recv())
+    except Exception:
+        return
+    if hello.get("action") == "worker_proxy":
+        await handler(ws, hello.get("peer") or "worker", hello.get("path", ""))
+    elif hello.get("action") == "worker_hello":
+        index = hello.get("index")
+        print(f"[audio-ws] fan-out worker {index} connected", flush=True)
+        try:
+            async for message in ws:
+                WORKER_METRICS[index] = json.loads(message)
+        except Exception:
+            pass
+        finally:
+            WORKER_METRICS.pop(index, None)
+
+
+async def supervise_worker(index):
+    """Run fan-out worker index, restarting it with backoff whenever it exits."""
+    backoff = RestartBackoff()
+    env = {**os.environ, "AUDIO_WORKER_INDEX": str(index)}
+    while True:
+        started = time.monotonic()
+        try:
+            proc = WORKER_PROCS[index] = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), env=env)
+            code = await proc.wait()
+            print(f"[audio-ws] fan-out worker {index} exited (code={code})", flush=True)
+        except OSError as e:
+            print(f"[audio-ws] fan-out worker {index} start failed: {e}", flush=True)
+        await asyncio.sleep(backoff.next(time.monotonic() - started))
+
+
+def _shared_ring(key):
+    ring = SHARED_RINGS.get(key)
+    if ring is None:
+        ring = FrameRing.attach(_ring_name(key))
+        if ring is not None:
+            SHARED_RINGS[key] = ring
+    return ring
+
+
+def _worker_command(ws, upstream, cmd):
+    """Apply a {"worker": ...} command from the capture process to ws's sender."""
+    kind = cmd.get("worker")
+    sender = AUDIO_PLAYING_CLIENTS.get(ws)
+    if kind == "configure":
+        if sender is None:
+            sender = AUDIO_PLAYING_CLIENTS[ws] = WorkerSender(ws, upstream, cmd["tier"], cmd["auto"])
+        sender.max_tier = cmd["max_tier"]
+        sender.configure(cmd["tier"], cmd["auto"], cmd["framing"], cmd["frame_ms"], cmd["batch"], cmd["stream"])
+    elif sender is None:
+        return
+    elif kind == "flush":
+        sender.flush()
+    elif kind in ("burst", "replay"):
+        ring = _shared_ring(sender.stream_key)
+        end = SHARED_CURSORS.get(sender.stream_key)
+        frames = ring.since(cmd["since_us"], end) if ring is not None and end is not None and cmd["frames"] else []
+        if kind == "burst":
+            sender.push_burst(frames)
+        else:
+            sender.replay(frames)
+
+
+async def _pump_shared_rings():
+    """Worker side of the capture loop: fan out new ring frames to local senders."""
+    while True:
+        await asyncio.sleep(WORKER_POLL_SECONDS)
+        by_stream = {}
+        for sender in AUDIO_PLAYING_CLIENTS.values():
+            by_stream.setdefault(sender.stream_key, []).append(sender)
+        for key in list(SHARED_CURSORS):
+            if key not in by_stream:
+                del SHARED_CURSORS[key]  # the next subscriber starts live
+        for key, senders in by_stream.items():
+            ring = _shared_ring(key)
+            if ring is None:
+                continue
+            # A ring created after the subscription holds only new frames
+            frames, SHARED_CURSORS[key] = ring.read(SHARED_CURSORS.get(key, ring.first))
+            for seq, ts_us, payload in frames:
+                _fan_out(key, senders, seq, ts_us, payload)
+
+
+async def worker_handler(ws):
+    """Serve one client in a worker: audio from the rings, the rest proxied."""
+    _limit_send_buffer(ws)
+    try:
+        upstream = await websockets.unix_connect(WORKER_SOCKET)
+        await upstream.send(json.dumps({"action": "worker_proxy", "peer": _client_label(ws),
+                                        "path": _request_path(ws)}))
+    except Exception as e:
+        print(f"[audio-ws] worker: capture process unreachable: {e}", flush=True)
+        return
+
+    async def uplink():
+        async for message in ws:
+            await upstream.send(message)
+            if isinstance(message, str) and "set_audio" in message:
+                try:
+                    cmd = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(cmd, dict) and cmd.get("action") == "set_audio" and not cmd.get("enabled", False):
+                    sender = AUDIO_PLAYING_CLIENTS.pop(ws, None)
+                    if sender:
+                        sender.close()
+
+    async def downlink():
+        async for message in upstream:
+            if isinstance(message, str) and message.startswith('{"worker"'):
+                _worker_command(ws, upstream, json.loads(message))
+                continue
+            # Through the sender (if any) to stay in order with the audio
+            sender = AUDIO_PLAYING_CLIENTS.get(ws)
+            if sender is not None:
+                sender.push(message)
+            else:
+                await ws.send(message)
+
+    tasks = [asyncio.ensure_future(uplink()), asyncio.ensure_future(downlink())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        sender = AUDIO_PLAYING_CLIENTS.pop(ws, None)
+        if sender:
+            sender.close()
+        await upstream.close()
+
+
+async def worker_main(index):
+    """Fan-out worker process: serve AUDIO_PORT until the capture process goes away."""
+    control = None
+    for _ in range(100):
+        try:
+            control = await websockets.unix_connect(WORKER_SOCKET)
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+    if control is None:
+        print(f"[audio-ws] worker {index}: no capture process on {WORKER_SOCKET}", flush=True)
+        sys.exit(1)
+    await control.send(json.dumps({"action": "worker_hello", "index": index}))
+    asyncio.ensure_future(_pump_shared_rings())
+    async with websockets.serve(worker_handler, HOST, PORT, reuse_port=True, write_limit=SEND_BUFFER_BYTES,
+                                process_request=_recordings_request):
+        print(f"[audio-ws] fan-out worker {index} (pid {os.getpid()}) listening on ws://{HOST}:{PORT}", flush=True)
+        try:
+            while True:
+                await control.send(json.dumps(METRICS.report()))
+                await asyncio.sleep(1)
+        except websockets.ConnectionClosed:
+            print(f"[audio-ws] worker {index}: capture process went away, exiting", flush=True)
+    for ring in SHARED_RINGS.values():
+        ring.close()
+
+
+# --- Relay mode (AUDIO_RELAY_UPSTREAMS) ---
+#
+# One process per host connects to the container audio servers as an
+# ordinary listener and serves them to clients over a single WebSocket each:
+# clients subscribe to containers by ID, binary messages are the upstream's
+# framing v2 messages prefixed with a 2-byte channel number, and text events
+# carry "container" and "channel". Each (container, stream, tier) has one
+# upstream connection however many clients subscribe to it.
+
+RELAY_HEADER = struct.Struct("!H")  # channel of a relayed binary message
+RELAY_LINKS = {}  # (container, stream, tier) -> RelayLink
+
+
+def _parse_relay_upstreams(spec):
+    """{container ID: upstream URL} from AUDIO_RELAY_UPSTREAMS."""
+    urls = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        container, _, url = (part.strip() for part in entry.partition("="))
+        if not container or not url:
+            print(f"[audio-ws] ignoring relay upstream '{entry}': expected <id>=<url or port>", flush=True)
+            continue
+        urls[container] = f"ws://127.0.0.1:{url}" if url.isdigit() else url
+    return urls
+
+
+RELAY_URLS = _parse_relay_upstreams(RELAY_UPSTREAMS)
+
+
+class RelaySender(AudioSender):
+    """A client's subscription to one relayed container stream.
+
+    Messages arrive framed and channel-prefixed from the link and are queued
+    as they are. Queue limits, drops and resyncs are per subscription, so a
+    container whose audio backs up on a slow link is resynced on its own
+    without pushing the client's other containers out of their queues.
+    """
+
+    def __init__(self, ws, link):
+        super().__init__(ws, link.tier, False)
+        self.link = link
+        self.stream_name = f"{link.container}/{link.stream}"
+        self.framing = 2
+
+    def _drop(self, messages, frames):
+        super()._drop(messages, frames)
+        self.link.dropped += frames
+
+    def _resync_event(self):
+        self.link.resyncs += 1
+        return json.dumps({"event": "resync", "dropped": self.dropped,
+                           "container": self.link.container, "channel": self.link.channel})
+
+
+class RelayLink:
+    """The upstream connection for one (container, stream, tier).
+
+    Connected while it has subscribers (plus AUDIO_IDLE_GRACE) and
+    reconnected with backoff when the container's server goes away. Each
+    upstream message is prefixed with the channel once and the same bytes
+    are queued for every subscriber; the latest codec_info and silence state
+    and the last AUDIO_PREBUFFER_MS of audio are replayed to new ones.
+    """
+
+    def __init__(self, container, stream, tier, channel):
+        self.container = container
+        self.stream = stream
+        self.tier = tier
+        self.channel = channel
+        self.url = RELAY_URLS[container]
+        self.senders = set()
+        self.codec_info = None
+        self.silence = None  # last silence event while active
+        self.recent = collections.deque()  # (ts_us, frames, message)
+        self.task = None
+        self._idle_timer = None
+        self.connected = False
+        self.connects = 0
+        self.failures = 0
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.dropped = 0
+        self.resyncs = 0
+
+    @property
+    def label(self):
+        return f"{self.container}/{self.stream}/{self.tier}"
+
+    def add(self, sender):
+        if self._idle_timer:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        self.senders.add(sender)
+        for message in (self.codec_info, self.silence):
+            if message is not None:
+                sender.push(message)
+        if self.recent and self.silence is None:
+            sender.push([message for _, _, message in self.recent], None,
+                        sum(frames for _, frames, _ in self.recent))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def remove(self, sender):
+        sender.close()
+        self.senders.discard(sender)
+        if not self.senders and self.task is not None and not self._idle_timer:
+            self._idle_timer = asyncio.get_running_loop().call_later(CAPTURE_IDLE_GRACE, self._stop_if_idle)
+
+    def _stop_if_idle(self):
+        self._idle_timer = None
+        if self.senders or self.task is None:
+            return
+        self.task.cancel()
+        self.task = None
+        self.recent.clear()
+        print(f"[audio-ws] relay {self.label}: no subscribers, upstream closed", flush=True)
+
+    def _push_all(self, message, ts_us=None, frames=0):
+        for sender in list(self.senders):
+            sender.push(message, ts_us, frames)
+
+    def _set_connected(self, connected):
+        self.connected = connected
+        self._push_all(json.dumps({"event": "upstream", "connected": connected,
+                                   "container": self.container, "channel": self.channel}))
+
+    async def _run(self):
+        backoff = RestartBackoff()
+        while True:
+            started = time.monotonic()
+            try:
+                # Opus doesn't deflate: skip permessage-deflate on this hop
+                async with websockets.connect(self.url, compression=None) as ws:
+                    await ws.send(json.dumps({"action": "set_audio", "enabled": True, "tier": self.tier,
+                                              "auto": False, "framing": 2, "stream": self.stream}))
+                    self.connects += 1
+                    self._set_connected(True)
+                    print(f"[audio-ws] relay {self.label}: connected to {self.url}", flush=True)
+                    async for message in ws:
+                        self._dispatch(message)
+                print(f"[audio-ws] relay {self.label}: upstream closed the connection", flush=True)
+            except (OSError, websockets.WebSocketException) as e:
+                self.failures += 1
+                print(f"[audio-ws] relay {self.label}: upstream {self.url} failed: {e}", flush=True)
+            finally:
+                if self.connected:
+                    self._set_connected(False)
+            await asyncio.sleep(backoff.next(time.monotonic() - started))
+
+    def _dispatch(self, message):
+        if isinstance(message, str):
+            try:
+                event = json.loads(message)
+            except json.JSONDecodeError:
+                return
+            event["container"] = self.container
+            event["channel"] = self.channel
+            message = json.dumps(event)
+            if event.get("event") == "codec_info":
+                self.codec_info = message
+            elif event.get("event") == "silence":
+                self.silence = message if event.get("active") else None
+                self.recent.clear()
+            self._push_all(message)
+            return
+        if len(message) < FRAMING_V2_HEADER.size:
+            return
+        _, _, frames, _, _, ts_us = FRAMING_V2_HEADER.unpack_from(message)
+        message = RELAY_HEADER.pack(self.channel) + message
+        self.frames_in += frames
+        self.bytes_in += len(message)
+        self.recent.append((ts_us, frames, message))
+        while self.recent[0][0] < ts_us - PREBUFFER_MS * 1000:
+            self.recent.popleft()
+        self._push_all(message, ts_us, frames)
+
+    def info(self):
+        return {
+            "container": self.container, "stream": self.stream, "tier": self.tier,
+            "channel": self.channel, "url": self.url, "connected": self.connected,
+            "subscribers": len(self.senders), "connects": self.connects, "failures": self.failures,
+            "frames_in": self.frames_in, "bytes_in": self.bytes_in,
+            "dropped": self.dropped, "resyncs": self.resyncs,
+            "queue_depth": max((len(sender.queue) for sender in self.senders), default=0),
+        }
+
+
+def _relay_senders():
+    return [sender for link in list(RELAY_LINKS.values()) for sender in link.senders]
+
+
+def _relay_link(container, stream, tier):
+    link = RELAY_LINKS.get((container, stream, tier))
+    if link is None and len(RELAY_LINKS) < 0xFFFF:
+        link = RELAY_LINKS[container, stream, tier] = RelayLink(container, stream, tier, len(RELAY_LINKS) + 1)
+    return link
+
+
+async def relay_handler(ws):
+    """Serve one relay client: any number of container subscriptions
+    (one per container) over this connection."""
+    CLIENTS.add(ws)
+    _limit_send_buffer(ws)
+    subscriptions = {}  # container -> RelaySender
+    print(f"[audio-ws] relay client connected ({len(CLIENTS)} total) from {ws.remote_address}", flush=True)
+    try:
+        await ws.send(json.dumps({"event": "relay", "containers": list(RELAY_URLS), "tiers": list(TIERS)}))
+        async for message in ws:
+            if not isinstance(message, str):
+                continue  # the mic uplink isn't relayed
+            try:
+                cmd = json.loads(message)
+            except json.JSONDecodeError:
+                continue
+            # A bad command gets an error, not the connection (and every
+            # container on it) torn down
+            if not isinstance(cmd, dict) or any(
+                    cmd.get(key) is not None and not isinstance(cmd[key], str)
+                    for key in ("action", "container", "stream", "tier")):
+                await ws.send(json.dumps({"event": "relay_error", "error": "bad_message"}))
+                continue
+            action = cmd.get("action")
+            container = cmd.get("container")
+
+            if action == "subscribe":
+                # One upstream link per (container, stream, tier), shared
+                tier = cmd.get("tier", DEFAULT_TIER)
+                stream = cmd.get("stream", DEFAULT_STREAM)
+                link = _relay_link(container, stream, tier) if container in RELAY_URLS and tier in TIERS else None
+                if container not in RELAY_URLS:
+                    resp = {"event": "relay_error", "error": "unknown_container",
+                            "container": container, "containers": list(RELAY_URLS)}
+                elif tier not in TIERS:
+                    resp = {"event": "relay_error", "error": "unknown_tier",
+                            "container": container, "tiers": list(TIERS)}
+                elif link is None:
+                    resp = {"event": "relay_error", "error": "too_many_links", "container": container}
+                else:
+                    old = subscriptions.pop(container, None)
+                    if old is not None:
+                        old.link.remove(old)
+                    sender = subscriptions[container] = RelaySender(ws, link)
+                    # Ahead of the link's messages, so the channel is known first
+                    sender.push(json.dumps({"event": "subscribed", "container": container, "stream": stream,
+                                            "tier": tier, "channel": link.channel}))
+                    link.add(sender)
+                    print(f"[audio-ws] relay client subscribed to {link.label} "
+                          f"({len(link.senders)} on the link)", flush=True)
+                    continue
+
+            elif action == "unsubscribe":
+                sender = subscriptions.pop(container, None)
+                if sender is not None:
+                    sender.link.remove(sender)
+                resp = {"event": "unsubscribed", "container": container}
+
+            elif action == "containers":
+                resp = {"event": "containers", "containers": list(RELAY_URLS),
+                        "links": [link.info() for link in RELAY_LINKS.values()]}
+
+            elif action == "metrics":
+                resp = {"event": "metrics", **METRICS.snapshot()}
+
+            else:
+                resp = {"event": "relay_error", "error": "unsupported_action", "action": action}
+
+            await ws.send(json.dumps(resp))
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        for sender in subscriptions.values():
+            sender.link.remove(sender)
+        CLIENTS.discard(ws)
+        print(f"[audio-ws] relay client disconnected ({len(CLIENTS)} remaining)", flush=True)
+
+
+async def relay_main():
+    """Relay mode: no capture, just the relayed containers on AUDIO_PORT."""
+    await _start_metrics()
+    async with websockets.serve(relay_handler, HOST, PORT, write_limit=SEND_BUFFER_BYTES):
+        print(f"[audio-ws] relay for {len(RELAY_URLS)} containers listening on ws://{HOST}:{PORT} "
+              f"(upstreams connect on demand)", flush=True)
+        await asyncio.get_running_loop().create_future()
+
+
+async def main():
+    import atexit
+
+    def _cleanup():
+        if ffmpeg_proc and ffmpeg_proc.returncode is None:
+            try:
+                ffmpeg_proc.send_signal(signal.SIGINT)
+            except Exception:
+                pass
+        for proc in WORKER_PROCS.values():
+            if proc.returncode is None:
+                proc.terminate()
+        for named in NAMED_STREAMS.values():
+            for stream in named.streams.values():
+                if stream.ring is not None:
+                    stream.ring.close(unlink=True)
+
+    atexit.register(_cleanup)
+    if WORKERS:
+        # Exit through atexit on SIGTERM so workers stop and rings are unlinked
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, sys.exit, 0)
+
+    # Listen first: clients can connect (and enable audio) while PulseAudio
+    # is still being set up; capture waits for AUDIO_READY
+    for named in NAMED_STREAMS.values():
+        named.capture = CaptureController(named)
+    await _start_metrics()
+    if WORKERS:
+        server = websockets.unix_serve(_worker_entry, WORKER_SOCKET)
+    else:
+        server = websockets.serve(handler, HOST, PORT, write_limit=SEND_BUFFER_BYTES,
+                                  process_request=_recordings_request)
+    async with server:
+        if WORKERS:
+            for index in range(WORKERS):
+                asyncio.ensure_future(supervise_worker(index))
+            print(f"[audio-ws] {WORKERS} fan-out workers on ws://{HOST}:{PORT}, "
+                  f"capture process on {WORKER_SOCKET}", flush=True)
+        else:
+            print(f"[audio-ws] WebSocket server listening on ws://{HOST}:{PORT} "
+                  f"after {(time.monotonic() - STARTED_AT) * 1000:.0f}ms", flush=True)
+        print(f"[audio-ws] capture is demand-driven (idle grace {CAPTURE_IDLE_GRACE:g}s), "
+              f"streams: {', '.join(NAMED_STREAMS)}", flush=True)
+        if not await setup_audio():
+            sys.exit(1)
+        await asyncio.wait([named.capture.failed for named in NAMED_STREAMS.values()],
+                           return_when=asyncio.FIRST_COMPLETED)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKER_INDEX is not None:
+        asyncio.run(worker_main(int(WORKER_INDEX)))
+    elif RELAY_URLS:
+        asyncio.run(relay_main())
+    else:
+        asyncio.run(main())
@@ -5,5 +5,7 @@ export XDG_RUNTIME_DIR="/run/user/1000"
 export PULSE_SERVER="unix:/run/user/1000/pulse/native"
 export DISPLAY=":1"
 export AUDIO_PORT="${AUDIO_PORT:-10006}"
+export AUDIO_METRICS_PORT="${AUDIO_METRICS_PORT:-10016}"
+export AUDIO_WORKERS="${AUDIO_WORKERS:-0}"
 
 exec /usr/bin/python3 /opt/audio-ws-server.py
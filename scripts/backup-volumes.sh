@@ -0,0 +1,33 @@
+#!/bin/bash
+#
+# WebCode backup volume list
+#
+# Sourced by backup.sh, restore.sh, snapshot.sh and snapshot-restore.sh so
+# a volume added to docker-compose.yml is listed in one place only.
+# Usage: source backup-volumes.sh; volume_mounts /backup
+#   docker run "${VOLUME_MOUNTS[@]}" ... then sees each volume at
+#   /backup/<name without the webcode-docker_ prefix>
+#
+
+# List of volumes to back up and restore (from docker-compose.yml)
+VOLUMES=(
+    "webcode-docker_dna-data"
+    "webcode-docker_projects"
+    "webcode-docker_vibe-kanban-data"
+    "webcode-docker_code-server-data"
+    "webcode-docker_user-data"
+    "webcode-docker_openclaw-data"
+    "webcode-docker_chrome-data"
+    "webcode-docker_v2rayn-data"
+    "webcode-docker_gitconfig"
+    "webcode-docker_recordings"
+    "webcode-docker_webcode-config"
+)
+
+# Fill VOLUME_MOUNTS with docker -v options mounting every volume under $1
+volume_mounts() {
+    VOLUME_MOUNTS=()
+    for vol in "${VOLUMES[@]}"; do
+        VOLUME_MOUNTS+=(-v "${vol}:$1/${vol#webcode-docker_}")
+    done
+}
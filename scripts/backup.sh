@@ -33,20 +33,8 @@ error() {
     echo -e "${RED}[backup]${NC} $1"
 }
 
-# List of volumes to backup (from docker-compose.yml)
-VOLUMES=(
-    "webcode-docker_dna-data"
-    "webcode-docker_projects"
-    "webcode-docker_vibe-kanban-data"
-    "webcode-docker_code-server-data"
-    "webcode-docker_user-data"
-    "webcode-docker_openclaw-data"
-    "webcode-docker_chrome-data"
-    "webcode-docker_v2rayn-data"
-    "webcode-docker_gitconfig"
-    "webcode-docker_recordings"
-    "webcode-docker_webcode-config"
-)
+# List of volumes to backup (VOLUMES, volume_mounts)
+source "$(dirname "${BASH_SOURCE[0]}")/backup-volumes.sh"
 
 # Create backup directory
 mkdir -p "$BACKUP_DIR"
@@ -66,23 +54,14 @@ if [ ${#missing_volumes[@]} -gt 0 ]; then
     warn "The following volumes do not exist and will be skipped:"
     for vol in "${missing_volumes[@]}"; do
         warn "  - $vol"
-    fi
+    done
 fi
 
 # Create temporary container for backup
 log "Creating temporary backup container..."
+volume_mounts /backup
 TEMP_CONTAINER=$(docker create \
-    -v webcode-docker_dna-data:/backup/dna-data \
-    -v webcode-docker_projects:/backup/projects \
-    -v webcode-docker_vibe-kanban-data:/backup/vibe-kanban-data \
-    -v webcode-docker_code-server-data:/backup/code-server-data \
-    -v webcode-docker_user-data:/backup/user-data \
-    -v webcode-docker_openclaw-data:/backup/openclaw-data \
-    -v webcode-docker_chrome-data:/backup/chrome-data \
-    -v webcode-docker_v2rayn-data:/backup/v2rayn-data \
-    -v webcode-docker_gitconfig:/backup/gitconfig \
-    -v webcode-docker_recordings:/backup/recordings \
-    -v webcode-docker_webcode-config:/backup/webcode-config \
+    "${VOLUME_MOUNTS[@]}" \
     -v "$BACKUP_DIR:/output" \
     ubuntu:22.04 \
     tar czf "/output/$(basename "$BACKUP_FILE")" -C /backup .)
@@ -97,20 +97,8 @@ supervisorctl stop vibe-kanban >/dev/null 2>&1 || true
 supervisorctl stop openclaw >/dev/null 2>&1 || true
 supervisorctl stop claudecodeui >/dev/null 2>&1 || true
 
-# List of volumes to restore
-VOLUMES=(
-    "webcode-docker_dna-data"
-    "webcode-docker_projects"
-    "webcode-docker_vibe-kanban-data"
-    "webcode-docker_code-server-data"
-    "webcode-docker_user-data"
-    "webcode-docker_openclaw-data"
-    "webcode-docker_chrome-data"
-    "webcode-docker_v2rayn-data"
-    "webcode-docker_gitconfig"
-    "webcode-docker_recordings"
-    "webcode-docker_webcode-config"
-)
+# List of volumes to restore (VOLUMES, volume_mounts)
+source "$(dirname "${BASH_SOURCE[0]}")/backup-volumes.sh"
 
 # Check if volumes exist
 missing_volumes=()
@@ -125,23 +113,14 @@ if [ ${#missing_volumes[@]} -gt 0 ]; then
     for vol in "${missing_volumes[@]}"; do
         warn "  - $vol"
         docker volume create "$vol" >/dev/null 2>&1
-    fi
+    done
 fi
 
 # Create temporary container for restore
 log "Creating temporary restore container..."
+volume_mounts /restore
 TEMP_CONTAINER=$(docker create \
-    -v webcode-docker_dna-data:/restore/dna-data \
-    -v webcode-docker_projects:/restore/projects \
-    -v webcode-docker_vibe-kanban-data:/restore/vibe-kanban-data \
-    -v webcode-docker_code-server-data:/restore/code-server-data \
-    -v webcode-docker_user-data:/restore/user-data \
-    -v webcode-docker_openclaw-data:/restore/openclaw-data \
-    -v webcode-docker_chrome-data:/restore/chrome-data \
-    -v webcode-docker_v2rayn-data:/restore/v2rayn-data \
-    -v webcode-docker_gitconfig:/restore/gitconfig \
-    -v webcode-docker_recordings:/restore/recordings \
-    -v webcode-docker_webcode-config:/restore/webcode-config \
+    "${VOLUME_MOUNTS[@]}" \
     -v "$BACKUP_DIR:/backup" \
     ubuntu:22.04 \
     tar xzf "/backup/$(basename "$BACKUP_FILE")" -C /restore)
@@ -8,6 +8,10 @@
 # 3. Restore volumes
 # 4. Recreate container from snapshot image
 #
+# Snapshots taken with SNAPSHOT_ENGINE=store are streamed out of the
+# snapshot store (snapshot-store.py) straight into docker load and the
+# volumes, without intermediate archives.
+#
 # Usage: snapshot-restore.sh <snapshot_name> [--force]
 #   snapshot_name - name of the snapshot (e.g., snapshot-20260308-143022)
 #   --force       - skip confirmation prompt
@@ -17,6 +21,8 @@ set -e
 
 # Configuration
 BACKUP_DIR="${BACKUP_DIR:-/home/ubuntu/backups}"
+SNAPSHOT_STORE="python3 /opt/snapshot-store.py"
+source "$(dirname "${BASH_SOURCE[0]}")/backup-volumes.sh"
 
 # Colors for output
 RED='\033[0;31m'
@@ -75,8 +81,10 @@ if [ ! -f "${METADATA_FILE}" ]; then
     exit 1
 fi
 
+SNAPSHOT_ENGINE=$(grep -oP '"engine":\s*"\K[^"]*' "$METADATA_FILE" || echo "archive")
+
 # Check if layer tar exists
-if [ ! -f "${LAYER_TAR}" ]; then
+if [ "${SNAPSHOT_ENGINE}" != "store" ] && [ ! -f "${LAYER_TAR}" ]; then
     error "Snapshot layer not found: ${LAYER_TAR}"
     exit 1
 fi
@@ -94,8 +102,9 @@ log "Snapshot information:"
 cat "$METADATA_FILE" | grep -E '(name|created_at|base_image|layer|volumes)' | sed 's/^/  /'
 echo ""
 
-# Check if base image exists
-if [ ! -f "${BASE_IMAGE_PATH}" ]; then
+# Check if base image exists (store snapshots carry it in the layer stream,
+# whose chunks are checked as they are read)
+if [ "${SNAPSHOT_ENGINE}" != "store" ] && [ ! -f "${BASE_IMAGE_PATH}" ]; then
     error "Base image backup not found: ${BASE_IMAGE_PATH}"
     error "Cannot restore snapshot without base image"
     exit 1
@@ -117,26 +126,35 @@ fi
 log "Starting restore: ${SNAPSHOT_NAME}"
 
 # Step 1: Load base image
-log "Loading base image: ${BASE_IMAGE_FILE}"
-if ! docker load -i "${BASE_IMAGE_PATH}" 2>/dev/null; then
-    # Try with gunzip if direct load fails
-    gunzip -c "${BASE_IMAGE_PATH}" | docker load 2>/dev/null || {
-        error "Failed to load base image"
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    # The stored image carries its base layers
+    log "Loading snapshot image from the snapshot store"
+    if ! (set -o pipefail; ${SNAPSHOT_STORE} get "${SNAPSHOT_NAME}" layer | docker load); then
+        error "Failed to load snapshot image"
         exit 1
-    }
-fi
-log "Base image loaded successfully"
-
-# Step 2: Load commit layer (Docker automatically merges with base)
-log "Loading snapshot layer: ${LAYER_TAR}"
-if ! docker load -i "${LAYER_TAR}" 2>/dev/null; then
-    # Try with gunzip if direct load fails
-    gunzip -c "${LAYER_TAR}" | docker load 2>/dev/null || {
-        error "Failed to load snapshot layer"
-        exit 1
-    }
+    fi
+else
+    log "Loading base image: ${BASE_IMAGE_FILE}"
+    if ! docker load -i "${BASE_IMAGE_PATH}" 2>/dev/null; then
+        # Try with gunzip if direct load fails
+        gunzip -c "${BASE_IMAGE_PATH}" | docker load 2>/dev/null || {
+            error "Failed to load base image"
+            exit 1
+        }
+    fi
+    log "Base image loaded successfully"
+
+    # Step 2: Load commit layer (Docker automatically merges with base)
+    log "Loading snapshot layer: ${LAYER_TAR}"
+    if ! docker load -i "${LAYER_TAR}" 2>/dev/null; then
+        # Try with gunzip if direct load fails
+        gunzip -c "${LAYER_TAR}" | docker load 2>/dev/null || {
+            error "Failed to load snapshot layer"
+            exit 1
+        }
+    fi
+    log "Snapshot layer loaded successfully"
 fi
-log "Snapshot layer loaded successfully"
 
 # Step 3: Verify snapshot image exists
 if ! docker inspect "${COMMIT_IMAGE_NAME}" >/dev/null 2>&1; then
@@ -202,7 +220,19 @@ fi
 
 # Step 8: Restore volumes
 log "Restoring volumes..."
-if bash /opt/restore.sh "${VOLUMES_BACKUP}" --force; then
+restore_volumes() {
+    if [ "${SNAPSHOT_ENGINE}" != "store" ]; then
+        bash /opt/restore.sh "${VOLUMES_BACKUP}" --force
+        return
+    fi
+    volume_mounts /restore
+    ${SNAPSHOT_STORE} get "${SNAPSHOT_NAME}" volumes | docker run --rm -i \
+        "${VOLUME_MOUNTS[@]}" \
+        ubuntu:22.04 \
+        tar xf - -C /restore
+    [ "${PIPESTATUS[0]}" -eq 0 ] && [ "${PIPESTATUS[1]}" -eq 0 ]
+}
+if restore_volumes; then
     log "Volumes restored successfully"
 else
     error "Failed to restore volumes"
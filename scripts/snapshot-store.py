@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+"""Content-addressed snapshot store for snapshot.sh and snapshot-restore.sh.
+
+Streams (docker save output, a tar of the volumes) are cut into chunks at
+content-defined boundaries (a FastCDC-style Gear hash with normalized
+chunking), so an edit only changes the chunks around it and everything after
+it lines up with the previous snapshot again. Chunks are named by SHA-256
+and stored once, compressed on all cores; a snapshot stream is a manifest
+listing its chunks. A new snapshot costs time and disk in proportion to what
+changed since any snapshot still in the store, and restores stream the
+chunks back in order, read, decompressed and verified ahead of the writer.
+
+Layout of the store (default $BACKUP_DIR/store, or SNAPSHOT_STORE_DIR):
+
+    chunks/ab/<sha256>               codec byte, raw size, (compressed) data
+    index                            "<sha256> <size> <stored size>" per chunk
+    snapshots/<name>/<stream>.json   chunk list and stats of one stream
+
+    docker save IMAGE | snapshot-store.py put snapshot-20260308-143022 layer
+    snapshot-store.py get snapshot-20260308-143022 layer | docker load
+    snapshot-store.py list
+    snapshot-store.py prune --keep 30
+    snapshot-store.py verify
+    snapshot-store.py bench --size-mb 512 --change 2
+
+The chunker needs NumPy. New chunks are compressed with zstandard when it is
+installed and with zlib otherwise (SNAPSHOT_STORE_LEVEL); chunks that don't
+shrink are stored raw.
+"""
+import argparse
+import collections
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "/home/ubuntu/backups")
+STORE_DIR = os.environ.get("SNAPSHOT_STORE_DIR", os.path.join(BACKUP_DIR, "store"))
+# Chunk boundaries fall between MIN_CHUNK and MAX_CHUNK, a little above
+# AVG_CHUNK on average
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK = 1024 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+READ_BLOCK = 16 * 1024 * 1024  # bytes hashed per NumPy pass
+LEVEL = int(os.environ.get("SNAPSHOT_STORE_LEVEL", "3"))
+# Hashing and (de)compression threads; zlib, zstandard and hashlib release
+# the GIL, so threads use every core without copying chunks between processes
+WORKERS = int(os.environ.get("SNAPSHOT_STORE_WORKERS", "0")) or os.cpu_count() or 1
+# Gear table derived from SHA-256, so boundaries are the same on every host
+GEAR = np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little")
+                 for i in range(256)], dtype=np.uint32)
+# Normalized chunking: a mask with 2 more bits than AVG_CHUNK needs before
+# the average size, one with 2 fewer after it. The top bits of the hash
+# depend on the whole 32-byte window.
+_AVG_BITS = AVG_CHUNK.bit_length() - 1
+MASK_STRICT = np.uint32(((1 << (_AVG_BITS + 2)) - 1) << (32 - _AVG_BITS - 2))
+MASK_LOOSE = np.uint32(((1 << (_AVG_BITS - 2)) - 1) << (32 - _AVG_BITS + 2))
+CHUNK_HEADER = struct.Struct(">cI")  # codec, raw size
+
+
+def log(message):
+    # stdout carries the data of "get"
+    print(f"[snapshot-store] {message}", file=sys.stderr, flush=True)
+
+
+def _mb(n):
+    return f"{n / 1048576:.1f} MB"
+
+
+def _gear_hash(data):
+    """Gear rolling hash (32-byte window) at every position of data.
+
+    h[i] = sum(GEAR[data[i - k]] << k for k < 32) mod 2**32, computed with
+    log2(32) shifted adds over the whole buffer instead of a loop per byte.
+    """
+    h = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    span = 1
+    while span < 32:
+        h[span:] += h[:-span] << np.uint32(span)
+        span *= 2
+    return h
+
+
+def _cut_points(h, final):
+    """End offsets of the chunks that can be cut from a buffer that starts at
+    a chunk boundary; the rest waits for more data unless final.
+
+    Cuts are only considered MIN_CHUNK (> 32) bytes into a chunk, so every
+    hash that decides one covers bytes of that chunk only.
+    """
+    strict = np.flatnonzero((h & MASK_STRICT) == 0)
+    loose = np.flatnonzero((h & MASK_LOOSE) == 0)
+    n = len(h)
+    cuts = []
+    start = 0
+    while start < n:
+        lo, mid, hi = start + MIN_CHUNK - 1, start + AVG_CHUNK - 1, start + MAX_CHUNK - 1
+        j = np.searchsorted(strict, lo)
+        if j < len(strict) and strict[j] < mid:
+            end = int(strict[j]) + 1
+        elif mid > n and not final:
+            break
+        else:
+            k = np.searchsorted(loose, mid)
+            if k < len(loose) and loose[k] < hi:
+                end = int(loose[k]) + 1
+            elif hi < n:
+                end = start + MAX_CHUNK
+            elif final:
+                end = n
+            else:
+                break
+        cuts.append(end)
+        start = end
+    return cuts
+
+
+def chunks(stream):
+    """Content-defined chunks of a binary stream, as bytes."""
+    buf = bytearray()
+    while True:
+        data = stream.read(READ_BLOCK)
+        final = len(data) < READ_BLOCK
+        buf += data
+        start = 0
+        if buf:
+            for end in _cut_points(_gear_hash(buf), final):
+                yield bytes(buf[start:end])
+                start = end
+        if final:
+            return
+        del buf[:start]
+
+
+def _encode(data):
+    if zstandard is not None:
+        codec, payload = b"s", zstandard.ZstdCompressor(level=LEVEL).compress(data)
+    else:
+        codec, payload = b"z", zlib.compress(data, LEVEL)
+    if len(payload) >= len(data) * 0.97:
+        codec, payload = b"r", data  # incompressible (archives, media)
+    return CHUNK_HEADER.pack(codec, len(data)), payload
+
+
+def _decode(blob):
+    codec, size = CHUNK_HEADER.unpack_from(blob)
+    payload = memoryview(blob)[CHUNK_HEADER.size:]
+    if codec == b"r":
+        return bytes(payload), size
+    if codec == b"z":
+        return zlib.decompress(payload), size
+    if codec == b"s":
+        if zstandard is None:
+            raise RuntimeError("chunk is zstd-compressed but the zstandard module is missing")
+        return zstandard.ZstdDecompressor().decompress(payload, max_output_size=size), size
+    raise ValueError(f"unknown chunk codec {codec!r}")
+
+
+class Store:
+    """Chunks, their index and the snapshot manifests under one directory.
+
+    put and prune take an exclusive lock on the store, get, list and verify
+    a shared one.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+        self.index_path = os.path.join(root, "index")
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        self.index = {}  # sha256 hex -> (size, stored size)
+        self._lock = open(os.path.join(root, "lock"), "a")
+
+    def lock(self, exclusive=False):
+        fcntl.flock(self._lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 3:
+                        self.index[fields[0]] = (int(fields[1]), int(fields[2]))
+        except FileNotFoundError:
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        """Index the chunk files themselves (missing or lost index)."""
+        for digest, path in self._chunk_files():
+            try:
+                with open(path, "rb") as f:
+                    _, size = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                self.index[digest] = (size, os.path.getsize(path))
+            except (OSError, struct.error):
+                continue
+        if self.index:
+            log(f"index rebuilt from {len(self.index)} chunk files")
+        self._write_index()
+
+    def _write_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            for digest, (size, stored) in self.index.items():
+                f.write(f"{digest} {size} {stored}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def _chunk_files(self):
+        for sub in sorted(os.listdir(self.chunks_dir)):
+            subdir = os.path.join(self.chunks_dir, sub)
+            if os.path.isdir(subdir):
+                for name in os.listdir(subdir):
+                    yield name, os.path.join(subdir, name)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _store_chunk(self, data):
+        """Hash a chunk and write it unless the store has it (worker thread).
+
+        Returns (digest, size, stored size, written).
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        known = self.index.get(digest)
+        if known is not None:
+            return digest, len(data), known[1], False
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            # Written by a put that died before updating the index
+            return digest, len(data), os.path.getsize(path), True
+        header, payload = _encode(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return digest, len(data), len(header) + len(payload), True
+
+    def _load_chunk(self, digest, size):
+        """Read, decompress and verify one chunk (worker thread)."""
+        with open(self.chunk_path(digest), "rb") as f:
+            data, stored_size = _decode(f.read())
+        if len(data) != size or stored_size != size or hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+        return data
+
+    def manifest_path(self, name, stream):
+        return os.path.join(self.snapshots_dir, name, f"{stream}.json")
+
+    def manifest(self, name, stream):
+        with open(self.manifest_path(name, stream)) as f:
+            return json.load(f)
+
+    def snapshots(self):
+        """{name: {stream: manifest}}, oldest snapshot first."""
+        found = {}
+        for name in os.listdir(self.snapshots_dir):
+            directory = os.path.join(self.snapshots_dir, name)
+            streams = {}
+            for entry in sorted(os.listdir(directory)) if os.path.isdir(directory) else ():
+                if entry.endswith(".json"):
+                    with open(os.path.join(directory, entry)) as f:
+                        streams[entry[:-5]] = json.load(f)
+            if streams:
+                found[name] = streams
+        return dict(sorted(found.items(), key=lambda item: (
+            min(m["created_at"] for m in item[1].values()), item[0])))
+
+    def put(self, name, stream, source):
+        """Store a stream as snapshot name/stream; returns its manifest."""
+        started = time.monotonic()
+        entries = []
+        size = new_chunks = new_bytes = stored_bytes = 0
+        with ThreadPoolExecutor(WORKERS) as pool, open(self.index_path, "a") as index:
+            pending = collections.deque()
+
+            def collect(future):
+                nonlocal size, new_chunks, new_bytes, stored_bytes
+                digest, chunk_size, stored, written = future.result()
+                entries.append([digest, chunk_size])
+                size += chunk_size
+                if written and digest not in self.index:
+                    self.index[digest] = (chunk_size, stored)
+                    index.write(f"{digest} {chunk_size} {stored}\n")
+                    new_chunks += 1
+                    new_bytes += chunk_size
+                    stored_bytes += stored
+
+            # Chunking runs here while the pool hashes and compresses; at most
+            # two chunks per worker wait, so memory stays bounded
+            for chunk in chunks(source):
+                pending.append(pool.submit(self._store_chunk, chunk))
+                while len(pending) > 2 * WORKERS:
+                    collect(pending.popleft())
+            while pending:
+                collect(pending.popleft())
+            index.flush()
+            os.fsync(index.fileno())
+        seconds = time.monotonic() - started
+        manifest = {
+            "name": name,
+            "stream": stream,
+            "created_at": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+            "size": size,
+            "chunks": entries,
+            "new_chunks": new_chunks,
+            "new_bytes": new_bytes,
+            "stored_bytes": stored_bytes,
+            "seconds": round(seconds, 3),
+        }
+        path = self.manifest_path(name, stream)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        log(f"{name}/{stream}: {_mb(size)} in {len(entries)} chunks, {new_chunks} new "
+            f"({_mb(new_bytes)} -> {_mb(stored_bytes)} stored) in {seconds:.1f}s "
+            f"({size / 1048576 / max(seconds, 0.001):.0f} MB/s)")
+        return manifest
+
+    def get(self, name, stream, out):
+        """Write snapshot name/stream to out, loading chunks ahead of it."""
+        manifest = self.manifest(name, stream)
+        started = time.monotonic()
+        with ThreadPoolExecutor(WORKERS) as pool:
+            pending = collections.deque()
+            for digest, size in manifest["chunks"]:
+                pending.append(pool.submit(self._load_chunk, digest, size))
+                while len(pending) > 2 * WORKERS:
+                    out.write(pending.popleft().result())
+            while pending:
+                out.write(pending.popleft().result())
+        out.flush()
+        seconds = time.monotonic() - started
+        log(f"{name}/{stream}: {_mb(manifest['size'])} restored in {seconds:.1f}s "
+            f"({manifest['size'] / 1048576 / max(seconds, 0.001):.0f} MB/s)")
+
+    def delete(self, name):
+        """Drop a snapshot's manifests; its chunks go at the next prune."""
+        shutil.rmtree(os.path.join(self.snapshots_dir, name), ignore_errors=True)
+
+    def prune(self, keep):
+        """Keep the newest keep snapshots and delete unreferenced chunks;
+        returns the names of the removed snapshots."""
+        snapshots = self.snapshots()
+        removed_names = list(snapshots)[:max(0, len(snapshots) - keep)]
+        for name in removed_names:
+            log(f"removing snapshot {name}")
+            self.delete(name)
+            del snapshots[name]
+        referenced = {digest for streams in snapshots.values()
+                      for manifest in streams.values() for digest, _ in manifest["chunks"]}
+        removed = freed = 0
+        for digest, path in list(self._chunk_files()):
+            if digest not in referenced:
+                freed += os.path.getsize(path)
+                os.unlink(path)
+                removed += 1
+                self.index.pop(digest, None)
+        self.index = {digest: entry for digest, entry in self.index.items() if digest in referenced}
+        self._write_index()
+        log(f"kept {len(snapshots)} snapshots, removed {removed} chunks ({_mb(freed)})")
+        return removed_names
+
+    def verify(self, names=None):
+        """Load every chunk of the given (default: all) snapshots; returns
+        the number of bad chunks, counting a missing snapshot as one."""
+        snapshots = self.snapshots()
+        digests = {}
+        bad = 0
+        for name in names or snapshots:
+            if name not in snapshots:
+                log(f"snapshot {name} not found")
+                bad += 1
+                continue
+            for manifest in snapshots[name].values():
+                digests.update((digest, size) for digest, size in manifest["chunks"])
+        with ThreadPoolExecutor(WORKERS) as pool:
+            futures = {digest: pool.submit(self._load_chunk, digest, size) for digest, size in digests.items()}
+            for digest, future in futures.items():
+                try:
+                    future.result()
+                except (OSError, ValueError, RuntimeError, zlib.error) as e:
+                    log(f"bad chunk {digest}: {e}")
+                    bad += 1
+        log(f"verified {len(digests)} chunks, {bad} bad")
+        return bad
+
+    def usage(self):
+        return sum(stored for _, stored in self.index.values())
+
+
+def cmd_list(store):
+    snapshots = store.snapshots()
+    logical = 0
+    for name, streams in snapshots.items():
+        size = sum(m["size"] for m in streams.values())
+        logical += size
+        added = sum(m["stored_bytes"] for m in streams.values())
+        created = min(m["created_at"] for m in streams.values())
+        print(f"{name}  {created}  {_mb(size):>12}  +{_mb(added):>11} stored  ({', '.join(streams)})")
+    usage = store.usage()
+    print(f"{len(snapshots)} snapshots, {_mb(logical)} logical, {_mb(usage)} on disk "
+          f"in {len(store.index)} chunks")
+
+
+# --- Benchmark on synthetic directory trees ---
+
+WORDS = [w.encode() for w in (
+    "def class return import self if else for while in not and or None True False "
+    "value index count buffer stream chunk write read open close path name data "
+    "config error result test assert print const let function async await yield "
+    "{ } ( ) [ ] = == != < > + - * / # // ; : , . -> => 0 1 2 42 100 0x1f").split()]
+
+
+def _text(rng, size):
+    """Source-like text: compressible but not repetitive."""
+    words = rng.integers(0, len(WORDS), size // 5 + 1)
+    lines = [b" ".join(WORDS[i] for i in words[n:n + 12]) for n in range(0, len(words), 12)]
+    return b"\n".join(lines)[:size]
+
+
+def _make_tree(root, size_mb, files, rng):
+    """Text files, incompressible binaries and a few large database-like files."""
+    total = size_mb * 1048576
+    os.makedirs(root)
+    big = total // 4
+    for i in range(4):
+        pages = bytearray(rng.bytes(big // 4))
+        pages[::2] = bytes(len(pages[::2]))  # half the bytes zero: compressible
+        with open(os.path.join(root, f"db{i}.sqlite"), "wb") as f:
+            f.write(pages)
+    per_file = (total - big) // files
+    for i in range(files):
+        directory = os.path.join(root, f"dir{i % 40:02d}", f"sub{i % 7}")
+        os.makedirs(directory, exist_ok=True)
+        size = max(256, int(rng.lognormal(0, 1) * per_file * 0.6))
+        if i % 4 == 0:
+            data, name = rng.bytes(size), f"blob{i}.bin"
+        else:
+            data, name = _text(rng, size), f"file{i}.py"
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(data)
+
+
+def _mutate(root, percent, rng):
+    """Edit about percent% of the tree: text insertions, overwritten pages,
+    new and deleted files. Returns the number of files touched."""
+    paths = sorted(os.path.join(d, f) for d, _, names in os.walk(root) for f in names)
+    touched = 0
+    for path in paths:
+        if rng.random() * 100 >= percent:
+            continue
+        touched += 1
+        with open(path, "r+b") as f:
+            data = f.read()
+            if path.endswith(".py"):
+                # Insert a line: shifts everything after it
+                at = int(rng.integers(0, len(data) + 1))
+                f.seek(0)
+                f.write(data[:at] + _text(rng, 200) + b"\n" + data[at:])
+            else:
+                for _ in range(max(1, len(data) // 1048576)):
+                    f.seek(int(rng.integers(0, max(1, len(data) - 4096))))
+                    f.write(rng.bytes(4096))
+    for path in paths[:max(1, len(paths) * int(percent) // 200)]:
+        if not path.endswith(".sqlite"):
+            os.unlink(path)
+    with open(os.path.join(root, f"new{int(rng.integers(1 << 30))}.py"), "wb") as f:
+        f.write(_text(rng, 64 * 1024))
+    return touched
+
+
+def _timed(fn):
+    started = time.monotonic()
+    result = fn()
+    return time.monotonic() - started, result
+
+
+def cmd_bench(args):
+    """tar czf of the whole tree each time (what backup.sh does) against a
+    put of an uncompressed tar stream, over an initial and several
+    incremental snapshots; then restore of the last one."""
+    work = tempfile.mkdtemp(prefix="snapshot-bench-", dir=args.dir)
+    rng = np.random.default_rng(args.seed)
+    tree = os.path.join(work, "tree")
+    store = Store(os.path.join(work, "store"))
+    store.lock(exclusive=True)
+    log(f"building a {args.size_mb} MB tree of {args.files} files in {work}")
+    _make_tree(tree, args.size_mb, args.files, rng)
+    rows = []
+    archives = 0
+    try:
+        for run in range(1, args.runs + 1):
+            touched = _mutate(tree, args.change, rng) if run > 1 else 0
+            archive = os.path.join(work, f"archive-{run}.tar.gz")
+            tar_s, _ = _timed(lambda: subprocess.run(["tar", "czf", archive, "-C", tree, "."], check=True))
+            archives += os.path.getsize(archive)
+
+            def put():
+                tar = subprocess.Popen(["tar", "cf", "-", "--sort=name", "-C", tree, "."],
+                                       stdout=subprocess.PIPE)
+                manifest = store.put(f"bench-{run}", "tree", tar.stdout)
+                if tar.wait() != 0:
+                    raise RuntimeError("tar failed")
+                return manifest
+
+            put_s, manifest = _timed(put)
+            rows.append((run, touched, tar_s, os.path.getsize(archive), put_s, manifest["stored_bytes"]))
+        last = os.path.join(work, f"archive-{args.runs}.tar.gz")
+        with open(os.devnull, "wb") as null:
+            gunzip_s, _ = _timed(lambda: subprocess.run(["gzip", "-dc", last], stdout=null, check=True))
+            get_s, _ = _timed(lambda: store.get(f"bench-{args.runs}", "tree", null))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    codec = "zstd" if zstandard is not None else "zlib"
+    print(f"{args.size_mb} MB tree, {args.files} files, {args.change:g}% changed per run, "
+          f"{WORKERS} workers, {codec} level {LEVEL}")
+    print(f"{'run':>4}{'files':>7}{'tar czf s':>11}{'archive MB':>12}{'store s':>9}{'new MB':>9}{'speedup':>9}")
+    for run, touched, tar_s, size, put_s, stored in rows:
+        print(f"{run:>4}{touched:>7}{tar_s:>11.2f}{size / 1048576:>12.1f}{put_s:>9.2f}"
+              f"{stored / 1048576:>9.1f}{tar_s / max(put_s, 0.001):>8.1f}x")
+    print(f"disk for {args.runs} snapshots: archives {_mb(archives)}, store {_mb(store.usage())}")
+    print(f"restore of run {args.runs}: gzip -dc {gunzip_s:.2f}s, get {get_s:.2f}s (verified)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--store", default=STORE_DIR, help="store directory (default %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("put", help="store stdin as a snapshot stream")
+    p.add_argument("name")
+    p.add_argument("stream")
+    p = sub.add_parser("get", help="write a snapshot stream to stdout")
+    p.add_argument("name")
+    p.add_argument("stream")
+    sub.add_parser("list", help="list snapshots and disk usage")
+    p = sub.add_parser("delete", help="drop a snapshot (chunks go at the next prune)")
+    p.add_argument("name")
+    p = sub.add_parser("prune", help="keep the newest snapshots, delete unreferenced chunks, "
+                                      "print the removed snapshots")
+    p.add_argument("--keep", type=int, required=True)
+    p = sub.add_parser("verify", help="check every chunk of the given (default: all) snapshots")
+    p.add_argument("names", nargs="*")
+    p = sub.add_parser("bench", help="compare with tar czf on a synthetic tree")
+    p.add_argument("--size-mb", type=int, default=256)
+    p.add_argument("--files", type=int, default=2000)
+    p.add_argument("--change", type=float, default=2, help="percent of files changed per run")
+    p.add_argument("--runs", type=int, default=4)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--dir", help="scratch directory (default: system temp)")
+    p.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        cmd_bench(args)
+        return
+    store = Store(args.store)
+    store.lock(exclusive=args.command in ("put", "delete", "prune"))
+    try:
+        if args.command == "put":
+            store.put(args.name, args.stream, sys.stdin.buffer)
+        elif args.command == "get":
+            store.get(args.name, args.stream, sys.stdout.buffer)
+        elif args.command == "list":
+            cmd_list(store)
+        elif args.command == "delete":
+            store.delete(args.name)
+        elif args.command == "prune":
+            # snapshot.sh removes the matching snapshot directories
+            for name in store.prune(args.keep):
+                print(name)
+        elif args.command == "verify":
+            sys.exit(1 if store.verify(args.names) else 0)
+    except FileNotFoundError as e:
+        log(f"not found: {e.filename}")
+        sys.exit(1)
+    except (ValueError, RuntimeError, zlib.error) as e:
+        log(f"failed: {e}")
+        sys.exit(1)
+    except BrokenPipeError:
+        log("output closed early")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,12 @@
 # 2. Commit layer (user changes) - backed up each snapshot
 # 3. Volumes (user data) - backed up each snapshot
 #
+# With SNAPSHOT_ENGINE=store, the image and the volumes are streamed into
+# the content-addressed store (snapshot-store.py) instead: only chunks that
+# changed since a stored snapshot take time and disk, so many more
+# snapshots can be kept (MAX_SNAPSHOTS defaults to 30, applied by the
+# store's prune, which also decides which snapshot directories are removed).
+#
 # Usage: snapshot.sh [snapshot_name]
 #   snapshot_name - optional, defaults to snapshot-YYYYMMDD-HHMMSS
 #
@@ -17,7 +23,14 @@ set -e
 BACKUP_DIR="${BACKUP_DIR:-/home/ubuntu/backups}"
 SNAPSHOT_NAME="${1:-snapshot-$(date +%Y%m%d-%H%M%S)}"
 TIMESTAMP=$(date +%Y%m%d-%H%M%S)
-MAX_SNAPSHOTS="${MAX_SNAPSHOTS:-3}"
+SNAPSHOT_ENGINE="${SNAPSHOT_ENGINE:-archive}"
+SNAPSHOT_STORE="python3 /opt/snapshot-store.py"
+source "$(dirname "${BASH_SOURCE[0]}")/backup-volumes.sh"
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    MAX_SNAPSHOTS="${MAX_SNAPSHOTS:-30}"
+else
+    MAX_SNAPSHOTS="${MAX_SNAPSHOTS:-3}"
+fi
 
 # Colors for output
 RED='\033[0;31m'
@@ -42,8 +55,37 @@ info() {
     echo -e "${BLUE}[snapshot]${NC} $1"
 }
 
+if [ "${SNAPSHOT_ENGINE}" = "store" ] && ! python3 -c "import numpy" 2>/dev/null; then
+    warn "snapshot store needs python3-numpy, falling back to archives"
+    SNAPSHOT_ENGINE="archive"
+fi
+
+# Remove what a failed run left behind (set -e exits on the first error)
+SNAPSHOT_DONE=false
+SNAPSHOT_DIR_CREATED=false
+COMMIT_IMAGE_NAME=""
+cleanup() {
+    if [ "${SNAPSHOT_DONE}" = true ]; then
+        return
+    fi
+    error "Snapshot failed, removing partial snapshot ${SNAPSHOT_NAME}"
+    if [ "${SNAPSHOT_DIR_CREATED}" = true ]; then
+        rm -rf "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}"
+    fi
+    if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+        ${SNAPSHOT_STORE} delete "${SNAPSHOT_NAME}" || true
+    fi
+    if [ -n "${COMMIT_IMAGE_NAME}" ]; then
+        docker rmi "${COMMIT_IMAGE_NAME}" >/dev/null 2>&1 || true
+    fi
+}
+trap cleanup EXIT
+
 # Create directories
 mkdir -p "${BACKUP_DIR}/base-images"
+if [ ! -d "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}" ]; then
+    SNAPSHOT_DIR_CREATED=true
+fi
 mkdir -p "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}"
 
 log "Creating snapshot: ${SNAPSHOT_NAME}"
@@ -67,7 +109,13 @@ log "Base image ID: ${BASE_IMAGE_SHORT_ID}"
 
 # Step 2: Backup base image (if not already backed up)
 BASE_IMAGE_PATH="${BACKUP_DIR}/base-images/${BASE_IMAGE_FILE}"
-if [ ! -f "${BASE_IMAGE_PATH}" ]; then
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    # docker save of the commit includes the base layers; the store keeps
+    # them once across all snapshots
+    BASE_IMAGE_FILE=""
+    BASE_IMAGE_SIZE="in store"
+    log "Base image layers are deduplicated in the snapshot store"
+elif [ ! -f "${BASE_IMAGE_PATH}" ]; then
     log "Backing up base image: ${BASE_IMAGE} (${BASE_IMAGE_SHORT_ID})"
     docker save "${BASE_IMAGE}" | gzip > "${BASE_IMAGE_PATH}"
 
@@ -98,9 +146,16 @@ log "Container committed as: ${COMMIT_IMAGE_NAME}"
 # Step 4: Export commit layer (only new layers, not base image)
 log "Exporting commit layer..."
 LAYER_TAR="${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}/layer.tar.gz"
-docker save "${COMMIT_IMAGE_NAME}" | gzip > "${LAYER_TAR}"
-
-if [ -f "${LAYER_TAR}" ]; then
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    LAYER_TAR="store:${SNAPSHOT_NAME}/layer"
+    docker save "${COMMIT_IMAGE_NAME}" | ${SNAPSHOT_STORE} put "${SNAPSHOT_NAME}" layer
+    if [ "${PIPESTATUS[0]}" -ne 0 ]; then
+        error "Failed to export commit layer"
+        exit 1
+    fi
+    LAYER_SIZE="in store"
+    log "Commit layer stored: ${LAYER_TAR}"
+elif [ -f "${LAYER_TAR}" ]; then
     LAYER_SIZE=$(du -h "${LAYER_TAR}" | cut -f1)
     log "Commit layer exported: ${LAYER_TAR} (${LAYER_SIZE})"
 else
@@ -111,7 +166,24 @@ fi
 # Step 5: Backup volumes
 log "Backing up volumes..."
 VOLUMES_BACKUP_NAME="volumes-${TIMESTAMP}"
-if bash /opt/backup.sh "${VOLUMES_BACKUP_NAME}"; then
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    # Uncompressed tar in name order, so unchanged files line up with the
+    # previous snapshot's chunks
+    VOLUMES_BACKUP_NAME="store:${SNAPSHOT_NAME}/volumes"
+    VOLUMES_TAR=""
+    VOLUMES_METADATA=""
+    volume_mounts /backup
+    docker run --rm \
+        "${VOLUME_MOUNTS[@]}" \
+        ubuntu:22.04 \
+        tar cf - --sort=name -C /backup . | ${SNAPSHOT_STORE} put "${SNAPSHOT_NAME}" volumes
+    if [ "${PIPESTATUS[0]}" -ne 0 ]; then
+        error "Failed to backup volumes"
+        exit 1
+    fi
+    VOLUMES_SIZE="in store"
+    log "Volumes stored: ${VOLUMES_BACKUP_NAME}"
+elif bash /opt/backup.sh "${VOLUMES_BACKUP_NAME}"; then
     VOLUMES_TAR="${BACKUP_DIR}/${VOLUMES_BACKUP_NAME}.tar.gz"
     VOLUMES_METADATA="${BACKUP_DIR}/${VOLUMES_BACKUP_NAME}.json"
 
@@ -133,6 +205,7 @@ cat > "${METADATA_FILE}" << EOF
 {
   "name": "${SNAPSHOT_NAME}",
   "timestamp": "${TIMESTAMP}",
+  "engine": "${SNAPSHOT_ENGINE}",
   "created_at": "$(date -Iseconds)",
   "base_image": {
     "id": "${BASE_IMAGE_ID}",
@@ -153,16 +226,28 @@ cat > "${METADATA_FILE}" << EOF
 EOF
 
 log "Snapshot metadata saved: ${METADATA_FILE}"
+SNAPSHOT_DONE=true
 
 # Step 7: Create symlink to volumes backup
-ln -sf "${VOLUMES_TAR}" "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}/volumes.tar.gz"
-ln -sf "${VOLUMES_METADATA}" "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}/volumes-metadata.json"
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    STORE_SIZE=$(${SNAPSHOT_STORE} list | tail -n 1)
+else
+    ln -sf "${VOLUMES_TAR}" "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}/volumes.tar.gz"
+    ln -sf "${VOLUMES_METADATA}" "${BACKUP_DIR}/snapshots/${SNAPSHOT_NAME}/volumes-metadata.json"
+fi
 
 # Step 8: Clean up old snapshots
 log "Cleaning up old snapshots (keeping last ${MAX_SNAPSHOTS})..."
 SNAPSHOT_COUNT=$(find "${BACKUP_DIR}/snapshots" -mindepth 1 -maxdepth 1 -type d -name "snapshot-*" | wc -l)
 
-if [ "$SNAPSHOT_COUNT" -gt "$MAX_SNAPSHOTS" ]; then
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    # The store decides which snapshots are kept (and drops chunks no kept
+    # snapshot references); it prints the names it removed
+    ${SNAPSHOT_STORE} prune --keep "${MAX_SNAPSHOTS}" | while read -r old_snapshot; do
+        log "Removing old snapshot: ${BACKUP_DIR}/snapshots/${old_snapshot}"
+        rm -rf "${BACKUP_DIR}/snapshots/${old_snapshot}"
+    done
+elif [ "$SNAPSHOT_COUNT" -gt "$MAX_SNAPSHOTS" ]; then
     find "${BACKUP_DIR}/snapshots" -mindepth 1 -maxdepth 1 -type d -name "snapshot-*" \
         -printf "%T@ %p\n" | \
         sort -n | \
@@ -192,7 +277,11 @@ log "Metadata: ${METADATA_FILE}"
 info "Base image: ${BASE_IMAGE_SIZE}"
 info "Commit layer: ${LAYER_SIZE}"
 info "Volumes: ${VOLUMES_SIZE}"
-info "Total storage: ${BASE_IMAGE_SIZE} (base) + ${LAYER_SIZE} (layer) + ${VOLUMES_SIZE} (volumes)"
+if [ "${SNAPSHOT_ENGINE}" = "store" ]; then
+    info "Snapshot store: ${STORE_SIZE}"
+else
+    info "Total storage: ${BASE_IMAGE_SIZE} (base) + ${LAYER_SIZE} (layer) + ${VOLUMES_SIZE} (volumes)"
+fi
 
 # List all available snapshots
 log "Available snapshots:"